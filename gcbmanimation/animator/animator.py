@@ -1,9 +1,11 @@
 import os
 import imageio
 import logging
+from collections import defaultdict
 from gcbmanimation.animator.layout.quadrantlayout import QuadrantLayout
 from gcbmanimation.animator.legend import Legend
-from gcbmanimation.util.tempfile import TempFileManager
+from gcbmanimation.animator.framestore import FrameStore
+from gcbmanimation.util.profiler import Profiler
 
 class Animator:
     '''
@@ -24,7 +26,8 @@ class Animator:
         self._indicators = indicators
         self._output_path = output_path
 
-    def render(self, bounding_box=None, start_year=None, end_year=None, fps=1, include_single_views=False):
+    def render(self, bounding_box=None, start_year=None, end_year=None, fps=1, include_single_views=False,
+               incremental=False, disturbance_frames=None, legends=None):
         '''
         Renders a set of animations, one for each Indicator in this animator.
 
@@ -40,17 +43,29 @@ class Animator:
         'include_single_views' -- include animations for each result view (graph,
             map, disturbances) separately in addition to the standard 4-quadrant
             layout.
+        'incremental' -- keep the processed layers and rendered frames in the output
+            directory, and on later runs only process the years whose spatial
+            output has changed, i.e. newly appended simulation years, and only
+            recolor the rest if the legend has changed.
+        'disturbance_frames' -- optional disturbance frames and legend already
+            rendered for the same bounding box and years, as returned by
+            LayerCollection.render, i.e. shared by several animators.
+        'legends' -- optional dictionary of indicator title to the legend to color
+            its map with, i.e. a legend shared with other animators; see
+            LayerCollection.create_common_legend.
         '''
         os.makedirs(self._output_path, exist_ok=True)
+        with Profiler.stage("prefetch_results"):
+            self._prefetch_results()
 
         layout = QuadrantLayout((50, 60), (50, 60), (50, 40), (50, 40))
-        disturbance_frames = None
-        disturbance_legend = None
+        disturbance_frames, disturbance_legend = disturbance_frames or (None, None)
+        legends = legends or {}
         for indicator in self._indicators:
             logging.info(f"Rendering animation: {indicator.title}")
 
             graph_frames = indicator.render_graph_frames(
-                bounding_box=bounding_box, start_year=start_year, end_year=end_year)
+                bounding_box=bounding_box, start_year=start_year, end_year=end_year, incremental=incremental)
 
             if not start_year or not end_year:
                 start_year = min((frame.year for frame in graph_frames))
@@ -58,11 +73,14 @@ class Animator:
 
             indicator_legend_title = f"{indicator.indicator} ({indicator.map_units.value[2]})"
             indicator_frames, indicator_legend = indicator.render_map_frames(
-                bounding_box, start_year, end_year)
+                bounding_box, start_year, end_year,
+                self._get_frame_store(indicator.title) if incremental else None,
+                legends.get(indicator.title))
 
             if not disturbance_frames:
                 disturbance_frames, disturbance_legend = self._disturbances.render(
-                    bounding_box, start_year, end_year)
+                    bounding_box, start_year, end_year,
+                    frame_store=self._get_frame_store("Disturbances") if incremental else None)
 
             if include_single_views:
                 self._render_single_view(f"{indicator.title} (graph view)", graph_frames,
@@ -89,10 +107,27 @@ class Animator:
 
             self._create_animation(indicator.title, animation_frames, fps)
 
+            # The indicator's temporary files are deleted once nothing refers to
+            # them any more; see TempFileManager.track.
+            indicator.release_layers()
+
         if include_single_views:
             self._render_single_view("Disturbances", disturbance_frames, start_year, end_year,
                                      disturbance_legend, "Disturbances", fps=fps)
 
+    def _prefetch_results(self):
+        # Give each results provider the chance to load all of its indicators at once.
+        provider_queries = defaultdict(list)
+        for indicator in self._indicators:
+            if indicator.results_provider:
+                provider_queries[indicator.results_provider].append(indicator.provider_filter)
+
+        for provider, queries in provider_queries.items():
+            provider.prefetch(queries)
+
+    def _get_frame_store(self, name):
+        return FrameStore(os.path.join(self._output_path, ".frames", name.replace(os.sep, "_")))
+
     def _render_single_view(self, title, frames, start_year, end_year,
                             legend=None, legend_title=None, scalebar=True, fps=1):
 
@@ -113,12 +148,11 @@ class Animator:
         self._create_animation(title, animation_frames, fps)
 
     def _create_animation(self, title, frames, fps=1):
-        video_frames = [imageio.imread(frame.path) for frame in frames]
-        video_frames.append(video_frames[-1]) # Duplicate the last frame to display longer.
-        imageio.mimsave(os.path.join(self._output_path, f"{title}.wmv"), video_frames,
-                        fps=fps, ffmpeg_log_level="fatal", quality=8)
-
-        TempFileManager.cleanup("*.tif")
+        with Profiler.stage("encode"):
+            video_frames = [imageio.imread(frame.path) for frame in frames]
+            video_frames.append(video_frames[-1]) # Duplicate the last frame to display longer.
+            imageio.mimsave(os.path.join(self._output_path, f"{title}.wmv"), video_frames,
+                            fps=fps, ffmpeg_log_level="fatal", quality=8)
 
     def _find_frame(self, frame_collection, year, default=None):
         return next(filter(lambda frame: frame.year == year, frame_collection), None)
@@ -0,0 +1,99 @@
+import os
+import gdal
+import logging
+from collections import defaultdict
+from gcbmanimation.animator.animator import Animator
+from gcbmanimation.animator.framestore import FrameStore
+from gcbmanimation.layer.layercollection import LayerCollection
+from gcbmanimation.util.resourcegovernor import ResourceGovernor
+
+class BatchAnimator:
+    '''
+    Creates animations for many GCBM runs - i.e. the scenarios of a study - that
+    share a study area. The work the runs have in common is only done once: the
+    bounding box is prepared and the disturbances are rendered a single time, and
+    every run is processed by the same worker pool. Each run's animations are
+    created in a subdirectory of the output path named after the run.
+
+    Arguments:
+    'disturbances' -- a LayerCollection of the input disturbance layers shared by
+        the runs.
+    'runs' -- a dictionary of run name to the list of Indicator objects to
+        animate for the run.
+    'output_path' -- the directory to generate the runs' output directories in.
+    '''
+
+    def __init__(self, disturbances, runs, output_path="."):
+        self._disturbances = disturbances
+        self._runs = runs
+        self._output_path = output_path
+
+    def render(self, bounding_box, start_year=None, end_year=None, fps=1, include_single_views=False,
+               incremental=False, common_legend=False):
+        '''
+        Renders a set of animations for each run.
+
+        Arguments:
+        'bounding_box' -- a BoundingBox shared by the runs: disturbance and spatial
+            output layers will be cropped to its minimum spatial extent and nodata
+            pixels.
+        'start_year' -- the year to render from - if not provided, will be detected
+            from the runs' indicators.
+        'end_year' -- the year to render to - if not provided, will be detected
+            from the runs' indicators.
+        'fps' -- the framerate to use for the output animations - default 1.
+        'include_single_views' -- include animations for each result view (graph,
+            map, disturbances) separately in addition to the standard 4-quadrant
+            layout.
+        'incremental' -- keep the processed layers and rendered frames in the output
+            directories, and on later runs only process what has changed; see
+            Animator.render.
+        'common_legend' -- color each indicator's maps with a single legend
+            created from every run's output, so that the runs' animations can be
+            compared side by side.
+        '''
+        os.makedirs(self._output_path, exist_ok=True)
+        reference_raster = gdal.Open(bounding_box.path)
+        with ResourceGovernor.shared_pool(reference_raster.RasterXSize * reference_raster.RasterYSize):
+            bounding_box.prepare()
+
+            if not start_year or not end_year:
+                start_year, end_year = self._find_year_range()
+
+            logging.info("Rendering disturbances")
+            disturbance_frames = self._disturbances.render(
+                bounding_box, start_year, end_year,
+                frame_store=self._get_frame_store("Disturbances") if incremental else None)
+
+            # A common legend is created from every run's processed layers; each
+            # run's layers are then kept until the run has been animated.
+            legends = self._create_common_legends(bounding_box, start_year, end_year) if common_legend else None
+            for name, indicators in self._runs.items():
+                logging.info(f"Rendering run: {name}")
+                animator = Animator(self._disturbances, indicators, os.path.join(self._output_path, name))
+                animator.render(bounding_box, start_year, end_year, fps, include_single_views, incremental,
+                                disturbance_frames, legends)
+
+    def _find_year_range(self):
+        # Every run is animated over the same years so that they line up.
+        year_ranges = [indicator.simulation_years for indicators in self._runs.values() for indicator in indicators]
+
+        return min(start_year for start_year, _ in year_ranges), max(end_year for _, end_year in year_ranges)
+
+    def _create_common_legends(self, bounding_box, start_year, end_year):
+        indicators_by_title = defaultdict(list)
+        for indicators in self._runs.values():
+            for indicator in indicators:
+                indicators_by_title[indicator.title].append(indicator)
+
+        legends = {}
+        for title, indicators in indicators_by_title.items():
+            logging.info(f"Creating common legend: {title}")
+            collections = [indicator.get_map_layers(bounding_box) for indicator in indicators]
+            legends[title] = LayerCollection.create_common_legend(
+                collections, bounding_box, start_year, end_year, indicators[0].map_units)
+
+        return legends
+
+    def _get_frame_store(self, name):
+        return FrameStore(os.path.join(self._output_path, ".frames", name.replace(os.sep, "_")))
@@ -1,5 +1,6 @@
 from PIL import Image
 from gcbmanimation.util.tempfile import TempFileManager
+from gcbmanimation.util.profiler import Profiler
 Image.MAX_IMAGE_PIXELS = None
 
 class Frame:
@@ -16,6 +17,11 @@ class Frame:
         self._year = year
         self._path = path
         self._scale = scale
+        TempFileManager.track(self, path)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        TempFileManager.track(self, self._path)
 
     @property
     def year(self):
@@ -52,13 +58,14 @@ class Frame:
         Returns the merged image as a new Frame with the same year as this one.
         '''
         out_path = TempFileManager.mktmp(suffix=".png")
-        this_image = Image.open(self._path)
-        other_image = Image.open(frame.path)
+        with Profiler.stage("composite", self._year):
+            this_image = Image.open(self._path)
+            other_image = Image.open(frame.path)
 
-        if send_to_bottom:
-            Image.alpha_composite(other_image, this_image).save(out_path)
-        else:
-            Image.alpha_composite(this_image, other_image).save(out_path)
+            if send_to_bottom:
+                Image.alpha_composite(other_image, this_image).save(out_path)
+            else:
+                Image.alpha_composite(this_image, other_image).save(out_path)
 
         return Frame(self._year, out_path, self._scale)
 
@@ -89,6 +96,35 @@ class Frame:
 
         return Frame(self._year, out_path, scale=None)
 
+    def merge_vertical(self, *frames):
+        '''
+        Merges one or more Frames vertically below this one, i.e. to stitch the
+        tiles of a map back together. Transparent pixels stay transparent.
+
+        Arguments:
+        'frames' -- one or more Frames to merge vertically.
+
+        Returns the merged image as a new Frame with the same year and scale as
+        this one.
+        '''
+        images = [Image.open(self._path)] + [Image.open(frame.path) for frame in frames]
+        widths, heights = zip(*(image.size for image in images))
+
+        max_width = max(widths)
+        total_height = sum(heights)
+
+        merged_image = Image.new("RGBA", (max_width, total_height), color=(255, 255, 255, 0))
+
+        y_offset = 0
+        for image in images:
+            merged_image.paste(image, (0, y_offset))
+            y_offset += image.size[1]
+
+        out_path = TempFileManager.mktmp(suffix=".png")
+        merged_image.save(out_path)
+
+        return Frame(self._year, out_path, self._scale)
+
     def resize(self, max_width, max_height):
         '''
         Resizes the image as closely as possible to the specified width and height
@@ -0,0 +1,157 @@
+import os
+import json
+import shutil
+import logging
+import gdal
+from tempfile import NamedTemporaryFile
+from gcbmanimation.util.config import IOProfile
+
+class FrameStore:
+    '''
+    Persistent store of the processed layers and rendered frames for one
+    LayerCollection, so that an animation can be updated incrementally. Each year's
+    processed (cropped, converted, reclassified and merged) layer is recorded
+    along with a key describing the inputs it was made from, and each year's
+    rendered frame along with a key describing the legend it was colored with:
+    years whose inputs are unchanged don't need to be processed again, and only
+    need to be recolored if the legend has changed.
+
+    Arguments:
+    'path' -- the directory to keep the stored layers, frames, and manifest in.
+    '''
+
+    def __init__(self, path):
+        self._path = path
+        self._manifest_path = os.path.join(path, "manifest.json")
+        self._manifest = self._load()
+
+    @property
+    def value_scale(self):
+        '''
+        The factor that the stored layers' pixel values need to be scaled by to be
+        in the rendered units; see LayerCollection.render.
+        '''
+        return self._manifest.get("value_scale")
+
+    @value_scale.setter
+    def value_scale(self, value):
+        self._manifest["value_scale"] = value
+
+    def get_layer(self, year, input_key):
+        '''
+        Gets the stored processed layer for a year if it was made from the same
+        inputs.
+
+        Arguments:
+        'year' -- the year to get the processed layer for.
+        'input_key' -- key describing the inputs the layer should be made from.
+
+        Returns the path to the stored layer, the name of its units, and its
+        interpretation (or None if it isn't interpreted), or None if there is no
+        up-to-date layer for the year.
+        '''
+        entry = self._manifest["years"].get(str(year))
+        if not entry or entry["inputs"] != input_key:
+            return None
+
+        path = os.path.join(self._path, entry["layer"])
+        if not os.path.exists(path):
+            return None
+
+        # JSON only has string keys, so the interpretation is kept as pairs.
+        interpretation = entry.get("interpretation")
+        if interpretation:
+            interpretation = {int(pixel_value): value for pixel_value, value in interpretation}
+
+        return path, entry["units"], interpretation
+
+    def put_layer(self, year, input_key, path, units_name, interpretation=None):
+        '''
+        Stores a year's processed layer, replacing any stored layer and frame for
+        that year.
+
+        Arguments:
+        'year' -- the year the layer is for.
+        'input_key' -- key describing the inputs the layer was made from.
+        'path' -- path to the processed layer.
+        'units_name' -- the name of the layer's units.
+        'interpretation' -- optional interpretation of the layer's pixel values.
+        '''
+        os.makedirs(self._path, exist_ok=True)
+
+        # Layers that aren't rasters, i.e. sparse layers, are stored as they are.
+        if gdal.IdentifyDriver(path) is None:
+            stored_name = f"{year}{os.path.splitext(path)[1]}"
+            shutil.copyfile(path, os.path.join(self._path, stored_name))
+        else:
+            stored_name = f"{year}.tif"
+            gdal.Translate(os.path.join(self._path, stored_name), path,
+                           creationOptions=IOProfile.Compressed.creation_options)
+
+        self._manifest["years"][str(year)] = {
+            "inputs": input_key,
+            "layer": stored_name,
+            "units": units_name,
+            "interpretation": sorted(interpretation.items()) if interpretation else None
+        }
+
+    def get_frame(self, year, legend_key):
+        '''
+        Gets the stored rendered frame for a year if it was colored with the same
+        legend as the current one and its processed layer is up to date.
+
+        Arguments:
+        'year' -- the year to get the rendered frame for.
+        'legend_key' -- key describing the legend the frame should be colored with.
+
+        Returns the path to the stored frame and its scale, or None if there is no
+        up-to-date frame for the year.
+        '''
+        entry = self._manifest["years"].get(str(year))
+        if not entry or entry.get("legend") != legend_key:
+            return None
+
+        path = os.path.join(self._path, entry["frame"])
+        if not os.path.exists(path):
+            return None
+
+        return path, entry["scale"]
+
+    def put_frame(self, year, legend_key, path, scale):
+        '''
+        Stores a year's rendered frame; the year's processed layer must already
+        be stored.
+
+        Arguments:
+        'year' -- the year the frame is for.
+        'legend_key' -- key describing the legend the frame was colored with.
+        'path' -- path to the rendered frame.
+        'scale' -- the scale of the frame in metres per pixel.
+        '''
+        stored_name = f"{year}.png"
+        shutil.copyfile(path, os.path.join(self._path, stored_name))
+        self._manifest["years"][str(year)].update({
+            "legend": legend_key,
+            "frame": stored_name,
+            "scale": scale
+        })
+
+    def save(self):
+        '''Writes the manifest to disk.'''
+        try:
+            os.makedirs(self._path, exist_ok=True)
+            with NamedTemporaryFile("w", dir=self._path, delete=False) as tmp_file:
+                json.dump(self._manifest, tmp_file, indent=4)
+
+            os.replace(tmp_file.name, self._manifest_path)
+        except OSError as e:
+            logging.warning(f"Unable to save frame manifest {self._manifest_path}: {e}")
+
+    def _load(self):
+        if os.path.exists(self._manifest_path):
+            try:
+                return json.load(open(self._manifest_path, "r"))
+            except (OSError, ValueError):
+                logging.warning(f"Ignoring unreadable frame manifest: {self._manifest_path}")
+
+        return {"value_scale": None, "years": {}}
@@ -3,6 +3,7 @@ from PIL import ImageFont
 from PIL import ImageDraw
 from gcbmanimation.animator.frame import Frame
 from gcbmanimation.util.tempfile import TempFileManager
+from gcbmanimation.util.profiler import Profiler
 Image.MAX_IMAGE_PIXELS = None
 
 class Quadrant:
@@ -59,68 +60,69 @@ class QuadrantLayout:
 
         Returns the combined image as a new Frame for the same year as q1_frame.
         '''
-        width, height = dimensions or (640, 480)
-        x_margin = int(width * self._margin // 2)
-        y_margin = int(height * self._margin // 2)
-
-        canvas_width = int(width * (1 - self._margin * 1.5))
-        canvas_height = int(height * (1 - self._margin * 1.5))
-        canvas_x_min = x_margin
-        canvas_x_max = width - x_margin
-        canvas_y_min = y_margin
-        canvas_y_max = height - y_margin
-
-        image = Image.new("RGBA", dimensions, (255, 255, 255, 255))
-
-        if title:
-            title_font = self._find_optimal_font_size(title, canvas_width, int(height * 0.05))
-            title_w, title_h = title_font.getsize(title)
-            true_title_height = int(title_h) + int(height * 0.01)
+        with Profiler.stage("layout", q1_frame.year):
+            width, height = dimensions or (640, 480)
+            x_margin = int(width * self._margin // 2)
+            y_margin = int(height * self._margin // 2)
+
+            canvas_width = int(width * (1 - self._margin * 1.5))
+            canvas_height = int(height * (1 - self._margin * 1.5))
+            canvas_x_min = x_margin
+            canvas_x_max = width - x_margin
+            canvas_y_min = y_margin
+            canvas_y_max = height - y_margin
+
+            image = Image.new("RGBA", dimensions, (255, 255, 255, 255))
+
+            if title:
+                title_font = self._find_optimal_font_size(title, canvas_width, int(height * 0.05))
+                title_w, title_h = title_font.getsize(title)
+                true_title_height = int(title_h) + int(height * 0.01)
             
-            title_x = width // 2 - title_w // 2
-            title_y = canvas_y_min
-            ImageDraw.Draw(image).text((title_x, title_y), title, (0, 0, 0), font=title_font)
-
-            canvas_height -= true_title_height
-            canvas_y_min += true_title_height
-
-        quadrants = [
-            Quadrant(canvas_x_min,
-                     canvas_y_min,
-                     int(self._q1_pct[0] / 100 * canvas_width),
-                     int(self._q1_pct[1] / 100 * canvas_height),
-                     q1_label, self._q1_scalebar),
-            Quadrant(int(canvas_x_max - self._q2_pct[0] / 100 * canvas_width),
-                     canvas_y_min,
-                     int(self._q2_pct[0] / 100 * canvas_width),
-                     int(self._q2_pct[1] / 100 * canvas_height),
-                     q2_label, self._q2_scalebar),
-            Quadrant(canvas_x_min,
-                     int(canvas_y_max - self._q3_pct[1] / 100 * canvas_height + y_margin // 4),
-                     int(self._q3_pct[0] / 100 * canvas_width),
-                     int(self._q3_pct[1] / 100 * canvas_height),
-                     q3_label, self._q3_scalebar),
-            Quadrant(int(canvas_x_max - self._q4_pct[0] / 100 * canvas_width),
-                     int(canvas_y_max - self._q4_pct[1] / 100 * canvas_height + y_margin // 4),
-                     int(self._q4_pct[0] / 100 * canvas_width),
-                     int(self._q4_pct[1] / 100 * canvas_height),
-                     q4_label, self._q4_scalebar)]
-
-        quadrant_label_font = None
-        all_labels = [label for label in (q1_label, q2_label, q3_label, q4_label) if label]
-        if all_labels:
-            longest_label = sorted(all_labels, key=len, reverse=True)[0]
-            quadrant_label_font = self._find_optimal_font_size(
-                longest_label, canvas_width // 4, int(canvas_height * self._margin))
-
-        for i, frame in enumerate((q1_frame, q2_frame, q3_frame, q4_frame)):
-            if frame:
-                self._render_quadrant(image, quadrants[i], frame, quadrant_label_font)
-
-        out_path = TempFileManager.mktmp(suffix=".png")
-        image.save(out_path)
-
-        return Frame(q1_frame.year, out_path)
+                title_x = width // 2 - title_w // 2
+                title_y = canvas_y_min
+                ImageDraw.Draw(image).text((title_x, title_y), title, (0, 0, 0), font=title_font)
+
+                canvas_height -= true_title_height
+                canvas_y_min += true_title_height
+
+            quadrants = [
+                Quadrant(canvas_x_min,
+                         canvas_y_min,
+                         int(self._q1_pct[0] / 100 * canvas_width),
+                         int(self._q1_pct[1] / 100 * canvas_height),
+                         q1_label, self._q1_scalebar),
+                Quadrant(int(canvas_x_max - self._q2_pct[0] / 100 * canvas_width),
+                         canvas_y_min,
+                         int(self._q2_pct[0] / 100 * canvas_width),
+                         int(self._q2_pct[1] / 100 * canvas_height),
+                         q2_label, self._q2_scalebar),
+                Quadrant(canvas_x_min,
+                         int(canvas_y_max - self._q3_pct[1] / 100 * canvas_height + y_margin // 4),
+                         int(self._q3_pct[0] / 100 * canvas_width),
+                         int(self._q3_pct[1] / 100 * canvas_height),
+                         q3_label, self._q3_scalebar),
+                Quadrant(int(canvas_x_max - self._q4_pct[0] / 100 * canvas_width),
+                         int(canvas_y_max - self._q4_pct[1] / 100 * canvas_height + y_margin // 4),
+                         int(self._q4_pct[0] / 100 * canvas_width),
+                         int(self._q4_pct[1] / 100 * canvas_height),
+                         q4_label, self._q4_scalebar)]
+
+            quadrant_label_font = None
+            all_labels = [label for label in (q1_label, q2_label, q3_label, q4_label) if label]
+            if all_labels:
+                longest_label = sorted(all_labels, key=len, reverse=True)[0]
+                quadrant_label_font = self._find_optimal_font_size(
+                    longest_label, canvas_width // 4, int(canvas_height * self._margin))
+
+            for i, frame in enumerate((q1_frame, q2_frame, q3_frame, q4_frame)):
+                if frame:
+                    self._render_quadrant(image, quadrants[i], frame, quadrant_label_font)
+
+            out_path = TempFileManager.mktmp(suffix=".png")
+            image.save(out_path)
+
+            return Frame(q1_frame.year, out_path)
     
     def _render_quadrant(self, base_image, quadrant, frame, font):
         true_title_height = 0
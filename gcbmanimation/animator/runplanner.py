@@ -0,0 +1,327 @@
+import json
+import shutil
+import logging
+import gdal
+import osr
+from collections import OrderedDict
+from collections import defaultdict
+from tempfile import gettempdir
+from gcbmanimation.indicator.compositeindicator import CompositeIndicator
+from gcbmanimation.indicator.formulaindicator import FormulaIndicator
+from gcbmanimation.util.resourcegovernor import ResourceGovernor
+from gcbmanimation.util.spatialoutputcatalog import SpatialOutputCatalog
+
+class RunPlanner:
+    '''
+    Estimates the work an animation run will do and the resources it needs -
+    runtime, peak memory per pool worker, and temporary disk space - from the
+    study area, the indicator configuration and the catalogued raster metadata,
+    without reading any pixels. Runtime estimates use built-in rates unless
+    calibrated with results from the benchmark suite on the same machine.
+
+    Arguments:
+    'calibration_path' -- optional path to benchmark results saved by
+        gcbmanimation.benchmark.hotpaths.
+    '''
+
+    # Operation name to the working memory and temporary disk space it needs per
+    # pixel (in bytes), the default time it takes per megapixel (in seconds), and
+    # whether it runs in the worker pool.
+    _operations = OrderedDict((
+        ("prepare_bounding_box", (8, 4, 0.05, False)),
+        ("crop",                 (8, 4, 0.05, True)),
+        ("convert_units",        (16, 4, 0.08, True)),
+        ("crop_blend",           (16, 4, 0.1, True)),
+        ("formula",              (16, 4, 0.1, True)),
+        ("reclassify",           (12, 1, 0.03, True)),
+        ("merge",                (4, 1, 0.03, True)),
+        ("flatten",              (8, 1, 0.03, False)),
+        ("legend",               (8, 0, 0.02, False)),
+        ("render",               (12, 1, 0.15, True)),
+        ("plot",                 (12, 1, 0.1, False)),
+        ("layout",               (16, 1, 0.2, False)),
+        ("encode",               (3, 0, 0.04, False))
+    ))
+
+    # Sizes of the rendered graph and layout frames.
+    _plot_pixels = 3000 * 1500
+    _layout_pixels = 3840 * 2160
+
+    def __init__(self, calibration_path=None):
+        self._rates = {operation: rate for operation, (_, _, rate, _) in self._operations.items()}
+        self._calibrated = False
+        if calibration_path:
+            self._calibrate(calibration_path)
+
+    @property
+    def calibrated(self):
+        '''Whether the runtime estimates are calibrated from benchmark results.'''
+        return self._calibrated
+
+    def plan(self, bounding_box_path, disturbances, indicators, include_single_views=False):
+        '''
+        Plans a run of Animator.render.
+
+        Arguments:
+        'bounding_box_path' -- path to the bounding box raster.
+        'disturbances' -- the LayerCollection of disturbance layers.
+        'indicators' -- the list of Indicator objects to animate.
+        'include_single_views' -- whether the run also renders the separate
+            graph, map and disturbance animations.
+
+        Returns a list of planned operations, each a dictionary of the operation
+        name, its target (indicator or disturbances), the number of times it runs,
+        the pixels it processes each time, the peak memory of one run of it, the
+        total temporary disk space it uses, the total time it takes, and whether
+        it runs in the worker pool.
+        '''
+        bounding_box = gdal.Open(bounding_box_path)
+        bounding_box_pixels = bounding_box.RasterXSize * bounding_box.RasterYSize
+        projected = bool(osr.SpatialReference(bounding_box.GetProjection()).IsProjected())
+
+        operations = []
+        def add(operation, target, count, pixels, memory=None):
+            if not count:
+                return
+
+            memory_per_pixel, temp_per_pixel, _, parallel = self._operations[operation]
+            operations.append({
+                "operation": operation,
+                "target": target,
+                "count": count,
+                "pixels": pixels,
+                "memory": memory or pixels * memory_per_pixel,
+                "temp_bytes": count * pixels * temp_per_pixel,
+                "seconds": count * pixels / 1e6 * self._rates[operation],
+                "parallel": parallel
+            })
+
+        def add_each(operation, target, pixel_counts):
+            # Runs of an operation on rasters of different sizes, i.e. cropping
+            # each year's output, are planned together so that they're costed as
+            # spread over the pool rather than one after another.
+            if not pixel_counts:
+                return
+
+            memory_per_pixel, *_ = self._operations[operation]
+            add(operation, target, len(pixel_counts), sum(pixel_counts) // len(pixel_counts),
+                max(pixel_counts) * memory_per_pixel)
+
+        # The bounding box is warped twice when it's prepared.
+        add("prepare_bounding_box", "bounding box", 2, bounding_box_pixels)
+
+        start_year = end_year = None
+        for indicator in indicators:
+            spatial_output = [
+                (SpatialOutputCatalog.find(pattern), units)
+                for pattern, units in indicator.spatial_output_patterns]
+
+            years = sorted({year for files, _ in spatial_output for _, year in files if year})
+            if not years:
+                logging.warning(f"No spatial output found for {indicator.title}")
+                continue
+
+            if start_year is None:
+                start_year, end_year = years[0], years[-1]
+
+            years = [year for year in years if start_year <= year <= end_year]
+
+            title = indicator.title
+            frames = end_year - start_year + 1
+            if isinstance(indicator, FormulaIndicator):
+                add("formula", title, len(years), bounding_box_pixels * len(spatial_output))
+            elif isinstance(indicator, CompositeIndicator):
+                add("crop_blend", title, len(years), bounding_box_pixels * len(spatial_output))
+            else:
+                files, units = spatial_output[0]
+                add_each("crop", title, [
+                    self._get_pixels(path) for path, year in files
+                    if year and start_year <= year <= end_year])
+
+                # Conversions that are a constant factor are applied to the legend,
+                # but per-hectare conversions in a geographic projection depend on
+                # each pixel's area.
+                per_ha, *_ = units.value
+                map_per_ha, *_ = indicator.map_units.value
+                if per_ha != map_per_ha and not projected:
+                    add("convert_units", title, len(years), bounding_box_pixels)
+
+            add("flatten", title, 1, bounding_box_pixels)
+            add("legend", title, 1, bounding_box_pixels * len(years))
+            add("render", title, len(years), bounding_box_pixels)
+            add("plot", title, frames, self._plot_pixels)
+            add("layout", title, frames, self._layout_pixels)
+            add("encode", title, 1, self._layout_pixels, (frames + 1) * self._layout_pixels * 3)
+            if include_single_views:
+                add("layout", f"{title} (single views)", frames * 2, self._layout_pixels)
+                add("encode", f"{title} (single views)", 2, self._layout_pixels,
+                    (frames + 1) * self._layout_pixels * 3)
+
+        if start_year is not None:
+            # Disturbances are rendered once, for the first indicator's years.
+            disturbance_layers = [layer for layer in disturbances.layers if start_year <= layer.year <= end_year]
+            layers_by_path = defaultdict(list)
+            layers_by_year = defaultdict(list)
+            for layer in disturbance_layers:
+                layers_by_path[layer.path].append(layer)
+                layers_by_year[layer.year].append(layer)
+
+            # Disturbance layers are outside the spatial output, so only the
+            # rasters' headers are read.
+            disturbance_pixels = []
+            for path in layers_by_path:
+                disturbance_raster = gdal.Open(path)
+                disturbance_pixels.append(disturbance_raster.RasterXSize * disturbance_raster.RasterYSize)
+
+            add_each("crop", "Disturbances", disturbance_pixels)
+
+            add("reclassify", "Disturbances", len(disturbance_layers), bounding_box_pixels)
+            add("merge", "Disturbances", sum(len(layers) > 1 for layers in layers_by_year.values()),
+                bounding_box_pixels)
+
+            add("flatten", "Disturbances", 1, bounding_box_pixels)
+            add("render", "Disturbances", len(layers_by_year), bounding_box_pixels)
+            if include_single_views:
+                frames = end_year - start_year + 1
+                add("layout", "Disturbances (single view)", frames, self._layout_pixels)
+                add("encode", "Disturbances (single view)", 1, self._layout_pixels,
+                    (frames + 1) * self._layout_pixels * 3)
+
+        return operations
+
+    def summarize(self, operations):
+        '''
+        Totals up a plan from RunPlanner.plan and compares it to the resources
+        available to the run.
+
+        Arguments:
+        'operations' -- the planned operations from RunPlanner.plan.
+
+        Returns a dictionary of the number of workers, the estimated runtime in
+        seconds, the peak memory of a pool worker and of the main process, the
+        total temporary disk space, the memory and disk space available, and
+        whether the run fits in them.
+        '''
+        # Pool workers are limited by the size of the bounding box.
+        bounding_box_pixels = next((
+            operation["pixels"] for operation in operations
+            if operation["operation"] == "prepare_bounding_box"), None)
+
+        workers = ResourceGovernor.worker_count(bounding_box_pixels)
+        runtime = sum(
+            operation["seconds"] / min(workers, operation["count"]) if operation["parallel"]
+            else operation["seconds"]
+            for operation in operations)
+
+        worker_memory = max((operation["memory"] for operation in operations if operation["parallel"]), default=0)
+        main_memory = max((operation["memory"] for operation in operations if not operation["parallel"]), default=0)
+        temp_bytes = sum(operation["temp_bytes"] for operation in operations)
+        available_memory = ResourceGovernor.memory_limit()
+        available_disk = shutil.disk_usage(gettempdir()).free
+
+        return {
+            "workers": workers,
+            "runtime": runtime,
+            "worker_memory": worker_memory,
+            "main_memory": main_memory,
+            "temp_bytes": temp_bytes,
+            "available_memory": available_memory,
+            "available_disk": available_disk,
+            "fits_memory": worker_memory * workers + main_memory <= available_memory,
+            "fits_disk": temp_bytes <= available_disk,
+            "calibrated": self._calibrated
+        }
+
+    def report(self, operations, summary, output_path=None):
+        '''
+        Logs a plan and its summary, and optionally saves them as JSON.
+
+        Arguments:
+        'operations' -- the planned operations from RunPlanner.plan.
+        'summary' -- the plan summary from RunPlanner.summarize.
+        'output_path' -- optional path to save the plan to.
+        '''
+        logging.info("{:<22} {:<32} {:>6} {:>10} {:>10} {:>10} {:>10}".format(
+            "Operation", "Target", "Count", "MPixels", "Memory", "Temp", "Time"))
+
+        for operation in operations:
+            logging.info("{:<22} {:<32} {:>6} {:>10.1f} {:>10} {:>10} {:>10}".format(
+                operation["operation"], operation["target"][:32], operation["count"],
+                operation["pixels"] / 1e6, self._format_bytes(operation["memory"]),
+                self._format_bytes(operation["temp_bytes"]), self._format_seconds(operation["seconds"])))
+
+        logging.info("")
+        logging.info(f"Workers: {summary['workers']}")
+        logging.info(f"Estimated runtime: {self._format_seconds(summary['runtime'])}"
+                     f"{'' if summary['calibrated'] else ' (uncalibrated - see gcbmanimation.benchmark.hotpaths)'}")
+        logging.info(f"Peak memory: {self._format_bytes(summary['worker_memory'])} per worker, "
+                     f"{self._format_bytes(summary['main_memory'])} in the main process "
+                     f"({self._format_bytes(summary['available_memory'])} available)")
+        logging.info(f"Temporary disk space: up to {self._format_bytes(summary['temp_bytes'])} "
+                     f"({self._format_bytes(summary['available_disk'])} free)")
+
+        if not summary["fits_memory"]:
+            logging.warning("The run may not fit in the available memory - consider --max_workers")
+
+        if not summary["fits_disk"]:
+            logging.warning("The run may not fit in the free temporary disk space - consider --temp_quota")
+
+        if output_path:
+            json.dump({"operations": operations, "summary": summary}, open(output_path, "w"), indent=4)
+
+    def _calibrate(self, calibration_path):
+        results = json.load(open(calibration_path, "r"))
+        metadata = results["metadata"]
+        benchmarks = results["benchmarks"]
+
+        layer_megapixels = metadata["width"] * metadata["height"] / 1e6
+        bounding_box_megapixels = metadata.get("bounding_box_pixels", layer_megapixels * 1e6) / 1e6
+        disturbance_megapixels = metadata.get("disturbance_pixels", 0) / 1e6
+        years = metadata["years"]
+
+        # Operation to the benchmark that measures it and the megapixels of work
+        # the benchmark does.
+        benchmarked_work = {
+            "prepare_bounding_box": ("crop", years * layer_megapixels),
+            "crop": ("crop", years * layer_megapixels),
+            "merge": ("crop", years * layer_megapixels),
+            "convert_units": ("convert_units_geographic", layer_megapixels),
+            "crop_blend": ("blend", (years - 1) * layer_megapixels),
+            "formula": ("blend", (years - 1) * layer_megapixels),
+            "reclassify": ("reclassify", disturbance_megapixels),
+            "legend": ("quantile_colorizer", years * layer_megapixels),
+            "render": ("layer_collection_render", years * bounding_box_megapixels),
+            "plot": ("results_plot", years * self._plot_pixels / 1e6),
+            "layout": ("quadrant_layout", self._layout_pixels / 1e6),
+            "encode": ("create_animation", (years + 1) * self._layout_pixels / 1e6)
+        }
+
+        for operation, (benchmark, megapixels) in benchmarked_work.items():
+            if benchmark in benchmarks and megapixels > 0:
+                self._rates[operation] = benchmarks[benchmark]["min"] / megapixels
+                self._calibrated = True
+
+    def _get_pixels(self, path):
+        raster_info = SpatialOutputCatalog.get_raster_info(path)
+        if not raster_info:
+            return 0
+
+        return raster_info["width"] * raster_info["height"]
+
+    def _format_bytes(self, value):
+        for unit in ("B", "KB", "MB", "GB"):
+            if value < 1024:
+                return f"{value:.0f} {unit}"
+
+            value /= 1024
+
+        return f"{value:.1f} TB"
+
+    def _format_seconds(self, value):
+        if value < 60:
+            return f"{value:.1f}s"
+
+        if value < 3600:
+            return f"{value / 60:.1f}m"
+
+        return f"{value / 3600:.1f}h"
@@ -0,0 +1,337 @@
+import os
+import gc
+import sys
+import json
+import time
+import logging
+import platform
+import statistics
+import gdal
+from datetime import datetime
+from argparse import ArgumentParser
+from gcbmanimation.layer.layer import Layer
+from gcbmanimation.layer.layer import BlendMode
+from gcbmanimation.layer.units import Units
+from gcbmanimation.layer.boundingbox import BoundingBox
+from gcbmanimation.layer.layercollection import LayerCollection
+from gcbmanimation.color.quantilecolorizer import QuantileColorizer
+from gcbmanimation.plot.basicresultsplot import BasicResultsPlot
+from gcbmanimation.provider.spatialgcbmresultsprovider import SpatialGcbmResultsProvider
+from gcbmanimation.animator.animator import Animator
+from gcbmanimation.animator.legend import Legend
+from gcbmanimation.animator.layout.quadrantlayout import QuadrantLayout
+from gcbmanimation.util.config import IOProfile
+from gcbmanimation.util.disturbancelayerconfigurer import DisturbanceLayerConfigurer
+from gcbmanimation.util.operationmemo import OperationMemo
+from gcbmanimation.util.spatialoutputcatalog import SpatialOutputCatalog
+from gcbmanimation.util.tempfile import TempFileManager
+from gcbmanimation.util.utmzones import find_best_projection
+
+def load_run(run_path, indicator="NPP", years=10, scale=1):
+    '''
+    Collects the inputs for the benchmarks from a GCBM run laid out like the runs
+    in sample_data: the bounding box and disturbance layers from input_layers, and
+    an indicator's spatial output from output_files/spatial.
+
+    Arguments:
+    'run_path' -- the GCBM run directory, i.e. sample_data/sample_1, or a run
+        made by gcbmanimation.benchmark.syntheticrun.
+    'indicator' -- the name of the spatial output to use, i.e. NPP for NPP_*.tiff.
+    'years' -- the maximum number of years of spatial output to use.
+    'scale' -- factor to scale every raster's width and height up by, to
+        benchmark larger inputs than the run has; 1 uses the rasters as-is.
+
+    Returns a dictionary of the bounding box path, the indicator layers, and the
+    disturbance layers.
+    '''
+    input_layers_path = os.path.join(run_path, "input_layers")
+    spatial_output_path = os.path.join(run_path, "output_files", "spatial")
+
+    indicator_files = [
+        (path, year) for path, year in SpatialOutputCatalog.find(
+            os.path.join(spatial_output_path, f"{indicator}_*.tif*"))
+        if year is not None][:years]
+
+    if not indicator_files:
+        raise IOError(f"No spatial output found for {indicator} in {spatial_output_path}")
+
+    disturbance_layers = DisturbanceLayerConfigurer().configure(
+        os.path.join(input_layers_path, "study_area.json")).layers
+
+    scaled_paths = {}
+    def scaled(path):
+        if scale == 1:
+            return path
+
+        if path not in scaled_paths:
+            scaled_paths[path] = _scale_raster(path, scale)
+
+        return scaled_paths[path]
+
+    return {
+        "bounding_box": scaled(os.path.join(input_layers_path, "bounding_box.tiff")),
+        "indicator_layers": [Layer(scaled(path), year) for path, year in indicator_files],
+        "disturbance_layers": [
+            Layer(scaled(layer.path), layer.year, layer.interpretation, layer.units)
+            for layer in disturbance_layers]
+    }
+
+def time_benchmark(benchmark, repeats=3):
+    '''
+    Times a benchmark.
+
+    Arguments:
+    'benchmark' -- the function to time; takes no arguments.
+    'repeats' -- the number of times to run the benchmark.
+
+    Returns a dictionary of the individual run times and their minimum, median
+    and mean, in seconds.
+    '''
+    run_times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = benchmark()
+        run_times.append(time.perf_counter() - start)
+
+        # Release the result's temporary files before the next run.
+        result = None
+        gc.collect()
+
+    return {
+        "runs": run_times,
+        "min": min(run_times),
+        "median": statistics.median(run_times),
+        "mean": statistics.mean(run_times)
+    }
+
+def run_benchmarks(run, names=None, repeats=3):
+    '''
+    Runs the benchmarks against a set of inputs from load_run.
+
+    Arguments:
+    'run' -- the benchmark inputs from load_run.
+    'names' -- optional list of the names of the benchmarks to run; runs all of
+        them by default.
+    'repeats' -- the number of times to run each benchmark.
+
+    Returns a dictionary of benchmark name to timings; see time_benchmark.
+    '''
+    # Every run of a benchmark should do the work, not fetch the first run's result.
+    OperationMemo.set_enabled(False)
+
+    results = {}
+    for name, setup in _benchmarks.items():
+        if names and name not in names:
+            continue
+
+        logging.info(f"Running {name}...")
+        results[name] = time_benchmark(setup(run), repeats)
+        logging.info(f"  {results[name]['min']:.3f}s (median {results[name]['median']:.3f}s)")
+
+    return results
+
+def compare_results(baseline, current, threshold=0.1):
+    '''
+    Compares two sets of benchmark results by each benchmark's fastest run.
+
+    Arguments:
+    'baseline' -- the results to compare against, in the format saved by cli().
+    'current' -- the new results, in the same format.
+    'threshold' -- the proportion a benchmark can slow down by before it counts
+        as a regression, i.e. 0.1 for 10%.
+
+    Returns a list of (benchmark name, baseline seconds, current seconds, relative
+    change, is regression) tuples for the benchmarks present in both.
+    '''
+    comparison = []
+    for name, current_result in current["benchmarks"].items():
+        baseline_result = baseline["benchmarks"].get(name)
+        if not baseline_result:
+            continue
+
+        change = (current_result["min"] - baseline_result["min"]) / baseline_result["min"]
+        comparison.append((name, baseline_result["min"], current_result["min"], change, change > threshold))
+
+    return comparison
+
+def _scale_raster(path, scale):
+    raster = gdal.Open(path)
+    scaled_path = TempFileManager.mktmp(no_manual_cleanup=True, suffix=".tif")
+    gdal.Warp(scaled_path, raster, width=raster.RasterXSize * scale, height=raster.RasterYSize * scale,
+              resampleAlg="near", creationOptions=IOProfile.Compressed.creation_options)
+
+    return scaled_path
+
+def _get_pixels(path):
+    raster = gdal.Open(path)
+
+    return raster.RasterXSize * raster.RasterYSize
+
+def _benchmark_convert_units_geographic(run):
+    layer = run["indicator_layers"][0]
+
+    return lambda: layer.convert_units(Units.Tc)
+
+def _benchmark_convert_units_projected(run):
+    geographic_layer = run["indicator_layers"][0]
+    layer = geographic_layer.reproject(find_best_projection(geographic_layer))
+
+    return lambda: layer.convert_units(Units.Tc)
+
+def _benchmark_reclassify(run):
+    layers = run["disturbance_layers"]
+    unique_values = sorted({value for layer in layers for value in layer.interpretation.values()})
+    new_interpretation = {i: value for i, value in enumerate(unique_values, 1)}
+
+    return lambda: [layer.reclassify(new_interpretation) for layer in layers]
+
+def _benchmark_blend(run):
+    layer, *other_layers = run["indicator_layers"]
+    blend_args = []
+    for other_layer in other_layers:
+        blend_args.extend([other_layer, BlendMode.Subtract])
+
+    return lambda: layer.blend(*blend_args)
+
+def _benchmark_crop(run):
+    bounding_box = BoundingBox(run["bounding_box"])
+    bounding_box.prepare()
+
+    return lambda: [bounding_box.crop(layer) for layer in run["indicator_layers"]]
+
+def _benchmark_layer_collection_render(run):
+    bounding_box = BoundingBox(run["bounding_box"])
+    bounding_box.prepare()
+
+    return lambda: LayerCollection(run["indicator_layers"], colorizer=QuantileColorizer()).render(bounding_box)
+
+def _benchmark_quantile_colorizer(run):
+    colorizer = QuantileColorizer(negative_palette="Reds")
+
+    return lambda: colorizer.create_legend(run["indicator_layers"])
+
+def _benchmark_results_plot(run):
+    # The spatial totals are calculated up front so that only the plotting is timed.
+    provider = SpatialGcbmResultsProvider(
+        layers=run["indicator_layers"], cache_path=TempFileManager.mktmp(no_manual_cleanup=True, suffix=".json"))
+
+    provider.get_annual_result()
+    plot = BasicResultsPlot("Benchmark", provider, Units.Tc)
+
+    return lambda: plot.render()
+
+def _render_layout_inputs(run):
+    bounding_box = BoundingBox(run["bounding_box"])
+    indicator_frames, indicator_legend = LayerCollection(
+        run["indicator_layers"], colorizer=QuantileColorizer()).render(bounding_box)
+
+    disturbance_frames, disturbance_legend = LayerCollection(
+        run["disturbance_layers"]).render(bounding_box, *_get_year_range(run))
+
+    provider = SpatialGcbmResultsProvider(layers=run["indicator_layers"], cache_path=False)
+    graph_frames = BasicResultsPlot("Benchmark", provider, Units.Tc).render()
+    legend_frame = Legend({"Disturbances": disturbance_legend, "Benchmark": indicator_legend}).render()
+
+    frames_by_year = {}
+    for frame in indicator_frames:
+        frames_by_year[frame.year] = [
+            next((f for f in disturbance_frames if f.year == frame.year), None),
+            frame,
+            next((f for f in graph_frames if f.year == frame.year), None),
+            legend_frame]
+
+    return frames_by_year
+
+def _get_year_range(run):
+    years = [layer.year for layer in run["indicator_layers"]]
+
+    return min(years), max(years)
+
+def _benchmark_quadrant_layout(run):
+    layout = QuadrantLayout((50, 60), (50, 60), (50, 40), (50, 40))
+    frames = next(iter(_render_layout_inputs(run).values()))
+
+    return lambda: layout.render(*frames, "Disturbances", "Benchmark", "Benchmark",
+                                 title="Benchmark", dimensions=(3840, 2160))
+
+def _benchmark_create_animation(run):
+    layout = QuadrantLayout((50, 60), (50, 60), (50, 40), (50, 40))
+    animation_frames = [
+        layout.render(*frames, title=f"Benchmark, Year: {year}", dimensions=(3840, 2160))
+        for year, frames in sorted(_render_layout_inputs(run).items())]
+
+    animator = Animator(None, [], TempFileManager.get_shared_dir("benchmark"))
+
+    return lambda: animator._create_animation("benchmark", animation_frames)
+
+# Benchmark name to a function that sets up the benchmark for a run and returns
+# the function to time. Animation is last because it cleans up temporary rasters.
+_benchmarks = {
+    "convert_units_geographic": _benchmark_convert_units_geographic,
+    "convert_units_projected": _benchmark_convert_units_projected,
+    "reclassify": _benchmark_reclassify,
+    "blend": _benchmark_blend,
+    "crop": _benchmark_crop,
+    "layer_collection_render": _benchmark_layer_collection_render,
+    "quantile_colorizer": _benchmark_quantile_colorizer,
+    "results_plot": _benchmark_results_plot,
+    "quadrant_layout": _benchmark_quadrant_layout,
+    "create_animation": _benchmark_create_animation
+}
+
+def cli():
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(message)s")
+    TempFileManager.delete_on_exit()
+
+    parser = ArgumentParser(description="Benchmark the raster, layout and encoding hot paths")
+    parser.add_argument("run_path", type=os.path.abspath, help="GCBM run to benchmark with, i.e. sample_data/sample_1 or a synthetic run")
+    parser.add_argument("--indicator", default="NPP", help="Spatial output to benchmark with (default: NPP)")
+    parser.add_argument("--years", type=int, default=10, help="Maximum number of years of spatial output to use")
+    parser.add_argument("--scale", type=int, default=1, help="Factor to scale the run's rasters up by")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of times to repeat each benchmark")
+    parser.add_argument("--benchmarks", nargs="+", choices=list(_benchmarks), help="Benchmarks to run (default: all)")
+    parser.add_argument("--output", type=os.path.abspath, help="Optional path to save the results as JSON")
+    parser.add_argument("--compare", type=os.path.abspath, help="Results JSON from an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Slowdown to report as a regression (default: 0.1)")
+    args = parser.parse_args()
+
+    run = load_run(args.run_path, args.indicator, args.years, args.scale)
+    reference_raster = gdal.Open(run["indicator_layers"][0].path)
+    bounding_box_raster = gdal.Open(run["bounding_box"])
+    results = {
+        "metadata": {
+            "run_path": args.run_path,
+            "indicator": args.indicator,
+            "years": len(run["indicator_layers"]),
+            "scale": args.scale,
+            "width": reference_raster.RasterXSize,
+            "height": reference_raster.RasterYSize,
+            "bounding_box_pixels": bounding_box_raster.RasterXSize * bounding_box_raster.RasterYSize,
+            "disturbance_pixels": sum(_get_pixels(layer.path) for layer in run["disturbance_layers"]),
+            "repeats": args.repeats,
+            "timestamp": datetime.now().isoformat(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "gdal": gdal.__version__,
+            "cpu_count": os.cpu_count()
+        },
+        "benchmarks": run_benchmarks(run, args.benchmarks, args.repeats)
+    }
+
+    if args.output:
+        json.dump(results, open(args.output, "w"), indent=4)
+
+    if args.compare:
+        regressions = 0
+        for name, baseline_time, current_time, change, regression in compare_results(
+            json.load(open(args.compare, "r")), results, args.threshold
+        ):
+            regressions += regression
+            logging.info("{}: {:.3f}s -> {:.3f}s ({:+.1%}){}".format(
+                name, baseline_time, current_time, change, " REGRESSION" if regression else ""))
+
+        if regressions:
+            sys.exit(f"{regressions} benchmark(s) slower than {args.compare} by more than {args.threshold:.0%}")
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,105 @@
+import os
+import sys
+import json
+import time
+import logging
+import gdal
+import numpy as np
+from argparse import ArgumentParser
+from osgeo.scripts import gdal_calc
+from gcbmanimation.util.config import IOProfile
+from gcbmanimation.util.tempfile import TempFileManager
+
+def create_test_raster(size, nodata_value=-1):
+    '''
+    Creates a square float32 raster with a mix of nodata and smoothly varying
+    values, similar to a GCBM spatial output.
+
+    Arguments:
+    'size' -- the width and height of the raster in pixels.
+    'nodata_value' -- the nodata value for the raster.
+
+    Returns the path to the new raster.
+    '''
+    path = TempFileManager.mktmp(suffix=".tif")
+    raster = gdal.GetDriverByName("GTiff").Create(
+        path, size, size, 1, gdal.GDT_Float32, IOProfile.Compressed.creation_options)
+
+    raster.SetGeoTransform((0, 30, 0, size * 30, 0, -30))
+    band = raster.GetRasterBand(1)
+    band.SetNoDataValue(nodata_value)
+
+    y, x = np.mgrid[0:size, 0:size]
+    data = (np.sin(x / 50) * np.cos(y / 50) * 100).astype(np.float32)
+    data[(x + y) % 7 == 0] = nodata_value
+    band.WriteArray(data)
+    raster = None
+
+    return path
+
+def benchmark_profile(profile, source_path, repeats=3):
+    '''
+    Times the typical life of an intermediate raster under an IOProfile: a warp,
+    a gdal_calc pass over the warped copy, and reading the result back.
+
+    Arguments:
+    'profile' -- the IOProfile to benchmark.
+    'source_path' -- the raster to use as input.
+    'repeats' -- the number of times to repeat the test; the fastest is kept.
+
+    Returns a dictionary of timings in seconds and the output file size in bytes.
+    '''
+    results = None
+    for _ in range(repeats):
+        warp_path = TempFileManager.mktmp(suffix=".tif")
+        calc_path = TempFileManager.mktmp(suffix=".tif")
+
+        start = time.perf_counter()
+        gdal.Warp(warp_path, source_path, creationOptions=profile.creation_options)
+        warped = time.perf_counter()
+        gdal_calc.Calc("A * 2", calc_path, -1, quiet=True, overwrite=True, A=warp_path,
+                       creation_options=profile.creation_options)
+        calculated = time.perf_counter()
+        gdal.Open(calc_path).ReadAsArray()
+        read = time.perf_counter()
+
+        run_results = {
+            "warp": warped - start,
+            "calc": calculated - warped,
+            "read": read - calculated,
+            "total": read - start,
+            "bytes": os.path.getsize(warp_path) + os.path.getsize(calc_path)
+        }
+
+        if not results or run_results["total"] < results["total"]:
+            results = run_results
+
+        TempFileManager.remove(warp_path)
+        TempFileManager.remove(calc_path)
+
+    return results
+
+def cli():
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(message)s")
+    TempFileManager.delete_on_exit()
+
+    parser = ArgumentParser(description="Compare GDAL creation option profiles for intermediate rasters")
+    parser.add_argument("--size", type=int, default=4096, help="Width and height of the test raster")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of times to repeat each test")
+    parser.add_argument("--output", type=os.path.abspath, help="Optional path to save the results as JSON")
+    args = parser.parse_args()
+
+    source_path = create_test_raster(args.size)
+    results = {}
+    for profile in IOProfile:
+        results[profile.name] = benchmark_profile(profile, source_path, args.repeats)
+        logging.info("{}: {:.2f}s total ({:.2f}s warp, {:.2f}s calc, {:.2f}s read), {:.1f} MB".format(
+            profile.name, results[profile.name]["total"], results[profile.name]["warp"],
+            results[profile.name]["calc"], results[profile.name]["read"],
+            results[profile.name]["bytes"] / 1024 ** 2))
+
+    if args.output:
+        json.dump(results, open(args.output, "w"), indent=4)
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,397 @@
+import os
+import sys
+import json
+import math
+import sqlite3
+import logging
+import gdal
+import osr
+import numpy as np
+from argparse import ArgumentParser
+from collections import defaultdict
+from gcbmanimation.util.config import IOProfile
+
+# Name in the results database, spatial output file name, results view, and
+# typical value in tC/ha for the indicators a synthetic run can have; runs with
+# more indicators than this get extra generic flux indicators.
+_indicators = [
+    ("NPP", "NPP", "v_flux_indicator_aggregates", 5),
+    ("NEP", "NEP", "v_flux_indicator_aggregates", 1),
+    ("NBP", "NBP", "v_flux_indicator_aggregates", 0.5),
+    ("Total Ecosystem", "Total_Ecosystem_C", "v_pool_indicators", 250),
+    ("Aboveground Biomass", "AG_Biomass_C", "v_pool_indicators", 80),
+    ("Rh", "Rh", "v_flux_indicator_aggregates", 4)
+]
+
+_disturbance_types = [
+    "Wildfire", "Clearcut harvesting with salvage", "Mountain pine beetle — Very severe impact",
+    "Deforestation", "Insect defoliation", "Partial harvest"
+]
+
+_classifier_values = ["BF", "BP", "JP", "TA", "WS"]
+
+# Location and pixel size of the run in geographic coordinates, as in sample_data.
+_origin = (-106.0, 55.0)
+_geographic_pixel_size = 0.00025
+_projected_pixel_size = 30
+
+_results_tables = {
+    "v_age_indicators": (
+        "year INTEGER", '"Classifier1" TEXT', "unfccc_land_class TEXT", "age_range TEXT", "area REAL"),
+    "v_disturbance_indicators": (
+        '"Classifier1" TEXT', "unfccc_land_class TEXT", "year INTEGER", "disturbance_code INTEGER",
+        "disturbance_type TEXT", "pre_dist_age_range TEXT", "post_dist_age_range TEXT", "dist_area REAL",
+        "dist_product REAL", "dist_product_per_ha REAL"),
+    "v_error_indicators": (
+        "year INTEGER", '"Classifier1" TEXT', "module TEXT", "error TEXT", "area REAL"),
+    "v_flux_indicator_aggregates": (
+        "flux_indicator_collection_id INTEGER", "indicator TEXT", "year INTEGER", '"Classifier1" TEXT',
+        "unfccc_land_class TEXT", "age_range TEXT", "area REAL", "flux_tc REAL"),
+    "v_flux_indicator_aggregates_density": (
+        "indicator TEXT", "year INTEGER", "flux_tc REAL", "flux_tc_per_ha REAL"),
+    "v_flux_indicators": (
+        "flux_indicator_id INTEGER", '"Classifier1" TEXT', "unfccc_land_class TEXT", "indicator TEXT",
+        "year INTEGER", "disturbance_code INTEGER", "disturbance_type TEXT", "age_range TEXT", "area REAL",
+        "flux_tc REAL"),
+    "v_flux_indicators_density": (
+        "indicator TEXT", "year INTEGER", "flux_tc REAL", "flux_tc_per_ha REAL"),
+    "v_pool_indicators": (
+        "indicator_id INTEGER", '"Classifier1" TEXT', "unfccc_land_class TEXT", "indicator TEXT",
+        "year INTEGER", "age_range TEXT", "area REAL", "pool_tc REAL", "pool_tc_per_ha REAL"),
+    "v_stock_change_indicators": (
+        "indicator TEXT", '"Classifier1" TEXT', "unfccc_land_class TEXT", "year INTEGER", "age_range TEXT",
+        "area REAL", "flux_tc REAL"),
+    "v_stock_change_indicators_density": (
+        "indicator TEXT", "year INTEGER", "flux_tc REAL", "flux_tc_per_ha REAL"),
+    "v_total_disturbed_areas": (
+        '"Classifier1" TEXT', "unfccc_land_class TEXT", "year INTEGER", "disturbance_code INTEGER",
+        "disturbance_type TEXT", "dist_area REAL")
+}
+
+_land_class = "UNFCCC_FL_R_FL"
+_age_range = "0-19"
+_output_nodata = -1.0
+_patch_size = 64
+_disturbed_proportion = 0.02
+
+def generate_run(output_path, size=1000, years=10, start_year=2010, crs="EPSG:4326",
+                 indicators=3, disturbance_types=3, seed=0):
+    '''
+    Writes a complete synthetic GCBM run for testing at scale, laid out like the
+    runs in sample_data: input_layers with study_area.json, a bounding box, and
+    *_moja.tiff disturbance and classifier layers with their attribute JSON;
+    output_files with spatial output for each indicator and year and a compiled
+    SQLite results database with totals matching the spatial output; and an
+    indicators.json animation config for the run's indicators.
+
+    Arguments:
+    'output_path' -- the directory to write the run to.
+    'size' -- the width and height of the rasters in pixels.
+    'years' -- the number of simulation years.
+    'start_year' -- the first simulation year.
+    'crs' -- the coordinate system of the rasters, i.e. "EPSG:4326" (default) or
+        a projected one like "EPSG:3005".
+    'indicators' -- the number of indicators to include.
+    'disturbance_types' -- the number of disturbance types to include.
+    'seed' -- the random seed; the same settings and seed give the same run.
+
+    Returns the paths to the study area file, the spatial output directory, the
+    animation config file, and the results database.
+    '''
+    input_layers_path = os.path.join(output_path, "input_layers")
+    spatial_output_path = os.path.join(output_path, "output_files", "spatial")
+    os.makedirs(input_layers_path, exist_ok=True)
+    os.makedirs(spatial_output_path, exist_ok=True)
+
+    random = np.random.RandomState(seed)
+    srs = osr.SpatialReference()
+    srs.SetFromUserInput(crs)
+    geotransform = _get_geotransform(srs)
+    pixel_areas = _get_pixel_areas(srs, geotransform, size)
+    run_indicators = _get_indicators(indicators)
+    run_disturbance_types = _get_disturbance_types(disturbance_types)
+    simulation_years = list(range(start_year, start_year + years))
+
+    # Coarse grids of random values give the rasters patches of similar pixels
+    # rather than noise, like real classifiers and disturbance events.
+    patch_rows = math.ceil(size / _patch_size)
+    classifier_patches = random.randint(0, len(_classifier_values), (patch_rows, patch_rows))
+    disturbance_patches = {
+        year: np.where(random.random_sample((patch_rows, patch_rows)) < _disturbed_proportion,
+                       random.randint(1, len(run_disturbance_types) + 1, (patch_rows, patch_rows)), 0)
+        for year in simulation_years}
+
+    def study_area_mask(y_offset, rows):
+        # An ellipse inset from the raster edges, so the bounding box has nodata
+        # around it like a real study area.
+        y, x = np.mgrid[y_offset:y_offset + rows, 0:size]
+        center = (size - 1) / 2
+        return ((x - center) / (center * 0.9)) ** 2 + ((y - center) / (center * 0.8)) ** 2 <= 1
+
+    def patches(grid, y_offset, rows):
+        return grid[np.arange(y_offset, y_offset + rows) // _patch_size][:, np.arange(size) // _patch_size]
+
+    _write_raster(os.path.join(input_layers_path, "bounding_box.tiff"), size, geotransform, srs,
+                  gdal.GDT_Byte, 0, lambda y, rows: study_area_mask(y, rows).astype(np.uint8))
+
+    study_area_layers = [{"name": "Classifier1", "type": "VectorLayer", "tags": ["classifier"]}]
+    classifier_areas = defaultdict(float)
+    def classifier_layer(y_offset, rows):
+        data = patches(classifier_patches, y_offset, rows) + 1
+        mask = study_area_mask(y_offset, rows)
+        row_areas = pixel_areas[y_offset:y_offset + rows]
+        for i, classifier_value in enumerate(_classifier_values, 1):
+            classifier_areas[classifier_value] += ((data == i) & mask).sum(axis=1) @ row_areas
+
+        return np.where(mask, data, 0).astype(np.uint8)
+
+    _write_moja_layer(input_layers_path, "Classifier1", size, geotransform, srs, gdal.GDT_Byte, 0,
+                      classifier_layer, {str(i): value for i, value in enumerate(_classifier_values, 1)})
+
+    disturbed_areas = defaultdict(float)
+    for year in simulation_years:
+        def disturbance_layer(y_offset, rows):
+            data = patches(disturbance_patches[year], y_offset, rows)
+            data[~study_area_mask(y_offset, rows)] = 0
+            for code in range(1, len(run_disturbance_types) + 1):
+                disturbed_areas[(year, code)] += (data == code).sum(axis=1) @ pixel_areas[y_offset:y_offset + rows]
+
+            return data.astype(np.uint8)
+
+        layer_name = f"disturbances_{year}"
+        _write_moja_layer(input_layers_path, layer_name, size, geotransform, srs, gdal.GDT_Byte, 0,
+                          disturbance_layer, {
+                              str(code): {"year": year, "disturbance_type": disturbance_type, "transition": 1}
+                              for code, disturbance_type in enumerate(run_disturbance_types, 1)})
+
+        study_area_layers.append({"name": layer_name, "type": "DisturbanceLayer", "tags": ["disturbance"]})
+
+    json.dump({
+        "tile_size": 1.0,
+        "block_size": 0.1,
+        "tiles": [{"x": int(_origin[0]), "y": int(_origin[1]), "index": 0}],
+        "pixel_size": abs(geotransform[1]),
+        "layers": study_area_layers
+    }, open(os.path.join(input_layers_path, "study_area.json"), "w"), indent=4)
+
+    indicator_totals = {}
+    for indicator_number, (indicator, file_name, table, typical_value) in enumerate(run_indicators):
+        for year_number, year in enumerate(simulation_years):
+            year_total = 0
+            def indicator_layer(y_offset, rows):
+                nonlocal year_total
+                y, x = np.mgrid[y_offset:y_offset + rows, 0:size]
+                phase = indicator_number + year_number * 0.3
+                data = typical_value * (1 + 0.5 * np.sin(x / 97 + phase) * np.cos(y / 113 - phase))
+                data[patches(disturbance_patches[year], y_offset, rows) > 0] *= 0.2
+                mask = study_area_mask(y_offset, rows)
+                year_total += np.where(mask, data, 0).sum(axis=1) @ pixel_areas[y_offset:y_offset + rows]
+                data[~mask] = _output_nodata
+
+                return data.astype(np.float32)
+
+            _write_raster(os.path.join(spatial_output_path, f"{file_name}_{year}.tiff"), size, geotransform, srs,
+                          gdal.GDT_Float32, _output_nodata, indicator_layer)
+
+            indicator_totals[(indicator, year)] = year_total
+
+        logging.info(f"Wrote spatial output for {indicator}")
+
+    results_path = os.path.join(output_path, "output_files", "compiled_gcbm_output.db")
+    _write_results(results_path, run_indicators, run_disturbance_types, simulation_years,
+                   indicator_totals, classifier_areas, disturbed_areas)
+
+    config_path = os.path.join(output_path, "indicators.json")
+    json.dump([{
+        "database_indicator": indicator,
+        "file_pattern": f"{file_name}_*.tiff",
+        "palette": "Greens"
+    } for indicator, file_name, *_ in run_indicators], open(config_path, "w"), indent=4)
+
+    return os.path.join(input_layers_path, "study_area.json"), spatial_output_path, config_path, results_path
+
+def _get_indicators(count):
+    run_indicators = _indicators[:count]
+    for i in range(len(_indicators) + 1, count + 1):
+        run_indicators.append((f"Indicator {i}", f"Indicator_{i}", "v_flux_indicator_aggregates", 1))
+
+    return run_indicators
+
+def _get_disturbance_types(count):
+    if count > 254:
+        raise ValueError("A synthetic run can have at most 254 disturbance types")
+
+    return [_disturbance_types[i] if i < len(_disturbance_types) else f"Disturbance type {i + 1}"
+            for i in range(count)]
+
+def _get_geotransform(srs):
+    if srs.IsGeographic():
+        return (_origin[0], _geographic_pixel_size, 0, _origin[1], 0, -_geographic_pixel_size)
+
+    # Put projected runs at the same place on the ground as geographic ones.
+    wgs84 = osr.SpatialReference()
+    wgs84.ImportFromEPSG(4326)
+    for spatial_ref in (wgs84, srs):
+        if hasattr(spatial_ref, "SetAxisMappingStrategy"):
+            spatial_ref.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+    x, y, _ = osr.CoordinateTransformation(wgs84, srs).TransformPoint(*_origin)
+
+    return (x, _projected_pixel_size, 0, y, 0, -_projected_pixel_size)
+
+def _get_pixel_areas(srs, geotransform, size):
+    # The area in hectares of a pixel in each row.
+    one_hectare = 100 ** 2
+    _, pixel_size_x, _, origin_y, _, pixel_size_y = geotransform
+    if not srs.IsGeographic():
+        return np.full(size, abs(pixel_size_x * pixel_size_y) / one_hectare)
+
+    earth_radius_m = 6371008.8
+    latitudes = np.radians(origin_y + pixel_size_y * (np.arange(size) + 0.5))
+    pixel_size_m = np.radians(abs(pixel_size_x)) * earth_radius_m
+
+    return pixel_size_m * pixel_size_m * np.cos(latitudes) / one_hectare
+
+def _write_raster(path, size, geotransform, srs, data_type, nodata_value, get_rows):
+    # Writes a raster in blocks of rows so that large runs don't need to fit in memory.
+    raster = gdal.GetDriverByName("GTiff").Create(
+        path, size, size, 1, data_type, IOProfile.Compressed.creation_options)
+
+    raster.SetGeoTransform(geotransform)
+    raster.SetProjection(srs.ExportToWkt())
+    band = raster.GetRasterBand(1)
+    band.SetNoDataValue(nodata_value)
+
+    rows_per_block = max(1, 2 ** 22 // size)
+    for y_offset in range(0, size, rows_per_block):
+        band.WriteArray(get_rows(y_offset, min(rows_per_block, size - y_offset)), 0, y_offset)
+
+    raster = None
+
+def _write_moja_layer(path, name, size, geotransform, srs, data_type, nodata_value, get_rows, attributes):
+    _write_raster(os.path.join(path, f"{name}_moja.tiff"), size, geotransform, srs, data_type,
+                  nodata_value, get_rows)
+
+    pixel_size = abs(geotransform[1])
+    json.dump({
+        "layer_type": "GridLayer",
+        "layer_data": gdal.GetDataTypeName(data_type),
+        "nodata": nodata_value,
+        "tileLatSize": 1.0,
+        "tileLonSize": 1.0,
+        "blockLatSize": 0.1,
+        "blockLonSize": 0.1,
+        "cellLatSize": pixel_size,
+        "cellLonSize": pixel_size,
+        "attributes": attributes
+    }, open(os.path.join(path, f"{name}_moja.json"), "w"), indent=4)
+
+def _write_results(path, run_indicators, run_disturbance_types, simulation_years,
+                   indicator_totals, classifier_areas, disturbed_areas):
+    if os.path.exists(path):
+        os.remove(path)
+
+    conn = sqlite3.connect(path)
+    for table, columns in _results_tables.items():
+        conn.execute(f"CREATE TABLE {table} ({', '.join(columns)})")
+
+    # Each year's totals are split between the classifier values by area.
+    total_area = sum(classifier_areas.values())
+    classifier_shares = {value: area / total_area for value, area in classifier_areas.items() if area}
+
+    def insert(table, rows):
+        if rows:
+            placeholders = ", ".join("?" * len(rows[0]))
+            conn.executemany(f"INSERT INTO {table} VALUES ({placeholders})", rows)
+
+    insert("v_age_indicators", [
+        (year, classifier_value, _land_class, _age_range, total_area * share)
+        for year in simulation_years
+        for classifier_value, share in classifier_shares.items()])
+
+    for indicator_id, (indicator, _, table, _) in enumerate(run_indicators, 1):
+        rows = []
+        density_rows = []
+        for year in simulation_years:
+            total = indicator_totals[(indicator, year)]
+            density_rows.append((indicator, year, total, total / total_area))
+            for classifier_value, share in classifier_shares.items():
+                area = total_area * share
+                if table == "v_pool_indicators":
+                    rows.append((indicator_id, classifier_value, _land_class, indicator, year, _age_range,
+                                 area, total * share, total / total_area))
+                else:
+                    rows.append((indicator_id, indicator, year, classifier_value, _land_class, _age_range,
+                                 area, total * share))
+
+        insert(table, rows)
+        if table == "v_flux_indicator_aggregates":
+            insert("v_flux_indicator_aggregates_density", density_rows)
+
+    # Stock changes follow the year-over-year change in each pool.
+    stock_change_rows = []
+    stock_change_density_rows = []
+    for indicator, _, table, _ in run_indicators:
+        if table != "v_pool_indicators":
+            continue
+
+        for previous_year, year in zip(simulation_years, simulation_years[1:]):
+            change = indicator_totals[(indicator, year)] - indicator_totals[(indicator, previous_year)]
+            stock_change_density_rows.append((f"Delta {indicator}", year, change, change / total_area))
+            stock_change_rows.extend(
+                (f"Delta {indicator}", classifier_value, _land_class, year, _age_range,
+                 total_area * share, change * share)
+                for classifier_value, share in classifier_shares.items())
+
+    insert("v_stock_change_indicators", stock_change_rows)
+    insert("v_stock_change_indicators_density", stock_change_density_rows)
+
+    disturbance_rows = []
+    disturbed_area_rows = []
+    flux_rows = []
+    for (year, code), area in sorted(disturbed_areas.items()):
+        if not area:
+            continue
+
+        disturbance_type = run_disturbance_types[code - 1]
+        for classifier_value, share in classifier_shares.items():
+            classifier_area = area * share
+            dist_product = classifier_area * 50
+            disturbance_rows.append((classifier_value, _land_class, year, code, disturbance_type,
+                                     _age_range, _age_range, classifier_area, dist_product, 50))
+            disturbed_area_rows.append((classifier_value, _land_class, year, code, disturbance_type,
+                                        classifier_area))
+            flux_rows.append((1, classifier_value, _land_class, "CO2Production", year, code, disturbance_type,
+                              _age_range, classifier_area, dist_product * 0.5))
+
+    insert("v_disturbance_indicators", disturbance_rows)
+    insert("v_total_disturbed_areas", disturbed_area_rows)
+    insert("v_flux_indicators", flux_rows)
+
+    conn.commit()
+    conn.close()
+
+def cli():
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(message)s")
+
+    parser = ArgumentParser(description="Generate a synthetic GCBM run for testing at scale")
+    parser.add_argument("output_path", type=os.path.abspath, help="Directory to write the run to")
+    parser.add_argument("--size", type=int, default=1000, help="Width and height of the rasters in pixels")
+    parser.add_argument("--years", type=int, default=10, help="Number of simulation years")
+    parser.add_argument("--start_year", type=int, default=2010, help="First simulation year")
+    parser.add_argument("--crs", default="EPSG:4326", help="Coordinate system of the rasters, i.e. EPSG:3005")
+    parser.add_argument("--indicators", type=int, default=3, help="Number of indicators")
+    parser.add_argument("--disturbance_types", type=int, default=3, help="Number of disturbance types")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    study_area_path, spatial_output_path, config_path, results_path = generate_run(
+        args.output_path, args.size, args.years, args.start_year, args.crs,
+        args.indicators, args.disturbance_types, args.seed)
+
+    logging.info(f"Wrote synthetic run to {args.output_path} - animate it with:")
+    logging.info(f"  gcbmanimation {study_area_path} {spatial_output_path} {config_path} <output dir> "
+                 f"--db_results {results_path}")
+
+if __name__ == "__main__":
+    cli()
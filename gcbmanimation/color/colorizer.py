@@ -15,22 +15,25 @@ class Colorizer:
         self._palette = palette
         self._bins = bins
 
-    def create_legend(self, layers):
+    def create_legend(self, layers, value_scale=1):
         '''
         Creates a legend and color scheme for the specified group of layers.
 
         Arguments:
         'layers' -- list of Layer objects to create a legend and color scheme for.
+        'value_scale' -- optional factor to multiply the layers' pixel values by
+            for a unit conversion that has not been applied to the pixels yet; the
+            legend values are in the converted units.
         '''
         interpretation = layers[0].interpretation
         if interpretation:
             return self._create_interpreted_legend(layers, interpretation)
         
-        return self._create_value_legend(layers)
+        return self._create_value_legend(layers, value_scale)
 
-    def _create_value_legend(self, layers):
-        min_value = min((layer.min_max[0] for layer in layers)) - 0.5
-        max_value = max((layer.min_max[1] for layer in layers)) + 0.5
+    def _create_value_legend(self, layers, value_scale=1):
+        min_value = min((layer.min_max[0] for layer in layers)) * value_scale - 0.5
+        max_value = max((layer.min_max[1] for layer in layers)) * value_scale + 0.5
         bin_size = (max_value - min_value) / self._bins
             
         colors = self._create_colors(self._palette, self._bins)
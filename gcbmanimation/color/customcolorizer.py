@@ -20,11 +20,11 @@ class CustomColorizer(Colorizer):
         self._value_colorizer = value_colorizer
         self._custom_colors = custom_colors
 
-    def _create_value_legend(self, layers):
+    def _create_value_legend(self, layers, value_scale=1):
         if self._value_colorizer:
-            return self._value_colorizer.create_legend(layers)
+            return self._value_colorizer.create_legend(layers, value_scale)
 
-        return super()._create_value_legend(layers)
+        return super()._create_value_legend(layers, value_scale)
 
     def _create_interpreted_legend(self, layers, interpretation):
         color_map = {}
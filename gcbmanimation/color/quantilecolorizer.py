@@ -3,13 +3,12 @@ import warnings
 warnings.simplefilter("ignore")
 
 import gdal
-import psutil
 import numpy as np
 import seaborn as sns
 from enum import Enum
 from pysal.esda.mapclassify import Quantiles
 from gcbmanimation.color.colorizer import Colorizer
-from gcbmanimation.util.config import gdal_memory_limit
+from gcbmanimation.util.resourcegovernor import ResourceGovernor
 
 class Filter(Enum):
 
@@ -34,14 +33,14 @@ class QuantileColorizer(Colorizer):
         super().__init__(*args, **kwargs)
         self._negative_palette = negative_palette
 
-    def _create_value_legend(self, layers):
+    def _create_value_legend(self, layers, value_scale=1):
         if self._negative_palette:
-            return self._create_split_value_legend(layers)
+            return self._create_split_value_legend(layers, value_scale)
         else:
-            return self._create_simple_value_legend(layers)
+            return self._create_simple_value_legend(layers, value_scale)
 
-    def _create_simple_value_legend(self, layers):
-        quantile_data = self._get_quantile_dataset(layers)
+    def _create_simple_value_legend(self, layers, value_scale=1):
+        quantile_data = self._get_quantile_dataset(layers, value_scale=value_scale)
         quantiles = Quantiles(quantile_data, k=self._bins)
         bins = quantiles.bins
         colors = self._create_colors(self._palette, self._bins)
@@ -60,11 +59,11 @@ class QuantileColorizer(Colorizer):
        
         return legend
 
-    def _create_split_value_legend(self, layers):
+    def _create_split_value_legend(self, layers, value_scale=1):
         legend = {}
         k = self._bins // 2
 
-        negative_data = self._get_quantile_dataset(layers, Filter.Negative)
+        negative_data = self._get_quantile_dataset(layers, Filter.Negative, value_scale)
         negative_quantiles = Quantiles(negative_data, k=k)
         negative_bins = list(negative_quantiles.bins)
         negative_colors = list(self._create_colors(self._negative_palette, k))
@@ -83,7 +82,7 @@ class QuantileColorizer(Colorizer):
                     "label": f"{self._format_value(lower_bound)} to {self._format_value(upper_bound)}",
                     "color": negative_colors[-i - 1]}
 
-        positive_data = self._get_quantile_dataset(layers, Filter.Positive)
+        positive_data = self._get_quantile_dataset(layers, Filter.Positive, value_scale)
         positive_quantiles = Quantiles(positive_data, k=k)
         positive_bins = positive_quantiles.bins
         positive_colors = self._create_colors(self._palette, k)
@@ -98,13 +97,13 @@ class QuantileColorizer(Colorizer):
 
         return legend
 
-    def _get_quantile_dataset(self, layers, filter=None):
+    def _get_quantile_dataset(self, layers, filter=None, value_scale=1):
         # Cap the maximum amount of data to load to avoid running out of memory.
-        data_points_per_layer = int(psutil.virtual_memory().available * 0.75 / (64 / 8) / len(layers) / 4)
+        data_points_per_layer = int(ResourceGovernor.memory_limit() * 0.75 / (64 / 8) / len(layers) / 4)
 
         all_layer_data = np.empty(shape=(0, 0))
         for layer in layers:
-            layer_data = self._load_layer_data(layer, filter)
+            layer_data = self._load_layer_data(layer, filter, value_scale)
             if layer_data.size > data_points_per_layer:
                 # Keep the min/max values when trimming the dataset so that the
                 # legend ranges are correct.
@@ -116,12 +115,15 @@ class QuantileColorizer(Colorizer):
 
         return all_layer_data
 
-    def _load_layer_data(self, layer, filter=None):
+    def _load_layer_data(self, layer, filter=None, value_scale=1):
         raster = gdal.Open(layer.path)
         raster_data = np.array(raster.GetRasterBand(1).ReadAsArray())
         raster_data[np.where(raster_data == layer.nodata_value)] = np.nan
         raster_data = raster_data.reshape(raster_data.size)
         raster_data = raster_data[np.logical_not(np.isnan(raster_data))]
+        if value_scale != 1:
+            raster_data = raster_data * value_scale
+
         raster_data = raster_data[np.where(raster_data <= 0)] if filter == Filter.Negative \
                  else raster_data[np.where(raster_data  > 0)] if filter == Filter.Positive \
                  else raster_data
@@ -1,13 +1,15 @@
-import os
+import gdal
 import logging
-from glob import glob
-from multiprocessing import Pool
+from collections import defaultdict
 from gcbmanimation.indicator.indicator import Indicator
 from gcbmanimation.layer.units import Units
 from gcbmanimation.provider.spatialgcbmresultsprovider import SpatialGcbmResultsProvider
 from gcbmanimation.plot.basicresultsplot import BasicResultsPlot
 from gcbmanimation.layer.layercollection import LayerCollection
 from gcbmanimation.layer.layer import Layer
+from gcbmanimation.util.resourcegovernor import ResourceGovernor
+from gcbmanimation.util.spatialoutputcatalog import SpatialOutputCatalog
+from gcbmanimation.util.profiler import Profiler
 
 class CompositeIndicator(Indicator):
     '''
@@ -41,13 +43,31 @@ class CompositeIndicator(Indicator):
         self._patterns = patterns
         self._composite_layers = None
 
-    def render_map_frames(self, bounding_box=None, start_year=None, end_year=None):
+    @property
+    def spatial_output_patterns(self):
+        '''See Indicator.spatial_output_patterns.'''
+        return [pattern if isinstance(pattern, tuple) else (pattern, Units.TcPerHa)
+                for pattern in self._patterns]
+
+    @property
+    def simulation_years(self):
+        '''Gets the years present in the simulation.'''
+        years = {layer.year for pattern in self._patterns for layer in self._find_component_layers(pattern)}
+
+        return min(years), max(years)
+
+    def render_map_frames(self, bounding_box=None, start_year=None, end_year=None, frame_store=None,
+                          legend=None):
         '''
         Renders the indicator's spatial output into colorized Frame objects.
 
         Arguments:
         'bounding_box' -- optional bounding box Layer; spatial output will be
             cropped to the bounding box's minimum spatial extent and nodata pixels.
+        'frame_store' -- optional FrameStore to render incrementally; see
+            LayerCollection.render.
+        'legend' -- optional legend to color the map with instead of creating one
+            from the indicator's own output; see LayerCollection.render.
 
         Returns a list of colorized Frames, one for each year of output, and a
         legend in dictionary format describing the colors.
@@ -56,55 +76,95 @@ class CompositeIndicator(Indicator):
         if not start_year or not end_year:
             start_year, end_year = self._results_provider.simulation_years
         
-        return self._composite_layers.render(bounding_box, start_year, end_year, self._map_units)
+        with Profiler.stage("map_frames"):
+            return self._composite_layers.render(
+                bounding_box, start_year, end_year, self._map_units, frame_store, legend)
 
-    def render_graph_frames(self, start_year=None, end_year=None, **kwargs):
+    def get_map_layers(self, bounding_box=None):
+        '''
+        Gets the LayerCollection that the indicator's map frames are rendered from.
+
+        Arguments:
+        'bounding_box' -- optional bounding box Layer; spatial output will be
+            cropped to the bounding box's minimum spatial extent and nodata pixels.
+        '''
+        self._init(bounding_box)
+
+        return self._composite_layers
+
+    def release_layers(self):
+        '''See Indicator.release_layers.'''
+        self._composite_layers = None
+        self._results_provider = None
+
+    def render_graph_frames(self, start_year=None, end_year=None, incremental=False, **kwargs):
         '''
         Renders the indicator's non-spatial output into a graph.
 
         Arguments:
+        'incremental' -- ignored: composite layers are always made for every year
+            up front.
         Any accepted by GCBMResultsProvider and subclasses.
 
         Returns a list of Frames, one for each year of output.
         '''
-        self._init(**kwargs)
+        # The composite layers are already cropped to the bounding box, so the
+        # results provider doesn't need to crop them again.
+        bounding_box = kwargs.pop("bounding_box", None)
+        self._init(bounding_box)
         plot = BasicResultsPlot(self._indicator, self._results_provider, self._graph_units)
         
-        return plot.render(start_year=start_year, end_year=end_year, **kwargs)
+        with Profiler.stage("graph_frames"):
+            return plot.render(start_year=start_year, end_year=end_year, **kwargs)
 
-    def _init(self, bounding_box=None, **kwargs):
-        if not self._composite_layers:
-            self._composite_layers = LayerCollection(
-                background_color=self._background_color, colorizer=self._colorizer)
+    def _init(self, bounding_box=None):
+        if self._composite_layers:
+            return
 
-            layer_collections = []
-            for pattern, blend_mode in self._patterns.items():
-                layer_collections.extend([self._find_layers(pattern, bounding_box), blend_mode])
+        with Profiler.stage("composite_layers"):
+            if bounding_box:
+                self._composite_layers = self._crop_blend_layers(bounding_box)
+            else:
+                self._composite_layers = LayerCollection(
+                    background_color=self._background_color, colorizer=self._colorizer)
+
+                layer_collections = []
+                for pattern, blend_mode in self._patterns.items():
+                    layer_collections.extend([LayerCollection(self._find_component_layers(pattern)), blend_mode])
+
+                self._composite_layers = self._composite_layers.blend(*layer_collections)
 
-            self._composite_layers = self._composite_layers.blend(*layer_collections)
             self._results_provider = SpatialGcbmResultsProvider(layers=self._composite_layers.layers)
-       
-    def _find_layers(self, pattern, bounding_box=None):
+
+    def _crop_blend_layers(self, bounding_box):
+        # Each year's components are cropped, converted to the map units, and
+        # blended together in one pass.
+        components_by_year = defaultdict(list)
+        for pattern, blend_mode in self._patterns.items():
+            for layer in self._find_component_layers(pattern):
+                components_by_year[layer.year].extend([layer, blend_mode])
+
+        reference_raster = gdal.Open(bounding_box.path)
+        raster_pixels = reference_raster.RasterXSize * reference_raster.RasterYSize * len(self._patterns)
+        with ResourceGovernor.pool(raster_pixels) as pool:
+            tasks = [pool.apply_async(bounding_box.crop_blend, components, {"units": self._map_units})
+                     for components in components_by_year.values()]
+
+            layers = [task.get() for task in tasks]
+
+        return LayerCollection(layers, self._background_color, self._colorizer, bounding_box)
+
+    def _find_component_layers(self, pattern):
         units = Units.TcPerHa
         if isinstance(pattern, tuple):
             pattern, units = pattern
 
         layers = []
-        with Pool() as pool:
-            tasks = []
-            for layer_path in glob(pattern):
-                year = os.path.splitext(layer_path)[0][-4:]
-                layer = Layer(layer_path, year, units=units)
-                if bounding_box:
-                    tasks.append(pool.apply_async(bounding_box.crop, (layer,)))
-                else:
-                    layers.append(layer)
-
-            layers.extend((task.get() for task in tasks))
+        for layer_path, year in SpatialOutputCatalog.find(pattern):
+            if year:
+                layers.append(Layer(layer_path, year, units=units))
 
         if not layers:
             logging.warning(f"No spatial output found for pattern: {pattern}")
 
-        layer_collection = LayerCollection(layers, self._background_color)
-
-        return layer_collection
+        return layers
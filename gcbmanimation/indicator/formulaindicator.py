@@ -0,0 +1,130 @@
+import gdal
+from gcbmanimation.indicator.compositeindicator import CompositeIndicator
+from gcbmanimation.layer.units import Units
+from gcbmanimation.layer.layercollection import LayerCollection
+from gcbmanimation.layer.formulaengine import FormulaEngine
+from gcbmanimation.provider.spatialgcbmresultsprovider import SpatialGcbmResultsProvider
+from gcbmanimation.util.resourcegovernor import ResourceGovernor
+from gcbmanimation.util.profiler import Profiler
+
+class FormulaIndicator(CompositeIndicator):
+    '''
+    A spatial-only indicator calculated from a formula over other GCBM outputs,
+    i.e. ratios, clamped values, weighted sums, or the change since a base year.
+    See FormulaEngine for the formula syntax.
+
+    Arguments:
+    'indicator' -- the short name of the indicator.
+    'formula' -- the formula to calculate the indicator with, i.e.
+        "(NPP - Rh) / pixel_area", or "(NPP - NPP_base) / NPP_base * 100".
+    'components' -- a dictionary of the names used in the formula to the file
+        pattern (including directory path) in glob format for the spatial outputs
+        to use, i.e. {"NPP": "c:\\my_run\\NPP_*.tif"}; the file pattern can also be
+        a dictionary with a "pattern" entry and optional "year" entry to use the
+        output for a single year in every year's calculation, i.e. a base year,
+        and optional "units" entry (a Units enum value) for the native units of
+        the output if they aren't Units.TcPerHa.
+    'title' -- the indicator title for presentation - uses the indicator name if
+        not provided.
+    'units' -- a Units enum value for the formula result.
+    'graph_units' -- a Units enum value for the graph units - result values will
+        be converted to these units.
+    'map_units' -- a Units enum value for the map units - result values will be
+        converted to these units.
+    'background_color' -- the background (bounding box) color to use for the map
+        frames.
+    'colorizer' -- a Colorizer to create the map legend with - defaults to
+        simple Colorizer which bins values into equal-sized buckets.
+    '''
+
+    def __init__(self, indicator, formula, components, title=None, units=Units.TcPerHa,
+                 graph_units=Units.Tc, map_units=Units.TcPerHa, background_color=(255, 255, 255),
+                 colorizer=None):
+
+        super().__init__(indicator, {}, title, graph_units, map_units, background_color, colorizer)
+        self._formula_engine = FormulaEngine(formula)
+        self._components = components
+        self._units = units
+
+        unknown_components = set(self._formula_engine.variables) - set(components)
+        if unknown_components:
+            raise ValueError(f"No file pattern provided for {', '.join(sorted(unknown_components))} in {formula}")
+
+    @property
+    def spatial_output_patterns(self):
+        '''See Indicator.spatial_output_patterns.'''
+        return [self._get_pattern(name) for name in self._formula_engine.variables]
+
+    @property
+    def simulation_years(self):
+        '''Gets the years present in the simulation.'''
+        years = self._find_years(self._find_component_layers_by_year())
+
+        return min(years), max(years)
+
+    def _init(self, bounding_box=None):
+        if self._composite_layers:
+            return
+
+        with Profiler.stage("composite_layers"):
+            component_layers = self._find_component_layers_by_year()
+            years = self._find_years(component_layers)
+
+            first_component_layers = component_layers[self._formula_engine.variables[0]]
+            reference_raster = gdal.Open(bounding_box.path if bounding_box
+                                         else next(iter(first_component_layers.values())).path)
+
+            raster_pixels = reference_raster.RasterXSize * reference_raster.RasterYSize \
+                * len(self._formula_engine.variables)
+
+            with ResourceGovernor.pool(raster_pixels) as pool:
+                tasks = []
+                for year in years:
+                    year_layers = {
+                        name: layers[self._get_fixed_year(name) or year]
+                        for name, layers in component_layers.items()}
+
+                    tasks.append(pool.apply_async(
+                        self._formula_engine.evaluate, (year_layers, year),
+                        {"units": self._units, "bounding_box": bounding_box}))
+
+                layers = [task.get() for task in tasks]
+
+            self._composite_layers = LayerCollection(layers, self._background_color, self._colorizer, bounding_box)
+            self._results_provider = SpatialGcbmResultsProvider(layers=layers)
+
+    def _find_component_layers_by_year(self):
+        component_layers = {}
+        for name in self._formula_engine.variables:
+            pattern = self._get_pattern(name)
+            component_layers[name] = {layer.year: layer for layer in self._find_component_layers(pattern)}
+            fixed_year = self._get_fixed_year(name)
+            if fixed_year and fixed_year not in component_layers[name]:
+                raise IOError(f"No spatial output found for {name} in {fixed_year}")
+
+        return component_layers
+
+    def _find_years(self, component_layers):
+        # The formula can be calculated for the years where every component that
+        # changes over time has output.
+        years = None
+        for name, layers in component_layers.items():
+            if not self._get_fixed_year(name):
+                years = set(layers) if years is None else years & set(layers)
+
+        if not years:
+            raise IOError(f"No years with spatial output for every component of {self._formula_engine.formula}")
+
+        return sorted(years)
+
+    def _get_fixed_year(self, name):
+        component = self._components[name]
+
+        return int(component["year"]) if isinstance(component, dict) and "year" in component else None
+
+    def _get_pattern(self, name):
+        component = self._components[name]
+        if not isinstance(component, dict):
+            return component, Units.TcPerHa
+
+        return component["pattern"], component.get("units") or Units.TcPerHa
@@ -1,10 +1,12 @@
-import os
-from glob import glob
 from gcbmanimation.color.colorizer import Colorizer
 from gcbmanimation.layer.units import Units
 from gcbmanimation.layer.layer import Layer
 from gcbmanimation.layer.layercollection import LayerCollection
+from gcbmanimation.layer.layercube import LayerCube
 from gcbmanimation.plot.basicresultsplot import BasicResultsPlot
+from gcbmanimation.provider.spatialgcbmresultsprovider import SpatialGcbmResultsProvider
+from gcbmanimation.util.spatialoutputcatalog import SpatialOutputCatalog
+from gcbmanimation.util.profiler import Profiler
 
 class Indicator:
     '''
@@ -20,7 +22,8 @@ class Indicator:
         native units of the layers (i.e. Units.Tc) - otherwise the default of
         Units.TcPerHa is used.
     'results_provider' -- a GcbmResultsProvider for retrieving the non-spatial
-        GCBM results.
+        GCBM results; if None, the annual results are summed from the same
+        (cropped) spatial output that is rendered into the map frames.
     'provider_filter' -- filter to pass to results_provider to retrieve a single
         indicator.
     'title' -- the indicator title for presentation - uses the indicator name if
@@ -47,6 +50,8 @@ class Indicator:
         self._map_units = map_units or Units.TcPerHa
         self._background_color = background_color
         self._colorizer = colorizer or Colorizer()
+        self._spatial_results = results_provider is None
+        self._layers = None
 
     @property
     def title(self):
@@ -68,54 +73,140 @@ class Indicator:
         '''Gets the Units for the graphed/non-spatial output.'''
         return self._graph_units
 
+    @property
+    def results_provider(self):
+        '''Gets the GcbmResultsProvider for the non-spatial output, if any.'''
+        return self._results_provider
+
+    @property
+    def provider_filter(self):
+        '''Gets the filter passed to the results provider to retrieve this indicator.'''
+        return dict(self._provider_filter)
+
+    @property
+    def spatial_output_patterns(self):
+        '''
+        Gets the file patterns for the spatial output the indicator is made from,
+        as a list of (file pattern, Units) tuples.
+        '''
+        if isinstance(self._layer_pattern, tuple):
+            return [self._layer_pattern]
+
+        return [(self._layer_pattern, Units.TcPerHa)]
+
     @property
     def simulation_years(self):
         '''Gets the years present in the simulation.'''
+        if not self._results_provider:
+            self._find_layers()
+
         return self._results_provider.simulation_years
     
-    def render_map_frames(self, bounding_box=None, start_year=None, end_year=None):
+    def render_map_frames(self, bounding_box=None, start_year=None, end_year=None, frame_store=None,
+                          legend=None):
         '''
         Renders the indicator's spatial output into colorized Frame objects.
 
         Arguments:
         'bounding_box' -- optional bounding box Layer; spatial output will be
             cropped to the bounding box's minimum spatial extent and nodata pixels.
+        'frame_store' -- optional FrameStore to render incrementally; see
+            LayerCollection.render. The spatial output is then only cropped for
+            the years that have changed, instead of up front.
+        'legend' -- optional legend to color the map with instead of creating one
+            from the indicator's own output; see LayerCollection.render.
 
         Returns a list of colorized Frames, one for each year of output, and a
         legend in dictionary format describing the colors.
         '''
-        layers = self._find_layers()
+        with Profiler.stage("find_layers"):
+            layers = self._find_layers(bounding_box, crop=frame_store is None)
+
         if not start_year or not end_year:
             start_year, end_year = self._results_provider.simulation_years
         
-        return layers.render(bounding_box, start_year, end_year, self._map_units)
+        with Profiler.stage("map_frames"):
+            return layers.render(bounding_box, start_year, end_year, self._map_units, frame_store, legend)
+
+    def get_map_layers(self, bounding_box=None):
+        '''
+        Gets the LayerCollection that the indicator's map frames are rendered from.
 
-    def render_graph_frames(self, start_year=None, end_year=None, **kwargs):
+        Arguments:
+        'bounding_box' -- optional bounding box Layer; spatial output will be
+            cropped to the bounding box's minimum spatial extent and nodata pixels.
+        '''
+        with Profiler.stage("find_layers"):
+            return self._find_layers(bounding_box)
+
+    def release_layers(self):
+        '''
+        Lets go of the processed layers that the indicator keeps between rendering
+        its map and graph, so that their temporary files can be deleted; they are
+        processed again if they're needed again.
+        '''
+        self._layers = None
+        if self._spatial_results:
+            self._results_provider = None
+
+    def render_graph_frames(self, start_year=None, end_year=None, incremental=False, **kwargs):
         '''
         Renders the indicator's non-spatial output into a graph.
 
         Arguments:
+        'incremental' -- the map will be rendered incrementally (see
+            render_map_frames), so spatial results are only cropped for the years
+            whose totals aren't already cached, instead of up front.
         Any accepted by GCBMResultsProvider and subclasses.
 
         Returns a list of Frames, one for each year of output.
         '''
+        if self._spatial_results:
+            # The spatial results are summed from layers already cropped to the
+            # bounding box, so the provider doesn't need to crop them again -
+            # unless cropping is left to the provider for the years it needs.
+            bounding_box = kwargs.pop("bounding_box", None)
+            self._find_layers(bounding_box, crop=not incremental)
+            if incremental:
+                kwargs["bounding_box"] = bounding_box
+
         plot = BasicResultsPlot(self._indicator, self._results_provider, self._graph_units)
         
-        return plot.render(start_year=start_year, end_year=end_year, **self._provider_filter, **kwargs)
+        with Profiler.stage("graph_frames"):
+            return plot.render(start_year=start_year, end_year=end_year, **self._provider_filter, **kwargs)
        
-    def _find_layers(self):
+    def _find_layers(self, bounding_box=None, crop=True):
+        if self._layers:
+            cached_bounding_box, cropped, layers = self._layers
+            if cached_bounding_box is bounding_box and cropped == crop:
+                return layers
+
         pattern = self._layer_pattern
         units = Units.TcPerHa
         if isinstance(self._layer_pattern, tuple):
             pattern, units = self._layer_pattern
 
         layers = LayerCollection(background_color=self._background_color, colorizer=self._colorizer)
-        for layer_path in glob(pattern):
-            year = os.path.splitext(layer_path)[0][-4:]
-            layer = Layer(layer_path, year, units=units)
-            layers.append(layer)
+        for layer_path, year in SpatialOutputCatalog.find(pattern):
+            if year:
+                layers.append(Layer(layer_path, year, units=units))
 
         if layers.empty:
             raise IOError(f"No spatial output found for pattern: {self._layer_pattern}")
 
+        # Keep the cropped layers so that the map and graph are produced from the
+        # same intermediate files - optionally stacked into a single cube that is
+        # already in the map units. Incremental renders leave cropping until they
+        # know which years have changed; a cube covers every year, so it isn't
+        # used for them.
+        if bounding_box and crop and LayerCube.is_enabled():
+            cube = LayerCube.create(layers.layers, bounding_box, self._map_units)
+            layers = LayerCollection(cube.layers, self._background_color, self._colorizer, bounding_box)
+        elif bounding_box and crop:
+            layers = layers.crop(bounding_box)
+
+        self._layers = (bounding_box, crop, layers)
+        if self._spatial_results:
+            self._results_provider = SpatialGcbmResultsProvider(layers=layers.layers)
+
         return layers
@@ -3,8 +3,13 @@ import gdal
 import numpy as np
 from osgeo.scripts import gdal_calc
 from gcbmanimation.layer.layer import Layer
-from gcbmanimation.util.config import gdal_creation_options
-from gcbmanimation.util.config import gdal_memory_limit
+from gcbmanimation.layer.layer import BlendMode
+from gcbmanimation.layer.sparselayer import SparseLayer
+from gcbmanimation.layer.units import Units
+from gcbmanimation.util.config import IOProfile
+from gcbmanimation.util.operationmemo import OperationMemo
+from gcbmanimation.util.profiler import Profiler
+from gcbmanimation.util.resourcegovernor import ResourceGovernor
 from gcbmanimation.util.tempfile import TempFileManager
 
 class BoundingBox(Layer):
@@ -22,6 +27,8 @@ class BoundingBox(Layer):
         self._min_geographic_bounds = None
         self._initialized = False
         self._projection = projection
+        self._identity = self._derive_identity("bounding_box", projection)
+        self._window = None
     
     @property
     def min_pixel_bounds(self):
@@ -70,6 +77,66 @@ class BoundingBox(Layer):
 
         return self._min_geographic_bounds
 
+    def prepare(self):
+        '''
+        Prepares the bounding box for use, if it hasn't been already: reduces it to
+        the minimum extent of its data pixels, in the target projection. This is
+        done automatically by operations that crop other layers; after this, the
+        bounding box's path points to the prepared raster.
+        '''
+        if not self._initialized:
+            self._init()
+
+    def split(self, tile_count):
+        '''
+        Splits the bounding box into tiles - horizontal strips of whole rows - to
+        crop and process the parts of a layer in parallel. Cropping a layer to
+        each tile gives the same pixels as the corresponding rows of the layer
+        cropped to the whole bounding box.
+
+        Arguments:
+        'tile_count' -- the number of tiles to split the bounding box into.
+
+        Returns a list of BoundingBox objects for the tiles, from top to bottom.
+        '''
+        self.prepare()
+
+        width, height = self.info["size"]
+        tile_height = -(-height // max(1, min(tile_count, height)))
+        tiles = []
+        for y_offset in range(0, height, tile_height):
+            window = (0, y_offset, width, min(tile_height, height - y_offset))
+            tile_identity = self._derive_identity("tile", window)
+            tile_path = OperationMemo.get_or_compute(tile_identity, lambda: self._create_tile(window))
+            tile = BoundingBox(tile_path, self._projection)
+            tile._identity = tile_identity
+            tile._initialized = True
+            tile._window = window
+            tiles.append(tile)
+
+        return tiles
+
+    def slice(self, layer):
+        '''
+        Gets this tile's rows of a layer that has already been cropped to the
+        bounding box the tile was split from (see BoundingBox.split). This gives
+        the same pixels as cropping the original layer to the tile, but copies
+        them from the cropped layer instead of warping the original again.
+
+        Arguments:
+        'layer' -- the cropped layer to slice.
+
+        Returns a new Layer object for the tile's rows of the layer.
+        '''
+        if self._window is None:
+            raise RuntimeError("Only tiles of a bounding box can slice a layer.")
+
+        sliced_identity = layer._derive_identity("slice", self._window)
+        with Profiler.stage("slice", layer.year):
+            output_path = OperationMemo.get_or_compute(sliced_identity, lambda: self._slice(layer))
+
+        return Layer(output_path, layer.year, layer.interpretation, layer.units, sliced_identity)
+
     def crop(self, layer):
         '''
         Crops a Layer to the minimum spatial extent and nodata pixels of this
@@ -80,14 +147,114 @@ class BoundingBox(Layer):
 
         Returns a new cropped Layer object.
         '''
-        if not self._initialized:
-            self._init()
+        if isinstance(layer, SparseLayer):
+            return layer.crop(self)
+
+        self.prepare()
+
+        cropped_identity = layer._derive_identity("crop", self.identity)
+        with Profiler.stage("crop", layer.year):
+            output_path = OperationMemo.get_or_compute(cropped_identity, lambda: self._crop(layer))
+
+        cropped_layer = Layer(output_path, layer.year, layer.interpretation, layer.units, cropped_identity)
+
+        return cropped_layer
+
+    def crop_blend(self, *layers, units=Units.TcPerHa):
+        '''
+        Crops, converts and blends one or more layers in a single pass: equivalent
+        to cropping each layer to this bounding box, converting it into the target
+        units, and adding or subtracting it from a running total starting at 0,
+        but without writing the intermediate rasters. Pixels where any of the
+        layers are nodata become 0.
+
+        Arguments:
+        'layers' -- one or more layers to blend paired with the blend mode, i.e.
+            bounding_box.crop_blend(layer_a, BlendMode.Add, layer_b, BlendMode.Subtract)
+        'units' -- the units for the blended layer.
 
+        Returns a new cropped and blended Layer object for the same year as the
+        first layer.
+        '''
+        self.prepare()
+
+        blend_layers = list(zip(layers[::2], layers[1::2]))
+        blended_identity = self._derive_identity("crop_blend", units.name, *(
+            (layer.identity, layer.units.name, blend_mode.value) for layer, blend_mode in blend_layers))
+
+        with Profiler.stage("crop_blend", blend_layers[0][0].year):
+            output_path = OperationMemo.get_or_compute(
+                blended_identity, lambda: self._crop_blend(blend_layers, units))
+
+        return Layer(output_path, blend_layers[0][0].year, units=units, identity=blended_identity)
+
+    def _crop_blend(self, blend_layers, units):
+        ResourceGovernor.apply_gdal_limits()
+        width, height = self.info["size"]
+        output_bounds = (self.info["cornerCoordinates"]["upperLeft"][0],
+                         self.info["cornerCoordinates"]["lowerRight"][1],
+                         self.info["cornerCoordinates"]["lowerRight"][0],
+                         self.info["cornerCoordinates"]["upperLeft"][1])
+
+        bbox_raster = gdal.Open(self._path)
+        bbox_data = bbox_raster.GetRasterBand(1).ReadAsArray()
+        blended_data = np.zeros((height, width), dtype=np.float64)
+        data_mask = np.ones((height, width), dtype=bool)
+        nodata_value = None
+        row_conversion_factors = {}
+        for layer, blend_mode in blend_layers:
+            # Area conversions in a geographic coordinate system vary by latitude,
+            # so they're applied to the cropped pixels row by row.
+            unit_conversion_factor = self._get_unit_conversion_factor(layer.units, units)
+            if unit_conversion_factor is None:
+                if layer.units not in row_conversion_factors:
+                    row_conversion_factors[layer.units] = self._get_row_conversion_factors(
+                        layer.units, units, bbox_raster.GetGeoTransform(), height)
+
+                unit_conversion_factor = row_conversion_factors[layer.units]
+
+            # Warp to a virtual raster so that the cropped layer is only read, never written.
+            cropped_layer = gdal.Warp("", layer.path, format="VRT", dstSRS=self._get_srs(),
+                                      width=width, height=height, outputBounds=output_bounds)
+
+            band = cropped_layer.GetRasterBand(1)
+            layer_data = band.ReadAsArray().astype(np.float64)
+            layer_nodata_value = band.GetNoDataValue()
+            if layer_nodata_value is not None:
+                data_mask &= layer_data != layer_nodata_value
+                nodata_value = layer_nodata_value if nodata_value is None else nodata_value
+
+            data_mask &= np.isfinite(layer_data)
+            layer_data *= unit_conversion_factor
+            if blend_mode == BlendMode.Subtract:
+                blended_data -= layer_data
+            else:
+                blended_data += layer_data
+
+        nodata_value = -1 if nodata_value is None else nodata_value
+        blended_data[~data_mask] = 0
+        blended_data[bbox_data == self.nodata_value] = nodata_value
+
+        output_path = TempFileManager.mktmp(suffix=".tif")
+        output_raster = gdal.GetDriverByName("GTiff").Create(
+            output_path, width, height, 1, gdal.GDT_Float32, IOProfile.Scratch.creation_options)
+
+        output_raster.SetGeoTransform(bbox_raster.GetGeoTransform())
+        output_raster.SetProjection(bbox_raster.GetProjection())
+        band = output_raster.GetRasterBand(1)
+        band.SetNoDataValue(nodata_value)
+        band.WriteArray(blended_data.astype(np.float32))
+        output_raster = None
+
+        return output_path
+
+    def _crop(self, layer):
         # Clip to bounding box geographical area.
-        tmp_path = TempFileManager.mktmp(suffix=".tif")
         width, height = self.info["size"]
-        gdal.SetCacheMax(gdal_memory_limit)
-        gdal.Warp(tmp_path, layer.path, dstSRS=self._get_srs(), creationOptions=gdal_creation_options,
+        tmp_path = TempFileManager.mktmp(suffix=".tif", process_local=True, size_hint=width * height * 8)
+        ResourceGovernor.apply_gdal_limits()
+        gdal.Warp(tmp_path, layer.path, dstSRS=self._get_srs(),
+                  creationOptions=IOProfile.Scratch.creation_options,
                   width=width, height=height,
                   outputBounds=(self.info["cornerCoordinates"]["upperLeft"][0],
                                 self.info["cornerCoordinates"]["lowerRight"][1],
@@ -98,32 +265,57 @@ class BoundingBox(Layer):
         calc = "A * (B != {0}) + ((B == {0}) * {1})".format(self.nodata_value, layer.nodata_value)
         output_path = TempFileManager.mktmp(suffix=".tif")
         gdal_calc.Calc(calc, output_path, layer.nodata_value, quiet=True,
-                       creation_options=gdal_creation_options,
+                       creation_options=IOProfile.Scratch.creation_options,
                        overwrite=True, A=tmp_path, B=self.path)
 
-        cropped_layer = Layer(output_path, layer.year, layer.interpretation, layer.units)
+        TempFileManager.remove(tmp_path)
 
-        return cropped_layer
+        return output_path
+
+    def _slice(self, layer):
+        output_path = TempFileManager.mktmp(suffix=".tif")
+        ResourceGovernor.apply_gdal_limits()
+        gdal.Translate(output_path, layer.path, srcWin=self._window,
+                       creationOptions=IOProfile.Scratch.creation_options)
+
+        return output_path
+
+    def _create_tile(self, window):
+        # Tiles are kept for the rest of the run like the prepared bounding box.
+        tile_path = TempFileManager.mktmp(no_manual_cleanup=True, suffix=".tif")
+        ResourceGovernor.apply_gdal_limits()
+        gdal.Translate(tile_path, self._path, srcWin=window,
+                       creationOptions=IOProfile.Scratch.creation_options)
+
+        return tile_path
 
     def _init(self):
-        bbox_path = TempFileManager.mktmp(no_manual_cleanup=True, suffix=".tif")
-        gdal.SetCacheMax(gdal_memory_limit)
+        # Every pool worker gets its own copy of the bounding box, but only the
+        # first to need it does the work of preparing it.
+        with Profiler.stage("prepare_bounding_box"):
+            self._path = OperationMemo.get_or_compute(self._derive_identity("init"), self._prepare)
+
+        self._min_geographic_bounds = None
+        self._min_pixel_bounds = None
+        self._info = None
+        self._initialized = True
+
+    def _prepare(self):
+        bbox_path = TempFileManager.mktmp(suffix=".tif")
+        ResourceGovernor.apply_gdal_limits()
         gdal.Warp(bbox_path, self._path,
                   outputBounds=self.min_geographic_bounds,
                   outputBoundsSRS=self._get_srs(),
                   dstSRS=self._projection or self._get_srs(),
-                  creationOptions=gdal_creation_options)
+                  creationOptions=IOProfile.Scratch.creation_options)
 
         # Warp again to fix projection issues - sometimes will be flipped vertically
         # from the original.
         final_bbox_path = TempFileManager.mktmp(no_manual_cleanup=True, suffix=".tif")
-        gdal.Warp(final_bbox_path, bbox_path, creationOptions=gdal_creation_options)
+        gdal.Warp(final_bbox_path, bbox_path, creationOptions=IOProfile.Scratch.creation_options)
+        TempFileManager.remove(bbox_path)
 
-        self._path = final_bbox_path
-        self._min_geographic_bounds = None
-        self._min_pixel_bounds = None
-        self._info = None
-        self._initialized = True
+        return final_bbox_path
 
     def _get_srs(self):
         layer_data = gdal.Open(self._path)
@@ -0,0 +1,235 @@
+import ast
+import hashlib
+import gdal
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from geopy.distance import distance
+from gcbmanimation.layer.layer import Layer
+from gcbmanimation.layer.units import Units
+from gcbmanimation.util.config import IOProfile
+from gcbmanimation.util.operationmemo import OperationMemo
+from gcbmanimation.util.profiler import Profiler
+from gcbmanimation.util.resourcegovernor import ResourceGovernor
+from gcbmanimation.util.tempfile import TempFileManager
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+class FormulaEngine:
+    '''
+    Evaluates a formula over a set of layers, i.e. "(NPP - Rh) / pixel_area",
+    reading the layers in blocks of rows spread over multiple threads and writing
+    only the result - no intermediate rasters. Formulas use numexpr syntax and are
+    evaluated with numexpr if it's installed, or NumPy otherwise. Any pixel where
+    one of the layers is nodata, or where the result isn't a finite number (i.e.
+    division by zero), becomes nodata.
+
+    Besides the layer names, formulas can use 'pixel_area', the area of each pixel
+    in hectares, and the functions: where, abs, sqrt, exp, log, log10, sin, cos,
+    tan, arcsin, arccos, arctan. Conditions are combined with &, | and ~ rather
+    than and, or and not, i.e. "where((NPP > 0) & (Rh > 0), NPP / Rh, 0)".
+
+    Arguments:
+    'formula' -- the formula to evaluate.
+    'threads' -- the number of threads to use; defaults to the number of CPU
+        threads available to the process.
+    '''
+
+    chunk_pixels = 2 ** 22
+    nodata_value = float(np.finfo(np.float32).min)
+
+    _functions = {
+        "where": np.where, "abs": np.abs, "sqrt": np.sqrt, "exp": np.exp, "log": np.log,
+        "log10": np.log10, "sin": np.sin, "cos": np.cos, "tan": np.tan, "arcsin": np.arcsin,
+        "arccos": np.arccos, "arctan": np.arctan
+    }
+
+    _builtin_variables = ("pixel_area",)
+
+    # Python 3.7 parses numbers as ast.Num rather than ast.Constant. Boolean
+    # operators (and, or, not) don't work on arrays - formulas use &, | and ~.
+    _allowed_nodes = (
+        ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name, ast.Load,
+        ast.Constant, getattr(ast, "Num", ast.Constant), ast.operator, ast.UAdd, ast.USub,
+        ast.Invert, ast.cmpop)
+
+    def __init__(self, formula, threads=None):
+        self._formula = formula
+        self._threads = threads
+        self._variables = self._parse(formula)
+
+    @property
+    def formula(self):
+        '''Gets the formula.'''
+        return self._formula
+
+    @property
+    def variables(self):
+        '''Gets the names of the layers used in the formula.'''
+        return [name for name in self._variables if name not in self._builtin_variables]
+
+    def evaluate(self, layers, year, units=Units.Blank, bounding_box=None):
+        '''
+        Evaluates the formula for a single year.
+
+        Arguments:
+        'layers' -- dictionary of name in the formula to Layer.
+        'year' -- the year the result applies to.
+        'units' -- the units of the result.
+        'bounding_box' -- optional BoundingBox to crop the result to; otherwise
+            the result uses the extent and resolution of the first layer.
+
+        Returns a new Layer containing the result.
+        '''
+        missing_layers = set(self.variables) - set(layers)
+        if missing_layers:
+            raise ValueError(f"No layers provided for {', '.join(sorted(missing_layers))} in {self._formula}")
+
+        identity = hashlib.sha1(repr((
+            "formula", self._formula,
+            sorted((name, layers[name].identity) for name in self.variables),
+            bounding_box.identity if bounding_box else None
+        )).encode("utf-8")).hexdigest()
+
+        with Profiler.stage("formula", year):
+            output_path = OperationMemo.get_or_compute(identity, lambda: self._evaluate(layers, bounding_box))
+
+        return Layer(output_path, year, units=units, identity=identity)
+
+    def _parse(self, formula):
+        try:
+            tree = ast.parse(formula, mode="eval")
+        except SyntaxError as e:
+            raise ValueError(f"Invalid formula: {formula} ({e})")
+
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.BoolOp, ast.Not)):
+                raise ValueError(f"Use &, | and ~ instead of and, or and not in formula: {formula}")
+
+            if not isinstance(node, self._allowed_nodes):
+                raise ValueError(f"Unsupported expression in formula: {formula}")
+
+            if isinstance(node, ast.Call) and not (
+                isinstance(node.func, ast.Name) and node.func.id in self._functions
+            ):
+                raise ValueError(f"Unsupported function in formula: {formula}")
+
+        function_names = {node.func.id for node in ast.walk(tree) if isinstance(node, ast.Call)}
+        variables = sorted({
+            node.id for node in ast.walk(tree)
+            if isinstance(node, ast.Name) and node.id not in function_names})
+
+        if not any(name not in self._builtin_variables for name in variables):
+            raise ValueError(f"Formula doesn't use any layers: {formula}")
+
+        return variables
+
+    def _evaluate(self, layers, bounding_box=None):
+        ResourceGovernor.apply_gdal_limits()
+        if bounding_box:
+            bounding_box.prepare()
+
+        reference_path = bounding_box.path if bounding_box else layers[self.variables[0]].path
+        reference_raster = gdal.Open(reference_path)
+        width, height = reference_raster.RasterXSize, reference_raster.RasterYSize
+        geotransform = reference_raster.GetGeoTransform()
+        projection = reference_raster.GetProjection()
+        origin_x, pixel_size_x, _, origin_y, _, pixel_size_y = geotransform
+        output_bounds = (origin_x, origin_y + pixel_size_y * height, origin_x + pixel_size_x * width, origin_y)
+
+        # Warp each layer to a virtual raster on the output grid so that it's only
+        # ever read, never written.
+        input_paths = {}
+        for name in self.variables:
+            input_paths[name] = TempFileManager.mktmp(suffix=".vrt", process_local=True)
+            gdal.Warp(input_paths[name], layers[name].path, format="VRT", dstSRS=projection,
+                      width=width, height=height, outputBounds=output_bounds)
+
+        pixel_areas = self._get_pixel_areas(geotransform, projection, height) \
+            if "pixel_area" in self._variables else None
+
+        output_path = TempFileManager.mktmp(suffix=".tif")
+        output_raster = gdal.GetDriverByName("GTiff").Create(
+            output_path, width, height, 1, gdal.GDT_Float32, IOProfile.Scratch.creation_options)
+
+        output_raster.SetGeoTransform(geotransform)
+        output_raster.SetProjection(projection)
+        output_band = output_raster.GetRasterBand(1)
+        output_band.SetNoDataValue(self.nodata_value)
+
+        rows_per_chunk = max(1, self.chunk_pixels // width)
+        chunks = [(y, min(rows_per_chunk, height - y)) for y in range(0, height, rows_per_chunk)]
+        mask_path = bounding_box.path if bounding_box else None
+        threads = min(self._threads or ResourceGovernor.worker_threads(), len(chunks))
+
+        # Parallelism comes from evaluating several chunks at once, so numexpr
+        # shouldn't start threads of its own as well.
+        if numexpr:
+            numexpr.set_num_threads(1)
+
+        with ThreadPoolExecutor(threads) as executor:
+            results = executor.map(
+                lambda chunk: self._evaluate_rows(input_paths, mask_path, pixel_areas, *chunk), chunks)
+
+            # GDAL datasets can't be written to from multiple threads.
+            for (y_offset, _), result in zip(chunks, results):
+                output_band.WriteArray(result, 0, y_offset)
+
+        output_raster = None
+        for path in input_paths.values():
+            TempFileManager.remove(path)
+
+        return output_path
+
+    def _evaluate_rows(self, input_paths, mask_path, pixel_areas, y_offset, rows):
+        # Each thread needs its own dataset handles - they can't be shared.
+        data = {}
+        data_mask = None
+        for name, path in input_paths.items():
+            band = gdal.Open(path).GetRasterBand(1)
+            layer_data = band.ReadAsArray(0, y_offset, band.XSize, rows).astype(np.float64)
+            layer_mask = np.isfinite(layer_data)
+            nodata_value = band.GetNoDataValue()
+            if nodata_value is not None:
+                layer_mask &= layer_data != nodata_value
+
+            data_mask = layer_mask if data_mask is None else data_mask & layer_mask
+            data[name] = layer_data
+
+        if mask_path:
+            mask_band = gdal.Open(mask_path).GetRasterBand(1)
+            data_mask &= mask_band.ReadAsArray(0, y_offset, mask_band.XSize, rows) != mask_band.GetNoDataValue()
+
+        if pixel_areas is not None:
+            data["pixel_area"] = pixel_areas if np.isscalar(pixel_areas) \
+                else pixel_areas[y_offset:y_offset + rows, np.newaxis]
+
+        with np.errstate(all="ignore"):
+            if numexpr:
+                result = numexpr.evaluate(self._formula, local_dict=data, global_dict={})
+            else:
+                result = eval(self._formula, {"__builtins__": {}}, {**self._functions, **data})
+
+            result = np.broadcast_to(result, data_mask.shape).astype(np.float32)
+
+        result[~(data_mask & np.isfinite(result))] = self.nodata_value
+
+        return result
+
+    def _get_pixel_areas(self, geotransform, projection, height):
+        origin_x, pixel_size_x, _, origin_y, _, pixel_size_y = geotransform
+        one_hectare = 100 ** 2
+        if "metre" in projection:
+            return abs(pixel_size_x * pixel_size_y) / one_hectare
+
+        # In a geographic coordinate system the pixel area depends on the latitude.
+        pixel_areas = np.empty(height, dtype=np.float64)
+        for row in range(height):
+            lat = origin_y + pixel_size_y * row
+            lat_size_m = distance((lat, origin_x), (lat + pixel_size_y, origin_x)).m
+            lon_size_m = distance((lat, origin_x), (lat, origin_x + pixel_size_x)).m
+            pixel_areas[row] = lat_size_m * lon_size_m / one_hectare
+
+        return pixel_areas
@@ -1,16 +1,18 @@
 import gdal
 import json
+import hashlib
 import logging
 import os
-import subprocess
 import numpy as np
 from itertools import chain
 from enum import Enum
 from string import ascii_uppercase
 from osgeo.scripts import gdal_calc
 from geopy.distance import distance
-from gcbmanimation.util.config import gdal_creation_options
-from gcbmanimation.util.config import gdal_memory_limit
+from gcbmanimation.util.config import IOProfile
+from gcbmanimation.util.operationmemo import OperationMemo
+from gcbmanimation.util.profiler import Profiler
+from gcbmanimation.util.resourcegovernor import ResourceGovernor
 from gcbmanimation.util.tempfile import TempFileManager
 from gcbmanimation.animator.frame import Frame
 from gcbmanimation.layer.units import Units
@@ -34,14 +36,22 @@ class Layer:
     'interpretation' -- optional attribute table for the raster; should be a
         dictionary of pixel value to interpretation, i.e. {1: "Wildfire"}
     'units' -- the units the layer's pixel values are in
+    'identity' -- optional key identifying the layer's pixel content; by default
+        this is taken from the file's path, size and modification time.
     '''
 
-    def __init__(self, path, year, interpretation=None, units=Units.TcPerHa):
+    def __init__(self, path, year, interpretation=None, units=Units.TcPerHa, identity=None):
         self._path = path
         self._year = int(year)
         self._interpretation = interpretation
         self._units = units
         self._info = None
+        self._identity = identity
+        TempFileManager.track(self, path)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        TempFileManager.track(self, self._path)
 
     @property
     def interpretation(self):
@@ -66,6 +76,23 @@ class Layer:
         '''Gets the year the layer applies to.'''
         return self._year
 
+    @property
+    def identity(self):
+        '''
+        Gets a key identifying this layer's pixel content: the absolute path, size
+        and modification time of an original file, or for a layer produced from
+        others, a hash of their identities and the operation that produced it.
+        '''
+        if not self._identity:
+            if self._path.startswith("/vsi"):
+                file_stat = gdal.VSIStatL(self._path)
+                self._identity = f"{self._path}:{file_stat.size}:{file_stat.mtime}"
+            else:
+                file_stat = os.stat(self._path)
+                self._identity = f"{os.path.abspath(self._path)}:{file_stat.st_size}:{file_stat.st_mtime_ns}"
+
+        return self._identity
+
     @property
     def info(self):
         '''Gets this layer's GDAL info dictionary, including min/max values.'''
@@ -84,6 +111,13 @@ class Layer:
 
         return (info["bands"][0]["computedMin"], info["bands"][0]["computedMax"])
 
+    @property
+    def has_data(self):
+        '''Checks if this layer has any pixels that aren't nodata.'''
+        info = self.info
+
+        return bool(info) and "computedMin" in info["bands"][0]
+
     @property
     def data_type(self):
         '''Gets this layer's data type.'''
@@ -123,6 +157,23 @@ class Layer:
         
         return band.GetHistogram(min=min_value, max=max_value, buckets=buckets)
 
+    def get_unit_conversion_factor(self, units):
+        '''
+        Gets the constant factor that converts this layer's pixel values into new
+        units, if there is one. Conversions between the same area type (per hectare
+        or absolute), or between area types in a projected coordinate system where
+        every pixel is the same size, are a simple multiplication; conversions
+        between area types in a geographic coordinate system depend on the latitude
+        of each pixel and have no single factor.
+
+        Arguments:
+        'units' -- the Units enum value to convert to
+
+        Returns the conversion factor, or None if the conversion must be done
+        pixel by pixel.
+        '''
+        return self._get_unit_conversion_factor(self._units, units)
+
     def convert_units(self, units):
         '''
         Converts this layer's values into new units - both scale and area type
@@ -136,63 +187,17 @@ class Layer:
         if self._units == Units.Blank:
             return self
 
-        gdal.SetCacheMax(gdal_memory_limit)
-        current_per_ha, current_units_tc, current_units_name = self._units.value
-        new_per_ha, new_units_tc, new_units_name = units.value
-        unit_conversion = current_units_tc / new_units_tc
-
-        if current_per_ha == new_per_ha and unit_conversion == 1:
+        unit_conversion_factor = self.get_unit_conversion_factor(units)
+        if unit_conversion_factor == 1:
             self._units = units
             return self
 
-        output_path = TempFileManager.mktmp(suffix=".tif")
-        one_hectare = 100 ** 2
-
-        simple_conversion_calc = None
-        if current_per_ha == new_per_ha:
-            simple_conversion_calc = " ".join((
-                f"(A * {unit_conversion})",
-                f"* (A != {self.nodata_value})",
-                f"+ ((A == {self.nodata_value}) * {self.nodata_value})"))
-        elif "metre" in self.info["coordinateSystem"]["wkt"]:
-            per_ha_conversion_op = "*" if current_per_ha else "/"
-            _, pixel_size, *_ = self.info["geoTransform"]
-            pixel_size_m2 = float(pixel_size) ** 2
-            per_ha_modifier = pixel_size_m2 / one_hectare if current_per_ha != new_per_ha else 1
-            simple_conversion_calc = " ".join((
-                f"(A * {unit_conversion} {per_ha_conversion_op} {per_ha_modifier})",
-                f"* (A != {self.nodata_value})",
-                f"+ ((A == {self.nodata_value}) * {self.nodata_value})"))
-
-        if simple_conversion_calc:
-            gdal_calc.Calc(simple_conversion_calc, output_path, self.nodata_value, quiet=True,
-                           creation_options=gdal_creation_options,
-                           overwrite=True, A=self.path)
-
-            return Layer(output_path, self._year, self._interpretation, units)
-
-        raster = gdal.Open(self._path)
-        band = raster.GetRasterBand(1)
-        raster_data = band.ReadAsArray()
-        width = raster.RasterXSize
-        height = raster.RasterYSize
-        origin_x, pixel_size_x, _, origin_y, _, pixel_size_y = raster.GetGeoTransform()
-        for row in range(height):
-            for col in range(width):
-                lat = origin_y - pixel_size_y * row
-                lon = origin_x + pixel_size_x * col
-                lat_size_m = distance((lat, lon), (lat - pixel_size_y, lon)).m
-                lon_size_m = distance((lat, lon), (lat, lon + pixel_size_x)).m
-                pixel_size_ha = lat_size_m * lon_size_m / one_hectare
-                pixel_value = raster_data[row][col]
-                if pixel_value != self.nodata_value:
-                    raster_data[row][col] = unit_conversion * (
-                        pixel_value * pixel_size_ha if current_per_ha
-                        else pixel_value / pixel_size_ha)
+        converted_identity = self._derive_identity("convert_units", self._units.name, units.name)
+        with Profiler.stage("convert_units", self._year):
+            output_path = OperationMemo.get_or_compute(
+                converted_identity, lambda: self._convert_units(units, unit_conversion_factor))
 
-        self._save_as(raster_data, self.nodata_value, output_path)
-        
-        return Layer(output_path, self._year, self._interpretation, units)
+        return Layer(output_path, self._year, self._interpretation, units, converted_identity)
 
     def reclassify(self, new_interpretation, nodata_value=0):
         '''
@@ -208,36 +213,51 @@ class Layer:
         
         Returns a new reclassified Layer object.
         '''
-        gdal.SetCacheMax(gdal_memory_limit)
-        logging.debug(f"Reclassifying {self._path}")
-        raster = gdal.Open(self._path)
-        band = raster.GetRasterBand(1)
-        raster_data = band.ReadAsArray()
+        return Layer.reclassify_shared([self], new_interpretation, nodata_value)[0]
 
-        uninterpreted_values = np.isin(raster_data, list(self._interpretation.keys()), invert=True)
-        raster_data[uninterpreted_values] = nodata_value
-        
-        # Guard against conflicts between original and reclassified pixel values
-        # before updating anything.
-        collision_offset = max(chain(self._interpretation.keys(), new_interpretation.keys())) + 1
-        raster_data[raster_data != nodata_value] += collision_offset
+    @staticmethod
+    def reclassify_shared(layers, new_interpretation, nodata_value=0):
+        '''
+        Reclassifies several layers that share the same raster file but have
+        different interpretations - i.e. the years of a multi-year disturbance
+        layer - reading the file only once. See Layer.reclassify.
 
-        inverse_new_interpretation = {v: k for k, v in new_interpretation.items()}
-        for original_pixel_value, interpreted_value in self._interpretation.items():
-            new_pixel_value = inverse_new_interpretation[interpreted_value] \
-                if interpreted_value in inverse_new_interpretation \
-                else nodata_value
+        Arguments:
+        'layers' -- the layers to reclassify; must all have the same path.
+        'new_interpretation' -- dictionary of pixel value to interpreted value.
+        'nodata_value' -- the new nodata pixel value.
 
-            if new_pixel_value == nodata_value:
-                logging.info(f"  No new pixel value for {interpreted_value}: setting to nodata ({nodata_value})")
+        Returns a list of new reclassified Layer objects in the same order as
+        the original layers.
+        '''
+        raster_data = None
 
-            raster_data[raster_data == original_pixel_value + collision_offset] = new_pixel_value
+        def reclassify_layer(layer):
+            # The shared file is only read if at least one of the layers hasn't
+            # already been reclassified.
+            nonlocal raster_data
+            if raster_data is None:
+                ResourceGovernor.apply_gdal_limits()
+                logging.debug(f"Reclassifying {layers[0].path} for years {[layer.year for layer in layers]}")
+                raster = gdal.Open(layers[0].path)
+                band = raster.GetRasterBand(1)
+                raster_data = band.ReadAsArray()
 
-        output_path = TempFileManager.mktmp(suffix=".tif")
-        self._save_as(raster_data, nodata_value, output_path)
-        reclassified_layer = Layer(output_path, self._year, new_interpretation, self._units)
+            return layer._save_reclassified(raster_data.copy(), new_interpretation, nodata_value)
+
+        reclassified_layers = []
+        for layer in layers:
+            reclassified_identity = layer._derive_identity(
+                "reclassify", sorted(layer._interpretation.items()),
+                sorted(new_interpretation.items()), nodata_value)
 
-        return reclassified_layer
+            with Profiler.stage("reclassify", layer.year):
+                output_path = OperationMemo.get_or_compute(reclassified_identity, lambda: reclassify_layer(layer))
+
+            reclassified_layers.append(Layer(output_path, layer.year, new_interpretation, layer.units,
+                                             reclassified_identity))
+
+        return reclassified_layers
 
     def flatten(self, flattened_value=1, preserve_units=False):
         '''
@@ -250,15 +270,12 @@ class Layer:
 
         Returns a new flattened Layer object.
         '''
-        gdal.SetCacheMax(gdal_memory_limit)
-        logging.debug(f"Flattening {self._path}")
-        raster = gdal.Open(self._path)
-        band = raster.GetRasterBand(1)
-        raster_data = band.ReadAsArray()
-        raster_data[raster_data != self.nodata_value] = flattened_value
-        output_path = TempFileManager.mktmp(suffix=".tif")
-        self._save_as(raster_data, self.nodata_value, output_path)
-        flattened_layer = Layer(output_path, self.year, units=self._units if preserve_units else Units.Blank)
+        flattened_identity = self._derive_identity("flatten", flattened_value)
+        with Profiler.stage("flatten", self._year):
+            output_path = OperationMemo.get_or_compute(flattened_identity, lambda: self._flatten(flattened_value))
+
+        flattened_layer = Layer(output_path, self.year, units=self._units if preserve_units else Units.Blank,
+                                identity=flattened_identity)
 
         return flattened_layer
 
@@ -269,11 +286,12 @@ class Layer:
         Arguments:
         'projection' -- the new projection, i.e. NAD83.
         '''
-        output_path = TempFileManager.mktmp(suffix=".tif")
-        gdal.SetCacheMax(gdal_memory_limit)
-        gdal.Warp(output_path, self._path, dstSRS=projection, creationOptions=gdal_creation_options)
+        reprojected_identity = self._derive_identity("reproject", projection)
+        with Profiler.stage("reproject", self._year):
+            output_path = OperationMemo.get_or_compute(reprojected_identity, lambda: self._reproject(projection))
 
-        reprojected_layer = Layer(output_path, self._year, self._interpretation, self._units)
+        reprojected_layer = Layer(output_path, self._year, self._interpretation, self._units,
+                                  reprojected_identity)
 
         return reprojected_layer
 
@@ -285,36 +303,48 @@ class Layer:
         'layers' -- one or more other layers to blend paired with the blend mode, i.e.
             some_layer.blend(layer_a, BlendMode.Add, layer_b, BlendMode.Subtract)
         '''
-        blend_layers = {
-            ascii_uppercase[i]: (layer.convert_units(self._units), blend_mode)
-            for i, (layer, blend_mode) in enumerate(zip(layers[::2], layers[1::2]), 1)
-        }
+        blend_layers = {}
+        for i, (layer, blend_mode) in enumerate(zip(layers[::2], layers[1::2]), 1):
+            # Scale factors are folded into the blend expression rather than
+            # rewriting the other layer's pixels first.
+            unit_conversion_factor = layer.get_unit_conversion_factor(self._units)
+            if unit_conversion_factor is None:
+                layer = layer.convert_units(self._units)
+                unit_conversion_factor = 1
+
+            blend_layers[ascii_uppercase[i]] = (layer, blend_mode, unit_conversion_factor)
 
         calc = "(A "
         calc += " ".join((
-            f"{blend_mode.value} {layer_key}"
-            for layer_key, (layer, blend_mode) in blend_layers.items()))
+            f"{blend_mode.value} {layer_key}" if unit_conversion_factor == 1
+            else f"{blend_mode.value} ({layer_key} * {unit_conversion_factor})"
+            for layer_key, (layer, blend_mode, unit_conversion_factor) in blend_layers.items()))
 
         calc += f") * (A != {self.nodata_value}) * "
         calc += " * ".join((
             f"({layer_key} != {layer.nodata_value})"
-            for layer_key, (layer, blend_mode) in blend_layers.items()))
+            for layer_key, (layer, *_) in blend_layers.items()))
 
         calc_args = {
             layer_key: layer.path
-            for layer_key, (layer, blend_mode) in blend_layers.items()
+            for layer_key, (layer, *_) in blend_layers.items()
         }
 
         logging.debug(f"Blending {calc_args} using: {calc}")
         output_path = TempFileManager.mktmp(suffix=".tif")
-        gdal.SetCacheMax(gdal_memory_limit)
-        gdal_calc.Calc(calc, output_path, self.nodata_value, quiet=True,
-                       creation_options=gdal_creation_options,
-                       overwrite=True, A=self.path, **calc_args)
+        ResourceGovernor.apply_gdal_limits()
+        with Profiler.stage("blend", self._year):
+            gdal_calc.Calc(calc, output_path, self.nodata_value, quiet=True,
+                           creation_options=IOProfile.Scratch.creation_options,
+                           overwrite=True, A=self.path, **calc_args)
+
+        blend_identity = self._derive_identity("blend", *(
+            (layer.identity, blend_mode.value, unit_conversion_factor)
+            for layer, blend_mode, unit_conversion_factor in blend_layers.values()))
 
-        return Layer(output_path, self._year, self._interpretation, self._units)
+        return Layer(output_path, self._year, self._interpretation, self._units, blend_identity)
 
-    def render(self, legend, bounding_box=None, transparent=True):
+    def render(self, legend, bounding_box=None, transparent=True, value_scale=1):
         '''
         Renders this layer into a colorized Frame according to the specified legend.
 
@@ -325,63 +355,200 @@ class Layer:
             to the bounding box's minimum spatial extent and nodata pixels.
         'transparent' -- whether or not nodata and 0-value pixels should be
             transparent in the rendered Frame.
+        'value_scale' -- optional factor that the legend values have been scaled by
+            relative to this layer's pixel values, i.e. a deferred unit conversion;
+            the legend thresholds are divided by this before colorizing.
         
         Returns this layer as a colorized Frame object.
         '''
         with open(TempFileManager.mktmp(suffix=".txt"), "w") as color_table:
             color_table_path = color_table.name
             color_table.write(f"nv 255,255,255,{0 if transparent else 255}\n")
-            color_table.write(f"0 255,255,255,{0 if transparent else 255}\n")
-
-            near_zero_value = None
-            near_zero_color = None
-            for value, entry in legend.items():
-                color_str = ",".join((f"{v}" for v in entry["color"]))
-                if isinstance(value, tuple):
-                    range_min, range_max = value
-                    if range_min is not None:
-                        color_table.write(f"{range_min} {color_str},255\n")
-                    if range_max is not None:
-                        color_table.write(f"{range_max} {color_str},255\n")
-                    if (    range_min is not None and range_min < 0
-                        and range_max is not None and range_max > 0
-                    ):
-                        near_zero_value = 0
-                        near_zero_color = color_str
-                    else:
-                        min_val = min((abs(range_min), abs(range_max)))
-                        if near_zero_value is None or min_val < near_zero_value:
-                            near_zero_value = min_val
-                            near_zero_color = color_str
-                else:
-                    color_table.write(f"{value} {color_str},255\n")
-                    if near_zero_value is None or abs(value) < near_zero_value:
-                        near_zero_value = abs(value)
-                        near_zero_color = color_str
-            
-            # Guard the color entry closest to 0 against the 0/nodata color.
-            color_table.write(f"{-1e-3} {near_zero_color},255\n{1e-3} {near_zero_color},255\n")
+            for value, color in self._get_color_entries(legend, transparent, value_scale):
+                color_str = ",".join((f"{v}" for v in color))
+                color_table.write(f"{value} {color_str}\n")
 
         working_layer = self if not bounding_box else bounding_box.crop(self)
         rendered_layer_path = TempFileManager.mktmp(suffix=".png")
-        subprocess.run([
-            "gdaldem",
-            "color-relief",
-            working_layer.path,
-            color_table.name,
-            rendered_layer_path,
-            "-q",
-            "-alpha",
-            "-nearest_color_entry"])
+        with Profiler.stage("colorize", self._year):
+            gdal.DEMProcessing(rendered_layer_path, working_layer.path, "color-relief",
+                               colorFilename=color_table_path, format="PNG", addAlpha=True,
+                               colorSelection="nearest_color_entry")
+
+        TempFileManager.remove(color_table_path)
 
         return Frame(self._year, rendered_layer_path, self.scale)
 
-    def _save_as(self, data, nodata_value, output_path):
-        gdal.SetCacheMax(gdal_memory_limit)
+    @staticmethod
+    def _get_color_entries(legend, transparent=True, value_scale=1):
+        # Gets the color table for a legend as a list of (pixel value, RGBA color)
+        # entries: each pixel is given the color of the entry nearest to its value.
+        color_entries = [(0, (255, 255, 255, 0 if transparent else 255))]
+        near_zero_value = None
+        near_zero_color = None
+        for value, entry in legend.items():
+            color = (*entry["color"], 255)
+            if isinstance(value, tuple):
+                range_min, range_max = value
+                if range_min is not None:
+                    color_entries.append((range_min / value_scale, color))
+                if range_max is not None:
+                    color_entries.append((range_max / value_scale, color))
+                if (    range_min is not None and range_min < 0
+                    and range_max is not None and range_max > 0
+                ):
+                    near_zero_value = 0
+                    near_zero_color = color
+                else:
+                    min_val = min((abs(range_min), abs(range_max)))
+                    if near_zero_value is None or min_val < near_zero_value:
+                        near_zero_value = min_val
+                        near_zero_color = color
+            else:
+                color_entries.append((value / value_scale, color))
+                if near_zero_value is None or abs(value) < near_zero_value:
+                    near_zero_value = abs(value)
+                    near_zero_color = color
+
+        # Guard the color entry closest to 0 against the 0/nodata color.
+        near_zero_guard = 1e-3 / value_scale
+        color_entries.extend([(-near_zero_guard, near_zero_color), (near_zero_guard, near_zero_color)])
+
+        return color_entries
+
+    def _save_reclassified(self, raster_data, new_interpretation, nodata_value):
+        uninterpreted_values = np.isin(raster_data, list(self._interpretation.keys()), invert=True)
+        raster_data[uninterpreted_values] = nodata_value
+        
+        # Guard against conflicts between original and reclassified pixel values
+        # before updating anything.
+        collision_offset = max(chain(self._interpretation.keys(), new_interpretation.keys())) + 1
+        raster_data[raster_data != nodata_value] += collision_offset
+
+        inverse_new_interpretation = {v: k for k, v in new_interpretation.items()}
+        for original_pixel_value, interpreted_value in self._interpretation.items():
+            new_pixel_value = inverse_new_interpretation[interpreted_value] \
+                if interpreted_value in inverse_new_interpretation \
+                else nodata_value
+
+            if new_pixel_value == nodata_value:
+                logging.info(f"  No new pixel value for {interpreted_value}: setting to nodata ({nodata_value})")
+
+            raster_data[raster_data == original_pixel_value + collision_offset] = new_pixel_value
+
+        output_path = TempFileManager.mktmp(suffix=".tif", size_hint=raster_data.nbytes)
+        self._save_as(raster_data, nodata_value, output_path)
+
+        return output_path
+
+    def _get_unit_conversion_factor(self, from_units, to_units):
+        # Conversion factor between units for pixels the size of this layer's.
+        if from_units == Units.Blank:
+            return 1
+
+        current_per_ha, current_units_tc, current_units_name = from_units.value
+        new_per_ha, new_units_tc, new_units_name = to_units.value
+        unit_conversion = current_units_tc / new_units_tc
+
+        if current_per_ha == new_per_ha:
+            return unit_conversion
+
+        if "metre" not in self.info["coordinateSystem"]["wkt"]:
+            return None
+
+        one_hectare = 100 ** 2
+        _, pixel_size, *_ = self.info["geoTransform"]
+        pixel_size_ha = float(pixel_size) ** 2 / one_hectare
+
+        return unit_conversion * pixel_size_ha if current_per_ha else unit_conversion / pixel_size_ha
+
+    @staticmethod
+    def _get_row_conversion_factors(from_units, to_units, geotransform, height):
+        # Conversion factors between units for each row of a grid in a geographic
+        # coordinate system, where pixel area only varies with latitude; returned
+        # as a column to multiply the grid's pixel values by.
+        current_per_ha, current_units_tc, current_units_name = from_units.value
+        new_per_ha, new_units_tc, new_units_name = to_units.value
+        unit_conversion = current_units_tc / new_units_tc
+        one_hectare = 100 ** 2
+
+        origin_x, pixel_size_x, _, origin_y, _, pixel_size_y = geotransform
+        row_conversion_factors = np.empty((height, 1), dtype=np.float64)
+        for row in range(height):
+            lat = origin_y - pixel_size_y * row
+            lat_size_m = distance((lat, origin_x), (lat - pixel_size_y, origin_x)).m
+            lon_size_m = distance((lat, origin_x), (lat, origin_x + pixel_size_x)).m
+            pixel_size_ha = lat_size_m * lon_size_m / one_hectare
+            row_conversion_factors[row] = unit_conversion * pixel_size_ha if current_per_ha \
+                else unit_conversion / pixel_size_ha
+
+        return row_conversion_factors
+
+    def _convert_units(self, units, unit_conversion_factor):
+        ResourceGovernor.apply_gdal_limits()
+        if unit_conversion_factor is not None:
+            output_path = TempFileManager.mktmp(suffix=".tif", size_hint=self._get_size_hint())
+            simple_conversion_calc = " ".join((
+                f"(A * {unit_conversion_factor})",
+                f"* (A != {self.nodata_value})",
+                f"+ ((A == {self.nodata_value}) * {self.nodata_value})"))
+
+            gdal_calc.Calc(simple_conversion_calc, output_path, self.nodata_value, quiet=True,
+                           creation_options=IOProfile.Scratch.creation_options,
+                           overwrite=True, A=self.path)
+
+            return output_path
+
+        raster = gdal.Open(self._path)
+        band = raster.GetRasterBand(1)
+        raster_data = band.ReadAsArray()
+        row_conversion_factors = self._get_row_conversion_factors(
+            self._units, units, raster.GetGeoTransform(), raster.RasterYSize)
+
+        data_pixels = raster_data != self.nodata_value
+        raster_data[data_pixels] = (raster_data * row_conversion_factors)[data_pixels]
+
+        output_path = TempFileManager.mktmp(suffix=".tif", size_hint=raster_data.nbytes)
+        self._save_as(raster_data, self.nodata_value, output_path)
+
+        return output_path
+
+    def _flatten(self, flattened_value):
+        ResourceGovernor.apply_gdal_limits()
+        logging.debug(f"Flattening {self._path}")
+        raster = gdal.Open(self._path)
+        band = raster.GetRasterBand(1)
+        raster_data = band.ReadAsArray()
+        raster_data[raster_data != self.nodata_value] = flattened_value
+        output_path = TempFileManager.mktmp(suffix=".tif", size_hint=raster_data.nbytes)
+        self._save_as(raster_data, self.nodata_value, output_path)
+
+        return output_path
+
+    def _reproject(self, projection):
+        output_path = TempFileManager.mktmp(suffix=".tif")
+        ResourceGovernor.apply_gdal_limits()
+        gdal.Warp(output_path, self._path, dstSRS=projection,
+                  creationOptions=IOProfile.Scratch.creation_options)
+
+        return output_path
+
+    def _get_size_hint(self):
+        # The uncompressed size of a copy of this layer, for placing temp files.
+        raster = gdal.Open(self._path)
+        band = raster.GetRasterBand(1)
+
+        return raster.RasterXSize * raster.RasterYSize * gdal.GetDataTypeSize(band.DataType) // 8
+
+    def _derive_identity(self, operation, *params):
+        return hashlib.sha1(repr((self.identity, operation, params)).encode("utf-8")).hexdigest()
+
+    def _save_as(self, data, nodata_value, output_path, profile=IOProfile.Scratch):
+        ResourceGovernor.apply_gdal_limits()
         driver = gdal.GetDriverByName("GTiff")
         original_raster = gdal.Open(self._path)
         new_raster = driver.CreateCopy(output_path, original_raster, strict=0,
-                                       options=gdal_creation_options)
+                                       options=profile.creation_options)
 
         band = new_raster.GetRasterBand(1)
         band.SetNoDataValue(nodata_value)
@@ -1,15 +1,19 @@
 import os
 import gdal
+import hashlib
+import logging
 from itertools import chain
 from collections import defaultdict
-from multiprocessing import Pool
 from gcbmanimation.layer.layer import Layer
 from gcbmanimation.layer.units import Units
 from gcbmanimation.layer.layer import BlendMode
+from gcbmanimation.layer.sparselayer import SparseLayer
 from gcbmanimation.color.colorizer import Colorizer
 from gcbmanimation.animator.frame import Frame
-from gcbmanimation.util.config import gdal_creation_options
-from gcbmanimation.util.config import gdal_memory_limit
+from gcbmanimation.util.config import IOProfile
+from gcbmanimation.util.operationmemo import OperationMemo
+from gcbmanimation.util.profiler import Profiler
+from gcbmanimation.util.resourcegovernor import ResourceGovernor
 from gcbmanimation.util.tempfile import TempFileManager
 
 class LayerCollection:
@@ -28,12 +32,15 @@ class LayerCollection:
     'background_color' -- RGB tuple for the background color.
     'colorizer' -- a Colorizer to create the legend with - defaults to
         basic Colorizer which bins values into 8 equal-sized buckets.
+    'bounding_box' -- optional bounding box that the layers have already been
+        cropped to; rendering with the same bounding box won't crop them again.
     '''
 
-    def __init__(self, layers=None, background_color=(224, 224, 224), colorizer=None):
+    def __init__(self, layers=None, background_color=(224, 224, 224), colorizer=None, bounding_box=None):
         self._layers = layers or []
         self._background_color = background_color
         self._colorizer = colorizer or Colorizer()
+        self._bounding_box = bounding_box
 
     @property
     def empty(self):
@@ -53,6 +60,35 @@ class LayerCollection:
         '''Merges another LayerCollection's layers into this one.'''
         self._layers.extend(other._layers)
 
+    def crop(self, bounding_box, start_year=None, end_year=None):
+        '''
+        Crops the layers in this collection to a bounding box. Rendering the cropped
+        collection with the same bounding box uses the cropped layers as-is instead
+        of cropping them again.
+
+        Arguments:
+        'bounding_box' -- the bounding box Layer to crop to.
+        'start_year' -- optional start year to crop from - must be specified
+            along with end_year.
+        'end_year' -- optional end year to crop to - must be specified along
+            with start_year.
+
+        Returns a new LayerCollection containing the cropped layers.
+        '''
+        working_layers = [
+            layer for layer in self._layers
+            if not (start_year and end_year) or start_year <= layer.year <= end_year]
+
+        # Sparse layers are cropped without reading the full raster, so there's
+        # nothing to gain from tiling them.
+        raster_pixels = self._estimate_pixels(bounding_box)
+        tile_count = 1 if any(isinstance(layer, SparseLayer) for layer in working_layers) \
+            else ResourceGovernor.tile_count(raster_pixels, len({layer.path for layer in working_layers}))
+        with ResourceGovernor.pool(raster_pixels and raster_pixels // tile_count) as pool:
+            cropped_layers = self._crop_layers(pool, bounding_box, working_layers, tile_count)
+
+        return LayerCollection(cropped_layers, self._background_color, self._colorizer, bounding_box)
+
     def blend(self, *collections):
         '''
         Blends this collection's layer values with one or more other collections.
@@ -80,7 +116,8 @@ class LayerCollection:
                 placeholder = self._layers[0].flatten(0, True) if self._layers \
                     else next(chain(*(collection._layers for collection, _ in blend_collections))).flatten(0, True)
 
-                local_layer = Layer(placeholder.path, year, placeholder.interpretation, placeholder.units)
+                local_layer = Layer(placeholder.path, year, placeholder.interpretation, placeholder.units,
+                                    placeholder.identity)
             
             other_layers = []
             for collection, blend_mode in blend_collections:
@@ -95,7 +132,8 @@ class LayerCollection:
 
         return blended_collection
 
-    def render(self, bounding_box=None, start_year=None, end_year=None, units=Units.TcPerHa):
+    def render(self, bounding_box=None, start_year=None, end_year=None, units=Units.TcPerHa,
+               frame_store=None, legend=None):
         '''
         Renders the collection of layers into colorized Frame objects organized
         by year.
@@ -110,51 +148,133 @@ class LayerCollection:
         'end_year' -- optional end year to render to - must be specified along
             with start_year.
         'units' -- optional units to render the output in (default: tc/ha). Layers
-            in the collection will be converted to these units if necessary.
+            in the collection will be converted to these units if necessary; where
+            the conversion is a constant factor for every layer, it is applied to
+            the legend instead of to the pixels.
+        'frame_store' -- optional FrameStore to render incrementally: years whose
+            inputs haven't changed since the last render reuse their processed
+            layers, and their frames too if the legend hasn't changed either.
+        'legend' -- optional legend (in the render units) to color the layers with
+            instead of creating one from this collection, i.e. a legend shared with
+            other collections from LayerCollection.create_common_legend.
+
+        If tiling is turned on (see ResourceGovernor.set_tiling) and there are
+        fewer years to render than pool workers, each year is split into tiles of
+        the bounding box that are processed and colorized in parallel, then
+        stitched back together; the legend is still created from every tile.
+        Incremental renders and sparse layers are not tiled.
         
         Returns a list of rendered Frame objects and a legend (dict) describing
-        the colors.
+        the colors. Raises ValueError if the collection has no layers in the
+        years to render.
         '''
-        with Pool() as pool:
-            layer_years = {layer.year for layer in self._layers}
-            render_years = set(range(start_year, end_year + 1)) if start_year and end_year else layer_years
-            working_layers = [layer for layer in self._layers if layer.year in render_years]
-            if bounding_box:
-                working_layers = pool.map(bounding_box.crop, working_layers)
+        layer_years = {layer.year for layer in self._layers}
+        render_years = set(range(start_year, end_year + 1)) if start_year and end_year else layer_years
+        raster_pixels = self._estimate_pixels(bounding_box)
+        tile_count = 1 if frame_store or not bounding_box \
+            or any(isinstance(layer, SparseLayer) for layer in self._layers) \
+            else ResourceGovernor.tile_count(raster_pixels, len(layer_years & render_years))
 
-            tasks = [pool.apply_async(layer.convert_units, (units,)) for layer in working_layers]
-            working_layers = [task.get() for task in tasks]
+        with ResourceGovernor.pool(raster_pixels and raster_pixels // tile_count) as pool, \
+             Profiler.stage("render_layers"):
+            working_layers, common_interpretation = self._select_layers(render_years)
+            if not working_layers:
+                raise ValueError(f"No layers to render for years {min(render_years, default=None)} "
+                                 f"to {max(render_years, default=None)}")
+
+            stored_layers = {}
+            remapped_layers = {}
+            input_keys = {}
+            if frame_store:
+                input_keys = self._get_input_keys(working_layers, bounding_box, units)
+                stored_layers, remapped_layers = self._find_stored_layers(
+                    pool, frame_store, input_keys, common_interpretation)
+
+                working_layers = [layer for layer in working_layers
+                                  if layer.year not in stored_layers and layer.year not in remapped_layers]
+
+            if tile_count > 1:
+                tiled_layers, value_scale = self._process_tiles(
+                    pool, working_layers, bounding_box.split(tile_count), units, common_interpretation,
+                    cropped=bounding_box is self._bounding_box)
+
+                processed_layers = list(chain(*tiled_layers))
+            else:
+                processed_layers, value_scale = self._process_layers(
+                    pool, working_layers, bounding_box, units, common_interpretation)
+
+            reused_years = set(stored_layers) | set(remapped_layers)
+            if reused_years and processed_layers and value_scale != frame_store.value_scale:
+                logging.info("Unit conversion has changed since the last render - reprocessing all years")
+                working_layers.extend(chain(*(
+                    filter(lambda layer: layer.year == year, self._layers) for year in reused_years)))
+
+                stored_layers = {}
+                remapped_layers = {}
+                processed_layers, value_scale = self._process_layers(
+                    pool, working_layers, bounding_box, units, common_interpretation)
+
+            if frame_store:
+                if not processed_layers:
+                    value_scale = frame_store.value_scale or 1
+
+                frame_store.value_scale = value_scale
+                processed_layers.extend(remapped_layers.values())
+                for layer in processed_layers:
+                    frame_store.put_layer(layer.year, input_keys[layer.year], layer.path, layer.units.name,
+                                          layer.interpretation)
+
+            working_layers = sorted(chain(processed_layers, stored_layers.values()), key=lambda layer: layer.year)
 
-            common_interpretation = None
-            interpreted = any((layer.has_interpretation for layer in working_layers))
-            if interpreted:
-                # Interpreted layers where the pixel values have meaning, i.e. a disturbance type,
-                # get their pixel values normalized across the whole collection.
-                unique_values = sorted(set(chain(*(layer.interpretation.values() for layer in working_layers))))
-                common_interpretation = {i: value for i, value in enumerate(unique_values, 1)}
-                tasks = [pool.apply_async(layer.reclassify, (common_interpretation,)) for layer in working_layers]
-                working_layers = [task.get() for task in tasks]
-
-            # Merge the layers together by year if this is a fragmented collection of layers,
-            # i.e. fire and harvest in separate files.
-            layers_by_year = defaultdict(list)
-            for layer in working_layers:
-                layers_by_year[layer.year].append(layer)
+            # Each year's layer is rendered as a group of its tiles, from top to
+            # bottom, or on its own if the render isn't tiled.
+            layer_groups = tiled_layers if tile_count > 1 else [[layer] for layer in working_layers]
 
             background_layer = bounding_box or working_layers[0]
             background_frame = background_layer.flatten().render(
                 {1: {"color": self._background_color}}, bounding_box=bounding_box, transparent=False)
 
-            # Merge groups of layers by year.
-            working_layers = pool.map(self._merge_layers, layers_by_year.values())
-            legend = self._colorizer.create_legend(working_layers)
+            if not legend:
+                # Tiles without any data would add a meaningless 0 to the legend's range.
+                legend_layers = working_layers if tile_count == 1 \
+                    else [layer for layer in working_layers if layer.has_data] or working_layers
 
-            # Render the merged layers.
-            tasks = [pool.apply_async(layer.render, (legend,)) for layer in working_layers]
-            rendered_layers = [task.get() for task in tasks]
+                with Profiler.stage("create_legend"):
+                    legend = self._colorizer.create_legend(legend_layers, value_scale)
 
-            # Add the background to the rendered layers.
-            rendered_layers = [layer.composite(background_frame, True) for layer in rendered_layers]
+            # Render the merged layers, reusing any stored frames with the same colors.
+            rendered_layers = []
+            unrendered_groups = layer_groups
+            legend_key = None
+            if frame_store:
+                legend_key = self._get_legend_key(legend, value_scale)
+                unrendered_groups = []
+                for layers in layer_groups:
+                    year = layers[0].year
+                    stored_frame = frame_store.get_frame(year, legend_key)
+                    if stored_frame:
+                        rendered_layers.append(Frame(year, *stored_frame))
+                    else:
+                        unrendered_groups.append(layers)
+
+            group_tasks = [
+                [pool.apply_async(layer.render, (legend,), {"value_scale": value_scale}) for layer in layers]
+                for layers in unrendered_groups]
+
+            # Stitch the tiles back together and add the background to the rendered layers.
+            for tasks in group_tasks:
+                rendered_layer, *rendered_tiles = [task.get() for task in tasks]
+                if rendered_tiles:
+                    with Profiler.stage("stitch", rendered_layer.year):
+                        rendered_layer = rendered_layer.merge_vertical(*rendered_tiles)
+
+                rendered_layer = rendered_layer.composite(background_frame, True)
+                rendered_layers.append(rendered_layer)
+                if frame_store:
+                    frame_store.put_frame(rendered_layer.year, legend_key, rendered_layer.path, rendered_layer.scale)
+
+            if frame_store:
+                frame_store.save()
 
             missing_years = render_years - layer_years
             rendered_layers.extend([
@@ -163,13 +283,304 @@ class LayerCollection:
         
             return rendered_layers, legend
 
+    @staticmethod
+    def create_common_legend(collections, bounding_box=None, start_year=None, end_year=None,
+                             units=Units.TcPerHa):
+        '''
+        Creates a single legend for several collections of value layers, i.e. the
+        same indicator from different scenarios, so that their rendered frames use
+        the same colors for the same values. The legend is created with the first
+        collection's Colorizer.
+
+        Arguments:
+        'collections' -- the LayerCollections to create the legend for.
+        'bounding_box' -- optional bounding box Layer that the collections will be
+            rendered with.
+        'start_year' -- optional start year that the collections will be rendered
+            from - must be specified along with end_year.
+        'end_year' -- optional end year that the collections will be rendered to -
+            must be specified along with start_year.
+        'units' -- optional units that the collections will be rendered in.
+
+        Returns the legend, to pass to LayerCollection.render.
+        '''
+        reference_collection = collections[0]
+        with ResourceGovernor.pool(reference_collection._estimate_pixels(bounding_box)) as pool, \
+             Profiler.stage("create_legend"):
+            processed_collections = []
+            for collection in collections:
+                layer_years = {layer.year for layer in collection._layers}
+                render_years = set(range(start_year, end_year + 1)) if start_year and end_year else layer_years
+                working_layers, _ = collection._select_layers(render_years)
+                processed_collections.append(collection._process_layers(pool, working_layers, bounding_box, units, None))
+
+            # The legend can only defer a unit conversion to its values if it's the
+            # same for every collection.
+            value_scales = {value_scale for layers, value_scale in processed_collections if layers}
+            value_scale = next(iter(value_scales)) if len(value_scales) == 1 else 1
+            legend_layers = []
+            for layers, collection_value_scale in processed_collections:
+                if collection_value_scale != value_scale:
+                    tasks = [pool.apply_async(layer.convert_units, (units,)) for layer in layers]
+                    layers = [task.get() for task in tasks]
+
+                legend_layers.extend(layers)
+
+            return reference_collection._colorizer.create_legend(legend_layers, value_scale)
+
+    def _select_layers(self, years):
+        # Gets the layers to render for a set of years, and for interpreted layers
+        # where the pixel values have meaning, i.e. a disturbance type, the common
+        # interpretation that their pixel values are normalized to across the whole
+        # collection.
+        working_layers = [layer for layer in self._layers if layer.year in years]
+
+        common_interpretation = None
+        interpreted = any((layer.has_interpretation for layer in working_layers))
+        if interpreted:
+            unique_values = sorted(set(chain(*(layer.interpretation.values() for layer in working_layers))))
+            common_interpretation = {i: value for i, value in enumerate(unique_values, 1)}
+
+        return working_layers, common_interpretation
+
+    def _process_tiles(self, pool, layers, tiles, units, common_interpretation, cropped=False):
+        # Crops, converts, reclassifies and merges each year's layers separately for
+        # each tile; returns the processed tiles for each year, from top to bottom,
+        # and the factor the legend needs to be scaled by. Layers that are already
+        # cropped to the tiles' bounding box are sliced into tiles instead.
+        layers_by_year = defaultdict(list)
+        for layer in layers:
+            layers_by_year[layer.year].append(layer)
+
+        tile_tasks = [
+            [pool.apply_async(self._process_tile, (year_layers, tile, units, common_interpretation, cropped))
+             for tile in tiles]
+            for _, year_layers in sorted(layers_by_year.items())]
+
+        tiled_layers = [[task.get() for task in tasks] for tasks in tile_tasks]
+
+        value_scale = self._find_common_conversion_factor(list(chain(*tiled_layers)), units)
+        if value_scale is None:
+            value_scale = 1
+            tile_tasks = [[pool.apply_async(layer.convert_units, (units,)) for layer in tile_layers]
+                          for tile_layers in tiled_layers]
+
+            tiled_layers = [[task.get() for task in tasks] for tasks in tile_tasks]
+
+        return tiled_layers, value_scale
+
+    def _process_tile(self, layers, tile, units, common_interpretation, cropped=False):
+        working_layers = [tile.slice(layer) if cropped else tile.crop(layer) for layer in layers]
+
+        # Scale conversions are left for the legend as long as the year's layers
+        # all need the same one.
+        conversion_factors = {layer.get_unit_conversion_factor(units) for layer in working_layers}
+        if len(conversion_factors) != 1 or None in conversion_factors:
+            working_layers = [layer.convert_units(units) for layer in working_layers]
+
+        if common_interpretation is not None:
+            working_layers = [layer.reclassify(common_interpretation) for layer in working_layers]
+
+        return self._merge_layers(working_layers)
+
+    def _process_layers(self, pool, layers, bounding_box, units, common_interpretation):
+        # Crops, converts, reclassifies and merges layers by year; returns the merged
+        # layers and the factor the legend needs to be scaled by.
+        if not layers:
+            return [], 1
+
+        working_layers = layers
+        if bounding_box and bounding_box is not self._bounding_box:
+            working_layers = self._crop_layers(pool, bounding_box, working_layers)
+
+        # A unit conversion that is the same scale factor for every layer is
+        # deferred to the legend rather than rewriting each layer's pixels.
+        value_scale = self._find_common_conversion_factor(working_layers, units)
+        if value_scale is None:
+            value_scale = 1
+            tasks = [pool.apply_async(layer.convert_units, (units,)) for layer in working_layers]
+            working_layers = [task.get() for task in tasks]
+
+        if common_interpretation is not None:
+            working_layers = self._reclassify_layers(pool, working_layers, common_interpretation)
+
+        # Merge the layers together by year if this is a fragmented collection of layers,
+        # i.e. fire and harvest in separate files.
+        layers_by_year = defaultdict(list)
+        for layer in working_layers:
+            layers_by_year[layer.year].append(layer)
+
+        return pool.map(self._merge_layers, layers_by_year.values()), value_scale
+
+    def _get_input_keys(self, layers, bounding_box, units):
+        # The common interpretation isn't part of the key: it changes for every
+        # year whenever a new value appears in any year, i.e. a new disturbance
+        # type, so stored layers are remapped to it instead (see
+        # _find_stored_layers).
+        layers_by_year = defaultdict(list)
+        for layer in layers:
+            layers_by_year[layer.year].append(layer)
+
+        return {
+            year: hashlib.sha1(repr((
+                [(layer.identity, layer.units.name,
+                  sorted(layer.interpretation.items()) if layer.has_interpretation else None)
+                 for layer in year_layers],
+                bounding_box.identity if bounding_box else None,
+                units.name
+            )).encode("utf-8")).hexdigest()
+            for year, year_layers in layers_by_year.items()
+        }
+
+    def _find_stored_layers(self, pool, frame_store, input_keys, common_interpretation):
+        # Gets the stored layers that are up to date, and the ones that are up to
+        # date except for being reclassified to an older common interpretation,
+        # which are remapped to the current one.
+        stored_layers = {}
+        remap_tasks = {}
+        for year, input_key in input_keys.items():
+            stored_layer = frame_store.get_layer(year, input_key)
+            if not stored_layer:
+                continue
+
+            path, units_name, interpretation = stored_layer
+            if common_interpretation and not interpretation:
+                continue # Stored without its interpretation - can't be remapped.
+
+            layer_type = SparseLayer if path.endswith(SparseLayer.extension) else Layer
+            layer = layer_type(path, year, interpretation, Units[units_name], input_key)
+            if common_interpretation and interpretation != common_interpretation:
+                remap_tasks[year] = pool.apply_async(layer.reclassify, (common_interpretation,))
+            else:
+                stored_layers[year] = layer
+
+        remapped_layers = {year: task.get() for year, task in remap_tasks.items()}
+
+        return stored_layers, remapped_layers
+
+    def _get_legend_key(self, legend, value_scale):
+        return hashlib.sha1(repr((
+            list(legend.items()), value_scale, self._background_color
+        )).encode("utf-8")).hexdigest()
+
+    def _crop_layers(self, pool, bounding_box, layers, tile_count=1):
+        # Layers that share a file, i.e. the years of a multi-year disturbance layer,
+        # are only cropped once.
+        source_layers = {}
+        for layer in layers:
+            source_layers.setdefault(layer.path, layer)
+
+        if tile_count > 1:
+            cropped_sources = self._crop_tiled(pool, bounding_box, source_layers, tile_count)
+        else:
+            cropped_sources = dict(zip(source_layers, pool.map(bounding_box.crop, source_layers.values())))
+        cropped_layers = []
+        for layer in layers:
+            cropped_layer = cropped_sources[layer.path]
+            if layer is not source_layers[layer.path]:
+                cropped_layer = type(cropped_layer)(cropped_layer.path, layer.year, layer.interpretation,
+                                      layer.units, cropped_layer.identity)
+
+            cropped_layers.append(cropped_layer)
+
+        return cropped_layers
+
+    def _crop_tiled(self, pool, bounding_box, source_layers, tile_count):
+        # Crops each layer one tile at a time, then stitches the tiles together.
+        tiles = bounding_box.split(tile_count)
+        tile_tasks = {
+            path: [pool.apply_async(tile.crop, (layer,)) for tile in tiles]
+            for path, layer in source_layers.items()}
+
+        stitch_tasks = {
+            path: pool.apply_async(self._stitch_layers, (
+                source_layers[path], bounding_box, [task.get() for task in tasks]))
+            for path, tasks in tile_tasks.items()}
+
+        return {path: task.get() for path, task in stitch_tasks.items()}
+
+    @staticmethod
+    def _stitch_layers(layer, bounding_box, tile_layers):
+        # The stitched tiles are the same as the layer cropped in one piece.
+        cropped_identity = layer._derive_identity("crop", bounding_box.identity)
+        with Profiler.stage("stitch", layer.year):
+            output_path = OperationMemo.get_or_compute(
+                cropped_identity, lambda: LayerCollection._stitch(tile_layers))
+
+        return Layer(output_path, layer.year, layer.interpretation, layer.units, cropped_identity)
+
+    @staticmethod
+    def _stitch(tile_layers):
+        output_path = TempFileManager.mktmp(suffix=".tif")
+        ResourceGovernor.apply_gdal_limits()
+        mosaic = gdal.BuildVRT("", [layer.path for layer in tile_layers])
+        gdal.Translate(output_path, mosaic, creationOptions=IOProfile.Scratch.creation_options)
+
+        return output_path
+
+    def _reclassify_layers(self, pool, layers, new_interpretation):
+        # Layers that share a file are reclassified together from a single read per
+        # task, with each file's layers split into enough tasks to keep the pool's
+        # workers busy, i.e. for a single multi-year disturbance layer.
+        layer_indices_by_path = defaultdict(list)
+        for i, layer in enumerate(layers):
+            layer_indices_by_path[layer.path].append(i)
+
+        chunks_per_path = -(-ResourceGovernor.worker_count() // max(1, len(layer_indices_by_path)))
+        layer_index_chunks = []
+        for layer_indices in layer_indices_by_path.values():
+            chunk_size = -(-len(layer_indices) // chunks_per_path)
+            layer_index_chunks.extend(
+                layer_indices[i:i + chunk_size] for i in range(0, len(layer_indices), chunk_size))
+
+        tasks = [
+            (layer_indices, pool.apply_async(
+                type(layers[layer_indices[0]]).reclassify_shared,
+                ([layers[i] for i in layer_indices], new_interpretation)))
+            for layer_indices in layer_index_chunks]
+
+        reclassified_layers = [None] * len(layers)
+        for layer_indices, task in tasks:
+            for i, reclassified_layer in zip(layer_indices, task.get()):
+                reclassified_layers[i] = reclassified_layer
+
+        return reclassified_layers
+
+    def _estimate_pixels(self, bounding_box=None):
+        reference_layer = bounding_box or next(iter(self._layers), None)
+        if not reference_layer:
+            return None
+
+        if isinstance(reference_layer, SparseLayer):
+            width, height = reference_layer.info["size"]
+            return width * height
+
+        raster = gdal.Open(reference_layer.path)
+
+        return raster.RasterXSize * raster.RasterYSize
+
+    def _find_common_conversion_factor(self, layers, units):
+        conversion_factors = {layer.get_unit_conversion_factor(units) for layer in layers}
+        if len(conversion_factors) != 1:
+            return None
+
+        return next(iter(conversion_factors))
+
     def _merge_layers(self, layers):
         if len(layers) == 1:
             return layers[0]
 
-        output_path = TempFileManager.mktmp(suffix=".tif")
-        gdal.SetCacheMax(gdal_memory_limit)
-        gdal.Warp(output_path, [layer.path for layer in layers], creationOptions=gdal_creation_options)
-        merged_layer = Layer(output_path, layers[0].year, layers[0].interpretation, layers[0].units)
+        if all(isinstance(layer, SparseLayer) for layer in layers):
+            return SparseLayer.merge(layers)
+
+        output_path = TempFileManager.mktmp(
+            suffix=".tif", size_hint=max(layer._get_size_hint() for layer in layers))
+        ResourceGovernor.apply_gdal_limits()
+        with Profiler.stage("merge", layers[0].year):
+            gdal.Warp(output_path, [layer.path for layer in layers],
+                      creationOptions=IOProfile.Scratch.creation_options)
+
+        merged_layer = Layer(output_path, layers[0].year, layers[0].interpretation, layers[0].units,
+                             layers[0]._derive_identity("merge", *(layer.identity for layer in layers[1:])))
 
         return merged_layer
@@ -0,0 +1,201 @@
+import os
+import gdal
+import json
+import hashlib
+import numpy as np
+from gcbmanimation.layer.layer import Layer
+from gcbmanimation.util.config import IOProfile
+from gcbmanimation.util.operationmemo import OperationMemo
+from gcbmanimation.util.profiler import Profiler
+from gcbmanimation.util.resourcegovernor import ResourceGovernor
+from gcbmanimation.util.tempfile import TempFileManager
+
+class LayerCube:
+    '''
+    A stack of an indicator's yearly layers, cropped to a bounding box and
+    converted to the same units, in a single multi-band GeoTIFF on the bounding
+    box's grid: one band per year, each with its statistics stored alongside it.
+    The cube's years are read as CubeLayers, which look like any other Layer but
+    read their year straight from the cube, so rendering, legends and sums open
+    one file rather than one per year and never need to compute statistics.
+
+    Cubes are memoized operation outputs keyed by the original layers, the
+    bounding box and the units, so with a persistent cache (see
+    OperationMemo.set_persistent_cache) a rerun with the same spatial output
+    reuses the cube without cropping or converting anything.
+
+    Arguments:
+    'path' -- path to the cube file.
+    'identity' -- key identifying the cube's content.
+    'units' -- the Units of the cube's pixel values.
+    '''
+
+    # Settings are kept in the environment so that pool workers see them too.
+    _enabled_var = "GCBMANIMATION_LAYER_CUBES"
+    _years_item = "YEARS"
+
+    def __init__(self, path, identity, units):
+        self._path = path
+        self._identity = identity
+        self._units = units
+        TempFileManager.track(self, path)
+
+    @staticmethod
+    def set_enabled(enabled=True):
+        '''
+        Turns on stacking indicators' spatial output into cubes for the run; this
+        is off by default.
+
+        Arguments:
+        'enabled' -- whether or not to use cubes.
+        '''
+        if enabled:
+            os.environ[LayerCube._enabled_var] = "1"
+        else:
+            os.environ.pop(LayerCube._enabled_var, None)
+
+    @staticmethod
+    def is_enabled():
+        '''Checks if cubes are turned on for the run.'''
+        return bool(os.environ.get(LayerCube._enabled_var))
+
+    @staticmethod
+    def create(layers, bounding_box, units):
+        '''
+        Stacks a set of yearly layers into a cube, or gets the existing cube for
+        the same layers.
+
+        Arguments:
+        'layers' -- the layers to stack, one per year.
+        'bounding_box' -- the BoundingBox to crop the layers to.
+        'units' -- the Units to convert the layers to.
+
+        Returns a new LayerCube.
+        '''
+        cube_identity = hashlib.sha1(repr((
+            "cube", bounding_box.identity, units.name,
+            sorted((layer.year, layer.identity, layer.units.name) for layer in layers)
+        )).encode("utf-8")).hexdigest()
+
+        with Profiler.stage("create_cube"):
+            cube_path = OperationMemo.get_or_compute(
+                cube_identity, lambda: LayerCube._build(layers, bounding_box, units), IOProfile.Cube)
+
+        return LayerCube(cube_path, cube_identity, units)
+
+    @property
+    def path(self):
+        '''Gets the cube's file path.'''
+        return self._path
+
+    @property
+    def years(self):
+        '''Gets the years in the cube, in band order.'''
+        return json.loads(gdal.Open(self._path).GetMetadataItem(self._years_item))
+
+    @property
+    def layers(self):
+        '''Gets a CubeLayer for each year in the cube.'''
+        return [
+            CubeLayer(self._path, band, year, self._units, hashlib.sha1(
+                repr((self._identity, year)).encode("utf-8")).hexdigest())
+            for band, year in enumerate(self.years, 1)]
+
+    @staticmethod
+    def _build(layers, bounding_box, units):
+        bounding_box.prepare()
+        with ResourceGovernor.pool(bounding_box.info["size"][0] * bounding_box.info["size"][1]) as pool:
+            tasks = [pool.apply_async(LayerCube._prepare_layer, (layer, bounding_box, units))
+                     for layer in layers]
+
+            prepared_layers = sorted((task.get() for task in tasks), key=lambda layer: layer.year)
+
+        ResourceGovernor.apply_gdal_limits()
+        reference_raster = gdal.Open(prepared_layers[0].path)
+        reference_band = reference_raster.GetRasterBand(1)
+        cube_path = TempFileManager.mktmp(suffix=".tif")
+        cube = gdal.GetDriverByName("GTiff").Create(
+            cube_path, reference_raster.RasterXSize, reference_raster.RasterYSize, len(prepared_layers),
+            reference_band.DataType, IOProfile.Cube.creation_options)
+
+        cube.SetGeoTransform(reference_raster.GetGeoTransform())
+        cube.SetProjection(reference_raster.GetProjection())
+        cube.SetMetadataItem(LayerCube._years_item, json.dumps([layer.year for layer in prepared_layers]))
+        for band_number, layer in enumerate(prepared_layers, 1):
+            layer_band = gdal.Open(layer.path).GetRasterBand(1)
+            layer_data = layer_band.ReadAsArray()
+            nodata_value = layer_band.GetNoDataValue()
+
+            band = cube.GetRasterBand(band_number)
+            band.SetDescription(str(layer.year))
+            if nodata_value is not None:
+                band.SetNoDataValue(nodata_value)
+
+            band.WriteArray(layer_data)
+
+            # Store each year's statistics in the cube so they never need to be
+            # computed from the pixels again.
+            data = layer_data[np.isfinite(layer_data)]
+            if nodata_value is not None:
+                data = data[data != nodata_value]
+
+            if data.size:
+                band.SetStatistics(float(data.min()), float(data.max()), float(data.mean()), float(data.std()))
+
+        cube = None
+
+        return cube_path
+
+    @staticmethod
+    def _prepare_layer(layer, bounding_box, units):
+        return bounding_box.crop(layer).convert_units(units)
+
+
+class CubeLayer(Layer):
+    '''
+    A Layer for one year of a LayerCube. The layer's path is a small virtual
+    raster pointing at the year's band in the cube, so it can be used anywhere
+    a Layer can without copying any pixels, and its minimum and maximum values
+    come from the statistics stored in the cube.
+
+    Arguments:
+    'cube_path' -- path to the cube file.
+    'band' -- the cube band (1-based) holding the layer's year.
+    'year' -- the year the layer applies to.
+    'units' -- the units the layer's pixel values are in.
+    'identity' -- key identifying the layer's pixel content.
+    '''
+
+    def __init__(self, cube_path, band, year, units, identity):
+        vrt_path = TempFileManager.mktmp(suffix=".vrt")
+        gdal.Translate(vrt_path, cube_path, format="VRT", bandList=[band])
+        super().__init__(vrt_path, year, units=units, identity=identity)
+        self._cube_path = cube_path
+        self._band = band
+        TempFileManager.track(self, cube_path)
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        TempFileManager.track(self, self._cube_path)
+
+    @property
+    def band(self):
+        '''Gets the cube band (1-based) holding the layer's year.'''
+        return self._band
+
+    @property
+    def info(self):
+        '''
+        Gets this layer's GDAL info dictionary, including the min/max values
+        stored in the cube.
+        '''
+        if not self._info:
+            info = json.loads(gdal.Info(self._path, format="json", deserialize=False).replace("nan", "0"))
+            statistics = gdal.Open(self._cube_path).GetRasterBand(self._band).GetMetadata()
+            if "STATISTICS_MINIMUM" in statistics:
+                info["bands"][0]["computedMin"] = float(statistics["STATISTICS_MINIMUM"])
+                info["bands"][0]["computedMax"] = float(statistics["STATISTICS_MAXIMUM"])
+
+            self._info = info
+
+        return self._info
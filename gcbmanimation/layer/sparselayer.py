@@ -0,0 +1,452 @@
+import gdal
+import osr
+import json
+import logging
+import numpy as np
+from collections import defaultdict
+from PIL import Image
+from gcbmanimation.layer.layer import Layer
+from gcbmanimation.layer.units import Units
+from gcbmanimation.util.config import IOProfile
+from gcbmanimation.util.operationmemo import OperationMemo
+from gcbmanimation.util.profiler import Profiler
+from gcbmanimation.util.resourcegovernor import ResourceGovernor
+from gcbmanimation.util.tempfile import TempFileManager
+from gcbmanimation.animator.frame import Frame
+
+class SparseLayer(Layer):
+    '''
+    A Layer for rasters that are almost entirely nodata, i.e. disturbances, where
+    usually well under 1% of the pixels in a year have a value. Only the pixels
+    with data are stored: their row, column and value, in order, with an index of
+    where each block of rows starts, in a compressed NumPy (.npz) file alongside
+    the raster's size, georeferencing and nodata value.
+
+    Reclassifying, flattening, merging and rendering work on the stored pixels
+    alone, as does cropping to a bounding box on the same grid; only the rendered
+    Frame is expanded to the full size of the raster. Cropping to a bounding box on a
+    different grid falls back to warping the expanded layer.
+
+    Arguments:
+    'path' -- path to the sparse layer file; see SparseLayer.from_layers.
+    'year' -- the year the layer applies to.
+    'interpretation' -- optional attribute table for the layer; see Layer.
+    'units' -- the units the layer's pixel values are in.
+    'identity' -- optional key identifying the layer's pixel content.
+    '''
+
+    extension = ".npz"
+    block_rows = 256
+
+    # The data pixels of the last bounding box cropped to in this process, which
+    # every layer cropped to it needs: (bounding box identity, bit-packed mask).
+    _bounding_box_mask = (None, None)
+
+    @staticmethod
+    def from_layers(layers):
+        '''
+        Encodes dense layers as sparse layers. Layers that share a raster file -
+        i.e. the years of a multi-year disturbance layer - are encoded from a
+        single read of the file, and each keeps only the pixels covered by its
+        own interpretation.
+
+        Arguments:
+        'layers' -- the Layer objects to encode.
+
+        Returns a list of new SparseLayer objects in the same order as the
+        original layers.
+        '''
+        layer_indices_by_path = defaultdict(list)
+        for i, layer in enumerate(layers):
+            layer_indices_by_path[layer.path].append(i)
+
+        raster = gdal.Open(layers[0].path) if layers else None
+        with ResourceGovernor.pool(raster and raster.RasterXSize * SparseLayer.block_rows) as pool:
+            tasks = [
+                (layer_indices, pool.apply_async(
+                    SparseLayer._encode_shared, ([layers[i] for i in layer_indices],)))
+                for layer_indices in layer_indices_by_path.values()]
+
+            sparse_layers = [None] * len(layers)
+            for layer_indices, task in tasks:
+                for i, sparse_layer in zip(layer_indices, task.get()):
+                    sparse_layers[i] = sparse_layer
+
+        return sparse_layers
+
+    @property
+    def info(self):
+        '''
+        Gets a GDAL-style info dictionary for this layer, including min/max values,
+        from the sparse layer file.
+        '''
+        if not self._info:
+            rows, cols, values, metadata = self._load()
+            width, height = metadata["size"]
+            geotransform = metadata["geotransform"]
+            band = {"type": metadata["data_type"], "noDataValue": metadata["nodata"]}
+            if values.size:
+                band["computedMin"] = values.min().item()
+                band["computedMax"] = values.max().item()
+
+            self._info = {
+                "size": [width, height],
+                "geoTransform": geotransform,
+                "coordinateSystem": {"wkt": metadata["projection"]},
+                "cornerCoordinates": {
+                    "upperLeft": [geotransform[0], geotransform[3]],
+                    "lowerRight": [geotransform[0] + width * geotransform[1],
+                                   geotransform[3] + height * geotransform[5]]
+                },
+                "bands": [band]
+            }
+
+        return self._info
+
+    def get_histogram(self, min_value, max_value, buckets):
+        '''Computes a histogram for this layer.'''
+        _, _, values, _ = self._load()
+        histogram, _ = np.histogram(values, buckets, (min_value, max_value))
+
+        return histogram.tolist()
+
+    def crop(self, bounding_box):
+        '''
+        Crops this layer to the minimum spatial extent and nodata pixels of a
+        bounding box; see BoundingBox.crop, which uses this for sparse layers.
+
+        Arguments:
+        'bounding_box' -- the BoundingBox to crop to.
+
+        Returns a new cropped SparseLayer object.
+        '''
+        bounding_box.prepare()
+
+        cropped_identity = self._derive_identity("crop", bounding_box.identity)
+        with Profiler.stage("crop", self._year):
+            output_path = OperationMemo.get_or_compute(cropped_identity, lambda: self._crop(bounding_box))
+
+        return SparseLayer(output_path, self._year, self._interpretation, self._units, cropped_identity)
+
+    def reclassify(self, new_interpretation, nodata_value=0):
+        '''
+        Reclassifies a copy of this layer's pixel values according to a new
+        interpretation; see Layer.reclassify.
+
+        Arguments:
+        'new_interpretation' -- dictionary of pixel value to interpreted value.
+        'nodata_value' -- the new nodata pixel value.
+
+        Returns a new reclassified SparseLayer object.
+        '''
+        reclassified_identity = self._derive_identity(
+            "reclassify", sorted(self._interpretation.items()),
+            sorted(new_interpretation.items()), nodata_value)
+
+        with Profiler.stage("reclassify", self._year):
+            output_path = OperationMemo.get_or_compute(
+                reclassified_identity, lambda: self._reclassify(new_interpretation, nodata_value))
+
+        return SparseLayer(output_path, self._year, new_interpretation, self._units, reclassified_identity)
+
+    @staticmethod
+    def reclassify_shared(layers, new_interpretation, nodata_value=0):
+        '''
+        Reclassifies several sparse layers; each sparse layer only stores the
+        pixels for its own year, so there is nothing to share between them. See
+        Layer.reclassify_shared.
+        '''
+        return [layer.reclassify(new_interpretation, nodata_value) for layer in layers]
+
+    def flatten(self, flattened_value=1, preserve_units=False):
+        '''
+        Flattens a copy of this layer: all non-nodata pixels become the target value.
+        See Layer.flatten.
+
+        Returns a new flattened SparseLayer object.
+        '''
+        flattened_identity = self._derive_identity("flatten", flattened_value)
+        with Profiler.stage("flatten", self._year):
+            output_path = OperationMemo.get_or_compute(flattened_identity, lambda: self._flatten(flattened_value))
+
+        return SparseLayer(output_path, self._year, units=self._units if preserve_units else Units.Blank,
+                           identity=flattened_identity)
+
+    @staticmethod
+    def merge(layers):
+        '''
+        Merges sparse layers on the same grid into one, where the pixels of later
+        layers take priority over earlier ones - the same as merging the dense
+        layers with gdal.Warp.
+
+        Arguments:
+        'layers' -- the SparseLayer objects to merge.
+
+        Returns a new merged SparseLayer object for the first layer's year.
+        '''
+        if len(layers) == 1:
+            return layers[0]
+
+        merged_identity = layers[0]._derive_identity("merge", *(layer.identity for layer in layers[1:]))
+        with Profiler.stage("merge", layers[0].year):
+            output_path = OperationMemo.get_or_compute(merged_identity, lambda: SparseLayer._merge(layers))
+
+        return SparseLayer(output_path, layers[0].year, layers[0].interpretation, layers[0].units,
+                           merged_identity)
+
+    def to_dense(self):
+        '''
+        Expands this layer into an ordinary raster, one block of rows at a time.
+
+        Returns a new Layer object for the dense raster.
+        '''
+        dense_identity = self._derive_identity("dense")
+        with Profiler.stage("expand", self._year):
+            output_path = OperationMemo.get_or_compute(dense_identity, self._to_dense)
+
+        return Layer(output_path, self._year, self._interpretation, self._units, dense_identity)
+
+    def render(self, legend, bounding_box=None, transparent=True, value_scale=1):
+        '''
+        Renders this layer into a colorized Frame according to the specified legend;
+        see Layer.render. Pixels are colorized straight from the stored pixels with
+        the same color table as a dense layer: each gets the color of the nearest
+        legend entry, and 0-value pixels are treated like nodata.
+
+        Returns this layer as a colorized Frame object.
+        '''
+        working_layer = self if not bounding_box else bounding_box.crop(self)
+        rows, cols, values, metadata = working_layer._load()
+        width, height = metadata["size"]
+
+        entry_values, entry_colors = zip(*sorted(
+            self._get_color_entries(legend, transparent, value_scale), key=lambda entry: entry[0]))
+
+        entry_values = np.array(entry_values, dtype=np.float64)
+        entry_colors = np.array(entry_colors, dtype=np.uint8)
+
+        rendered_layer_path = TempFileManager.mktmp(suffix=".png")
+        with Profiler.stage("colorize", self._year):
+            # Nodata pixels are white, and transparent unless requested otherwise.
+            image_data = np.full((height, width, 4), 255, dtype=np.uint8)
+            if transparent:
+                image_data[..., 3] = 0
+
+            # Like gdaldem's nearest_color_entry, a value halfway between two
+            # entries gets the color of the higher one.
+            upper = np.clip(np.searchsorted(entry_values, values), 0, len(entry_values) - 1)
+            lower = np.clip(upper - 1, 0, len(entry_values) - 1)
+            nearest = np.where(values - entry_values[lower] < entry_values[upper] - values, lower, upper)
+            image_data[rows, cols] = entry_colors[nearest]
+
+            Image.fromarray(image_data, "RGBA").save(rendered_layer_path)
+
+        return Frame(self._year, rendered_layer_path, self.scale)
+
+    @staticmethod
+    def _encode_shared(layers):
+        # The shared file is only read if at least one of the layers hasn't
+        # already been encoded.
+        points = None
+
+        def encode_layer(layer):
+            nonlocal points
+            if points is None:
+                logging.debug(f"Encoding {layers[0].path} for years {[layer.year for layer in layers]}")
+                points = SparseLayer._read_points(layers[0].path)
+
+            rows, cols, values, metadata = points
+            if layer.has_interpretation:
+                pixels = np.isin(values, list(layer.interpretation.keys()))
+                rows, cols, values = rows[pixels], cols[pixels], values[pixels]
+
+            return SparseLayer._save(rows, cols, values, metadata)
+
+        sparse_layers = []
+        for layer in layers:
+            sparse_identity = layer._derive_identity(
+                "sparse", sorted(layer.interpretation.items()) if layer.has_interpretation else None)
+
+            with Profiler.stage("encode_sparse", layer.year):
+                output_path = OperationMemo.get_or_compute(sparse_identity, lambda: encode_layer(layer))
+
+            sparse_layers.append(SparseLayer(output_path, layer.year, layer.interpretation, layer.units,
+                                             sparse_identity))
+
+        return sparse_layers
+
+    @staticmethod
+    def _read_points(path):
+        # Reads the data pixels from a dense raster a block of rows at a time, so
+        # the whole raster is never in memory at once.
+        ResourceGovernor.apply_gdal_limits()
+        raster = gdal.Open(path)
+        band = raster.GetRasterBand(1)
+        width, height = raster.RasterXSize, raster.RasterYSize
+        nodata_value = band.GetNoDataValue()
+
+        block_points = []
+        for row_offset in range(0, height, SparseLayer.block_rows):
+            block = band.ReadAsArray(0, row_offset, width, min(SparseLayer.block_rows, height - row_offset))
+            pixels = block != nodata_value if nodata_value is not None else np.ones(block.shape, dtype=bool)
+            block_rows, block_cols = np.nonzero(pixels)
+            block_points.append((block_rows + row_offset, block_cols, block[pixels]))
+
+        rows, cols, values = (np.concatenate(arrays) for arrays in zip(*block_points))
+        metadata = {
+            "size": [width, height],
+            "geotransform": list(raster.GetGeoTransform()),
+            "projection": raster.GetProjection(),
+            "data_type": gdal.GetDataTypeName(band.DataType),
+            "nodata": nodata_value if nodata_value is not None else 0
+        }
+
+        return rows.astype(np.int32), cols.astype(np.int32), values, metadata
+
+    @staticmethod
+    def _save(rows, cols, values, metadata):
+        # Pixels are kept in row-major order, with the index of the first pixel in
+        # each block of rows.
+        width, height = metadata["size"]
+        block_starts = np.searchsorted(rows, np.arange(0, height + SparseLayer.block_rows, SparseLayer.block_rows))
+        output_path = TempFileManager.mktmp(
+            suffix=SparseLayer.extension, size_hint=rows.nbytes + cols.nbytes + values.nbytes)
+
+        np.savez_compressed(output_path, rows=rows, cols=cols, values=values, block_starts=block_starts,
+                            metadata=np.array(json.dumps(metadata)))
+
+        return output_path
+
+    def _load(self, *extra_items):
+        with np.load(self._path) as sparse_data:
+            return (sparse_data["rows"], sparse_data["cols"], sparse_data["values"],
+                    json.loads(sparse_data["metadata"].item()),
+                    *(sparse_data[item] for item in extra_items))
+
+    def _crop(self, bounding_box):
+        rows, cols, values, metadata = self._load()
+        bbox_width, bbox_height = bounding_box.info["size"]
+        bbox_geotransform = bounding_box.info["geoTransform"]
+        bbox_projection = gdal.Open(bounding_box.path).GetProjection()
+
+        # Without a shared grid, the layer has to be warped to the bounding box.
+        x_offset, y_offset = self._find_grid_offset(metadata, bbox_geotransform, bbox_projection)
+        if x_offset is None:
+            logging.debug(f"{self._path} is not on the bounding box grid - cropping the expanded layer")
+            cropped_layer = bounding_box.crop(self.to_dense())
+            rows, cols, values, metadata = SparseLayer._read_points(cropped_layer.path)
+
+            return SparseLayer._save(rows, cols, values, metadata)
+
+        rows = rows - y_offset
+        cols = cols - x_offset
+        pixels = (rows >= 0) & (rows < bbox_height) & (cols >= 0) & (cols < bbox_width)
+        rows, cols, values = rows[pixels], cols[pixels], values[pixels]
+
+        bbox_mask = SparseLayer._get_bounding_box_mask(bounding_box)
+        pixels = (bbox_mask[rows, cols >> 3] >> (7 - (cols & 7)) & 1).astype(bool)
+        rows, cols, values = rows[pixels], cols[pixels], values[pixels]
+
+        metadata.update({
+            "size": [bbox_width, bbox_height],
+            "geotransform": list(bbox_geotransform),
+            "projection": bbox_projection
+        })
+
+        return SparseLayer._save(rows, cols, values, metadata)
+
+    @staticmethod
+    def _get_bounding_box_mask(bounding_box):
+        identity, bbox_mask = SparseLayer._bounding_box_mask
+        if identity != bounding_box.identity:
+            ResourceGovernor.apply_gdal_limits()
+            bbox_data = gdal.Open(bounding_box.path).GetRasterBand(1).ReadAsArray()
+            bbox_mask = np.packbits(bbox_data != bounding_box.nodata_value, axis=1)
+            SparseLayer._bounding_box_mask = (bounding_box.identity, bbox_mask)
+
+        return bbox_mask
+
+    def _find_grid_offset(self, metadata, geotransform, projection):
+        # Gets the pixel offset of another grid with the same projection and pixel
+        # size whose origin falls on a pixel corner of this layer's grid.
+        layer_srs = osr.SpatialReference(wkt=metadata["projection"])
+        other_srs = osr.SpatialReference(wkt=projection)
+        if not layer_srs.IsSame(other_srs):
+            return None, None
+
+        origin_x, pixel_size_x, _, origin_y, _, pixel_size_y = metadata["geotransform"]
+        other_origin_x, other_pixel_size_x, _, other_origin_y, _, other_pixel_size_y = geotransform
+        if not (np.isclose(pixel_size_x, other_pixel_size_x) and np.isclose(pixel_size_y, other_pixel_size_y)):
+            return None, None
+
+        x_offset = (other_origin_x - origin_x) / pixel_size_x
+        y_offset = (other_origin_y - origin_y) / pixel_size_y
+        if not (np.isclose(x_offset, round(x_offset)) and np.isclose(y_offset, round(y_offset))):
+            return None, None
+
+        return int(round(x_offset)), int(round(y_offset))
+
+    def _reclassify(self, new_interpretation, nodata_value):
+        rows, cols, values, metadata = self._load()
+        inverse_new_interpretation = {v: k for k, v in new_interpretation.items()}
+        reclassified_values = np.full(values.shape, nodata_value, dtype=values.dtype)
+        for original_pixel_value, interpreted_value in self._interpretation.items():
+            new_pixel_value = inverse_new_interpretation.get(interpreted_value, nodata_value)
+            if new_pixel_value == nodata_value:
+                logging.info(f"  No new pixel value for {interpreted_value}: setting to nodata ({nodata_value})")
+                continue
+
+            reclassified_values[values == original_pixel_value] = new_pixel_value
+
+        pixels = reclassified_values != nodata_value
+        metadata["nodata"] = nodata_value
+
+        return SparseLayer._save(rows[pixels], cols[pixels], reclassified_values[pixels], metadata)
+
+    def _flatten(self, flattened_value):
+        rows, cols, values, metadata = self._load()
+
+        return SparseLayer._save(rows, cols, np.full(values.shape, flattened_value, dtype=values.dtype), metadata)
+
+    @staticmethod
+    def _merge(layers):
+        layer_points = [layer._load() for layer in layers]
+        *_, metadata = layer_points[0]
+        if any(points[3]["size"] != metadata["size"] or points[3]["geotransform"] != metadata["geotransform"]
+               for points in layer_points[1:]):
+            raise ValueError("Cannot merge sparse layers on different grids.")
+
+        width, _ = metadata["size"]
+        rows, cols, values = (np.concatenate(arrays) for arrays in zip(*(points[:3] for points in layer_points)))
+
+        # Where layers overlap, keep the pixel from the last layer.
+        pixel_ids = rows.astype(np.int64) * width + cols
+        _, last_indices = np.unique(pixel_ids[::-1], return_index=True)
+        pixels = len(pixel_ids) - 1 - last_indices
+
+        return SparseLayer._save(rows[pixels], cols[pixels], values[pixels], metadata)
+
+    def _to_dense(self):
+        rows, cols, values, metadata, block_starts = self._load("block_starts")
+        width, height = metadata["size"]
+
+        output_path = TempFileManager.mktmp(suffix=".tif")
+        ResourceGovernor.apply_gdal_limits()
+        raster = gdal.GetDriverByName("GTiff").Create(
+            output_path, width, height, 1, gdal.GetDataTypeByName(metadata["data_type"]),
+            IOProfile.Scratch.creation_options)
+
+        raster.SetGeoTransform(metadata["geotransform"])
+        raster.SetProjection(metadata["projection"])
+        band = raster.GetRasterBand(1)
+        band.SetNoDataValue(metadata["nodata"])
+        for block, row_offset in enumerate(range(0, height, self.block_rows)):
+            block_height = min(self.block_rows, height - row_offset)
+            start, end = block_starts[block], block_starts[block + 1]
+            block_data = np.full((block_height, width), metadata["nodata"], dtype=values.dtype)
+            block_data[rows[start:end] - row_offset, cols[start:end]] = values[start:end]
+            band.WriteArray(block_data, 0, row_offset)
+
+        raster = None
+
+        return output_path
@@ -6,6 +6,7 @@ from matplotlib import gridspec
 from gcbmanimation.plot.resultsplot import ResultsPlot
 from gcbmanimation.animator.frame import Frame
 from gcbmanimation.util.tempfile import TempFileManager
+from gcbmanimation.util.profiler import Profiler
 
 class BasicResultsPlot(ResultsPlot):
 
@@ -23,13 +24,15 @@ class BasicResultsPlot(ResultsPlot):
 
         Returns a list of Frames, one for each year of output.
         '''
-        indicator_data = self._provider.get_annual_result(start_year, end_year, self._units, **kwargs)
+        with Profiler.stage("query_results"):
+            indicator_data = self._provider.get_annual_result(start_year, end_year, self._units, **kwargs)
+
         years = sorted(indicator_data)
         values = [indicator_data[year] for year in years]
 
         frames = []
         for i, year in enumerate(years):
-            with self._figure(figsize=(10, 5)) as fig:
+            with Profiler.stage("plot", year), self._figure(figsize=(10, 5)) as fig:
                 y_label = f"{self._title} ({self._units.value[2]})"
                 plt.xlabel("Years", fontweight="bold", fontsize=14)
                 plt.ylabel(y_label, fontweight="bold", fontsize=14)
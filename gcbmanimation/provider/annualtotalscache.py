@@ -0,0 +1,89 @@
+import os
+import json
+import logging
+from tempfile import NamedTemporaryFile
+
+class AnnualTotalsCache:
+    '''
+    Persistent on-disk store of spatial layer totals, so that layers which have
+    not changed since a previous run don't need to be read and summed again.
+    Totals are keyed by a string built from the layer's identity (which covers
+    its source file and any cropping), the units, and the bounding box.
+
+    Arguments:
+    'path' -- path to the JSON file to store the totals in.
+    '''
+
+    _default_path_var = "GCBMANIMATION_TOTALS_CACHE"
+
+    def __init__(self, path):
+        self._path = path
+        self._totals = None
+        self._pending = {}
+
+    @staticmethod
+    def set_default_path(path):
+        '''
+        Sets the file that results providers keep layer totals in between runs
+        when they aren't given one; there is no cache by default.
+
+        Arguments:
+        'path' -- path to the JSON file to store the totals in, or None to
+            disable the default cache.
+        '''
+        if path:
+            os.environ[AnnualTotalsCache._default_path_var] = os.path.abspath(path)
+        else:
+            os.environ.pop(AnnualTotalsCache._default_path_var, None)
+
+    @staticmethod
+    def get_default():
+        '''
+        Gets an AnnualTotalsCache for the file set by set_default_path, or None
+        if there isn't one.
+        '''
+        path = os.environ.get(AnnualTotalsCache._default_path_var)
+
+        return AnnualTotalsCache(path) if path else None
+
+    def get(self, key):
+        '''Gets a cached total, or None if the key is not in the cache.'''
+        if self._totals is None:
+            self._totals = self._load()
+
+        return self._pending.get(key, self._totals.get(key))
+
+    def set(self, key, total):
+        '''Adds or updates a cached total; call save() to write it to disk.'''
+        self._pending[key] = total
+
+    def save(self):
+        '''
+        Writes any new totals to disk, merged with whatever is currently there
+        in case another run has updated the cache in the meantime.
+        '''
+        if not self._pending:
+            return
+
+        try:
+            totals = self._load()
+            totals.update(self._pending)
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            with NamedTemporaryFile("w", dir=os.path.dirname(self._path), delete=False) as tmp_file:
+                json.dump(totals, tmp_file)
+
+            os.replace(tmp_file.name, self._path)
+            self._totals = totals
+            self._pending = {}
+        except OSError as e:
+            logging.warning(f"Unable to save annual totals cache {self._path}: {e}")
+
+    def _load(self):
+        if not os.path.exists(self._path):
+            return {}
+
+        try:
+            return json.load(open(self._path, "r"))
+        except (OSError, ValueError):
+            logging.warning(f"Ignoring unreadable annual totals cache: {self._path}")
+            return {}
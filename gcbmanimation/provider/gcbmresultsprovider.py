@@ -27,3 +27,15 @@ class GcbmResultsProvider:
         keys are in ascending chronological order.
         '''
         raise NotImplementedError()
+
+    def prefetch(self, queries):
+        '''
+        Optionally loads the annual results for several queries at once, so that
+        later calls to get_annual_result for them can be served without going back
+        to the underlying data source. Does nothing by default.
+
+        Arguments:
+        'queries' -- list of dictionaries of the additional (subclass-specific)
+            arguments accepted by get_annual_result, one per indicator.
+        '''
+        pass
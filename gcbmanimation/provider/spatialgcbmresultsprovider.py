@@ -1,12 +1,16 @@
 import os
+import math
 import sqlite3
 import gdal
-from multiprocessing import Pool
-from glob import glob
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from collections import OrderedDict
 from gcbmanimation.layer.layer import Layer
 from gcbmanimation.layer.units import Units
 from gcbmanimation.provider.gcbmresultsprovider import GcbmResultsProvider
+from gcbmanimation.provider.annualtotalscache import AnnualTotalsCache
+from gcbmanimation.util.resourcegovernor import ResourceGovernor
+from gcbmanimation.util.spatialoutputcatalog import SpatialOutputCatalog
 from gcbmanimation.util.utmzones import find_best_projection
 
 class SpatialGcbmResultsProvider(GcbmResultsProvider):
@@ -17,14 +21,27 @@ class SpatialGcbmResultsProvider(GcbmResultsProvider):
     'pattern' -- glob pattern for spatial layers to read.
     'layers' -- instead of specifying a file pattern to search for, a list of Layer
         objects can be provided directly.
+    'cache_path' -- optional path to the file used to keep layer totals between
+        runs; defaults to the one set by AnnualTotalsCache.set_default_path, if
+        any. Use False to disable the cache.
+    'sum_threads' -- number of threads to use when summing each layer's pixels;
+        defaults to the number of CPU threads available to the run.
     '''
 
-    def __init__(self, pattern=None, layers=None):
+    chunk_pixels = 2 ** 22
+
+    def __init__(self, pattern=None, layers=None, cache_path=None, sum_threads=None):
         self._pattern = pattern
         self._layers = layers
         if not (pattern or layers):
             raise RuntimeError("Must provide either a file pattern or a list of Layer objects")
 
+        self._totals_cache = None if cache_path is False \
+            else AnnualTotalsCache(cache_path) if cache_path \
+            else AnnualTotalsCache.get_default()
+
+        self._sum_threads = sum_threads or ResourceGovernor.cpu_limit()
+
     @property
     def simulation_years(self):
         '''See GcbmResultsProvider.simulation_years.'''
@@ -38,26 +55,54 @@ class SpatialGcbmResultsProvider(GcbmResultsProvider):
             start_year, end_year = self.simulation_years
 
         result_years = list(range(start_year, end_year + 1))
-        working_layers = [layer for layer in layers if layer.year in result_years]
-        with Pool() as pool:
-            if bounding_box:
-                working_layers = pool.map(bounding_box.crop, working_layers)
+        data = OrderedDict((year, 0) for year in result_years)
 
-            tasks = [pool.apply_async(layer.convert_units, (units,)) for layer in working_layers]
-            working_layers = [task.get() for task in tasks]
+        uncached_layers = []
+        for year in result_years:
+            layer = self._find_year(layers, year)
+            if not layer:
+                continue
 
-            data = OrderedDict()
-            for year in result_years:
-                layer = self._find_year(working_layers, year)
-                if not layer:
-                    data[year] = 0
-                    continue
+            cached_total = self._totals_cache.get(self._get_cache_key(layer, units, bounding_box)) \
+                if self._totals_cache else None
 
-                value = self._sum_pixels(layer)
-                data[year] = value
+            if cached_total is not None:
+                data[year] = cached_total
+            else:
+                uncached_layers.append(layer)
 
+        if not uncached_layers:
             return data
 
+        reference_raster = gdal.Open((bounding_box or uncached_layers[0]).path)
+        with ResourceGovernor.pool(reference_raster.RasterXSize * reference_raster.RasterYSize) as pool:
+            working_layers = pool.map(bounding_box.crop, uncached_layers) if bounding_box \
+                else uncached_layers
+
+            # Layers with a constant unit conversion factor are summed as-is and
+            # the factor applied to the total instead of to every pixel.
+            tasks = []
+            for layer in working_layers:
+                conversion_factor = layer.get_unit_conversion_factor(units)
+                tasks.append(
+                    (pool.apply_async(layer.convert_units, (units,)), 1) if conversion_factor is None
+                    else (None, conversion_factor))
+
+            working_layers = [
+                (task.get() if task else layer, conversion_factor)
+                for layer, (task, conversion_factor) in zip(working_layers, tasks)]
+
+        for original_layer, (layer, conversion_factor) in zip(uncached_layers, working_layers):
+            total = self._sum_pixels(layer) * conversion_factor
+            data[original_layer.year] = total
+            if self._totals_cache:
+                self._totals_cache.set(self._get_cache_key(original_layer, units, bounding_box), total)
+
+        if self._totals_cache:
+            self._totals_cache.save()
+
+        return data
+
     def _find_layers(self):
         pattern = self._pattern
         units = Units.TcPerHa
@@ -65,23 +110,46 @@ class SpatialGcbmResultsProvider(GcbmResultsProvider):
             pattern, units = self._pattern
 
         layers = []
-        for layer_path in glob(pattern):
-            year = os.path.splitext(layer_path)[0][-4:]
-            layer = Layer(layer_path, year, units=units)
-            layers.append(layer)
+        for layer_path, year in SpatialOutputCatalog.find(pattern):
+            if year:
+                layers.append(Layer(layer_path, year, units=units))
 
         if not layers:
-            raise IOError(f"No spatial output found for pattern: {self._layer_pattern}")
+            raise IOError(f"No spatial output found for pattern: {self._pattern}")
 
         return layers
 
     def _find_year(self, layers, year):
         return next(filter(lambda layer: layer.year == year, layers), None)
 
+    def _get_cache_key(self, layer, units, bounding_box=None):
+        return "|".join((
+            layer.identity, layer.units.name, units.name,
+            bounding_box.identity if bounding_box else ""))
+
     def _sum_pixels(self, layer):
+        # Sum in blocks of rows in float64 to keep memory use down and avoid the
+        # overflow and precision loss of summing in the raster's own data type.
         raster = gdal.Open(layer.path)
-        band = raster.GetRasterBand(1)
-        raster_data = band.ReadAsArray()
-        raster_data[raster_data == layer.nodata_value] = 0
-
-        return raster_data.sum()
+        width, height = raster.RasterXSize, raster.RasterYSize
+        _, block_height = raster.GetRasterBand(1).GetBlockSize()
+        rows_per_chunk = max(block_height, self.chunk_pixels // width // block_height * block_height)
+        chunks = [(y, min(rows_per_chunk, height - y)) for y in range(0, height, rows_per_chunk)]
+        nodata_value = layer.nodata_value
+        if not chunks:
+            return 0.0
+
+        with ThreadPoolExecutor(max(1, min(self._sum_threads, len(chunks)))) as executor:
+            chunk_totals = executor.map(lambda chunk: self._sum_rows(layer.path, nodata_value, *chunk), chunks)
+
+            return math.fsum(chunk_totals)
+
+    def _sum_rows(self, path, nodata_value, y_offset, rows):
+        # Each thread needs its own dataset handle - they can't be shared.
+        band = gdal.Open(path).GetRasterBand(1)
+        raster_data = band.ReadAsArray(0, y_offset, band.XSize, rows)
+        data_mask = raster_data != nodata_value
+        if np.issubdtype(raster_data.dtype, np.floating):
+            data_mask &= np.isfinite(raster_data)
+
+        return float(raster_data[data_mask].sum(dtype=np.float64))
@@ -1,5 +1,6 @@
 import os
 import sqlite3
+from urllib.request import pathname2url
 from collections import OrderedDict
 from gcbmanimation.provider.gcbmresultsprovider import GcbmResultsProvider
 from gcbmanimation.layer.units import Units
@@ -7,6 +8,9 @@ from gcbmanimation.layer.units import Units
 class SqliteGcbmResultsProvider(GcbmResultsProvider):
     '''
     Retrieves non-spatial annual results from a SQLite GCBM results database.
+    The database is opened read-only and immutable, so the connection is only
+    safe to use as long as nothing else is writing to the database. Each process
+    lazily opens its own connection, so a provider can be passed to pool workers.
 
     Arguments:
     'path' -- path to SQLite GCBM results database.
@@ -19,50 +23,110 @@ class SqliteGcbmResultsProvider(GcbmResultsProvider):
         "v_stock_change_indicators"  : "flux_tc",
     }
 
+    mmap_size = 2 ** 30
+    cache_size_kb = 256 * 1024
+
     def __init__(self, path):
         if not os.path.exists(path):
             raise IOError(f"{path} not found.")
 
         self._path = path
+        self._conn = None
+        self._conn_pid = None
+        self._years = None
+        self._results = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_conn"] = None
+        state["_conn_pid"] = None
+
+        return state
 
     @property
     def simulation_years(self):
         '''See GcbmResultsProvider.simulation_years.'''
-        conn = sqlite3.connect(self._path)
-        years = conn.execute("SELECT MIN(year), MAX(year) from v_age_indicators").fetchone()
+        years = self._simulation_year_list
 
-        return years
+        return (years[0], years[-1]) if years else (None, None)
 
     def get_annual_result(self, start_year=None, end_year=None, units=Units.Tc, indicator=None, **kwargs):
         '''See GcbmResultsProvider.get_annual_result.'''
-        conn = sqlite3.connect(self._path)
-        table, value_col = self._find_indicator_table(indicator)
+        if indicator not in self._results:
+            self.prefetch([{"indicator": indicator}])
+
         _, units_tc, _ = units.value
         if not start_year or not end_year:
             start_year, end_year = self.simulation_years
 
-        db_result = conn.execute(
-            f"""
-            SELECT years.year, COALESCE(SUM(i.{value_col}), 0) / {units_tc} AS value
-            FROM (SELECT DISTINCT year FROM v_age_indicators ORDER BY year) AS years
-            LEFT JOIN {table} i
-                ON years.year = i.year
-            WHERE i.indicator = '{indicator}'
-                AND (years.year BETWEEN {start_year} AND {end_year})
-            GROUP BY years.year
-            ORDER BY years.year
-            """).fetchall()
+        indicator_results = self._results[indicator]
 
         data = OrderedDict()
-        for year, value in db_result:
-            data[year] = value
+        for year in self._simulation_year_list:
+            if start_year <= year <= end_year and year in indicator_results:
+                data[year] = indicator_results[year] / units_tc
 
         return data
 
-    def _find_indicator_table(self, indicator):
-        conn = sqlite3.connect(self._path)
+    def prefetch(self, queries):
+        '''
+        See GcbmResultsProvider.prefetch. Loads the annual totals (in tC) for all
+        of the requested indicators with a single grouped query per results view;
+        unit conversion is applied when the results are retrieved.
+        '''
+        remaining_indicators = {
+            query["indicator"] for query in queries
+            if query.get("indicator") is not None
+        } - set(self._results)
+
         for table, value_col in SqliteGcbmResultsProvider.results_tables.items():
-            if conn.execute(f"SELECT 1 FROM {table} WHERE indicator = ?", [indicator]).fetchone():
-                return table, value_col
+            if not remaining_indicators:
+                break
+
+            placeholders = ", ".join("?" * len(remaining_indicators))
+            db_result = self._connection.execute(
+                f"""
+                SELECT indicator, year, COALESCE(SUM({value_col}), 0) AS value
+                FROM {table}
+                WHERE indicator IN ({placeholders})
+                GROUP BY indicator, year
+                """, list(remaining_indicators)).fetchall()
+
+            # Indicators are taken from the first view they are found in.
+            table_results = {}
+            for indicator, year, value in db_result:
+                table_results.setdefault(indicator, {})[year] = value
+
+            self._results.update(table_results)
+            remaining_indicators -= set(table_results)
+
+        for indicator in remaining_indicators:
+            self._results[indicator] = {}
+
+    def close(self):
+        '''Closes this process's connection to the results database, if open.'''
+        if self._conn and self._conn_pid == os.getpid():
+            self._conn.close()
+
+        self._conn = None
+        self._conn_pid = None
+
+    @property
+    def _connection(self):
+        if not self._conn or self._conn_pid != os.getpid():
+            db_uri = f"file:{pathname2url(os.path.abspath(self._path))}?mode=ro&immutable=1"
+            self._conn = sqlite3.connect(db_uri, uri=True)
+            self._conn.execute(f"PRAGMA mmap_size = {SqliteGcbmResultsProvider.mmap_size}")
+            self._conn.execute(f"PRAGMA cache_size = -{SqliteGcbmResultsProvider.cache_size_kb}")
+            self._conn.execute("PRAGMA temp_store = MEMORY")
+            self._conn_pid = os.getpid()
+
+        return self._conn
+
+    @property
+    def _simulation_year_list(self):
+        if self._years is None:
+            self._years = [year for year, in self._connection.execute(
+                "SELECT DISTINCT year FROM v_age_indicators ORDER BY year")]
 
-        return None, None
+        return self._years
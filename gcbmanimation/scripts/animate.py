@@ -7,13 +7,20 @@ from glob import glob
 from argparse import ArgumentParser
 from gcbmanimation.util.disturbancelayerconfigurer import DisturbanceLayerConfigurer
 from gcbmanimation.provider.sqlitegcbmresultsprovider import SqliteGcbmResultsProvider
-from gcbmanimation.provider.spatialgcbmresultsprovider import SpatialGcbmResultsProvider
 from gcbmanimation.indicator.indicator import Indicator
+from gcbmanimation.indicator.formulaindicator import FormulaIndicator
 from gcbmanimation.layer.units import Units
 from gcbmanimation.animator.animator import Animator
 from gcbmanimation.layer.boundingbox import BoundingBox
 from gcbmanimation.color.quantilecolorizer import QuantileColorizer
 from gcbmanimation.util.tempfile import TempFileManager
+from gcbmanimation.util.operationmemo import OperationMemo
+from gcbmanimation.layer.layercube import LayerCube
+from gcbmanimation.util.resourcegovernor import ResourceGovernor
+from gcbmanimation.util.profiler import Profiler
+from gcbmanimation.animator.runplanner import RunPlanner
+from gcbmanimation.util.spatialoutputcatalog import SpatialOutputCatalog
+from gcbmanimation.provider.annualtotalscache import AnnualTotalsCache
 
 def find_units(units_str):
     try:
@@ -21,9 +28,137 @@ def find_units(units_str):
     except:
         return Units.Tc
 
+def find_bounding_box(study_area_path):
+    # Try to find a suitable bounding box: the tiler bounding box is usually
+    # the only tiff file in the study area directory without "moja" in its name;
+    # if that isn't found, use the first tiff file in the study area dir.
+    study_area_dir = os.path.dirname(study_area_path)
+    bounding_box_candidates = glob(os.path.join(study_area_dir, "*.tiff"))
+    bounding_box_file = next(filter(lambda tiff: "moja" not in tiff, bounding_box_candidates), None)
+    if not bounding_box_file:
+        bounding_box_file = bounding_box_candidates[0]
+
+    return bounding_box_file
+
+def load_indicators(config_path, spatial_results, results_provider=None):
+    indicators = []
+    for indicator_config in json.load(open(config_path, "rb")):
+        graph_units = find_units(indicator_config["graph_units"]) if "graph_units" in indicator_config else Units.Tc
+        map_units = find_units(indicator_config["map_units"]) if "map_units" in indicator_config else Units.TcPerHa
+        colorizer = QuantileColorizer(
+            palette=indicator_config.get("palette"),
+            negative_palette=indicator_config.get("negative_palette"))
+
+        if "formula" in indicator_config:
+            components = {}
+            for name, component in indicator_config["components"].items():
+                if isinstance(component, dict):
+                    components[name] = dict(component, pattern=os.path.join(spatial_results, component["pattern"]))
+                    if "units" in component:
+                        components[name]["units"] = find_units(component["units"])
+                else:
+                    components[name] = os.path.join(spatial_results, component)
+
+            units = find_units(indicator_config["units"]) if "units" in indicator_config else Units.TcPerHa
+            indicators.append(FormulaIndicator(
+                indicator_config["indicator"], indicator_config["formula"], components,
+                indicator_config.get("title"), units, graph_units, map_units, colorizer=colorizer))
+
+            continue
+
+        output_file_pattern = indicator_config["file_pattern"]
+        output_file_units = Units.TcPerHa
+        if isinstance(output_file_pattern, list):
+            output_file_pattern, output_file_units = output_file_pattern
+
+        output_file_pattern = os.path.join(spatial_results, output_file_pattern)
+
+        indicators.append(Indicator(
+            indicator_config["database_indicator"],
+            output_file_pattern,
+            results_provider, {"indicator": indicator_config["database_indicator"]},
+            indicator_config.get("title"),
+            graph_units, map_units,
+            colorizer=colorizer))
+
+    return indicators
+
+def add_common_arguments(parser):
+    # Options shared by the gcbmanimation and gcbmanimation-batch scripts.
+    parser.add_argument("--bounding_box", type=os.path.abspath, help="Bounding box defining animation area")
+    parser.add_argument("--temp_quota", type=float, help="Maximum disk space (GB) to use for temporary files")
+    parser.add_argument("--memory_budget", type=float, help="Memory (GB) to use for temporary files before using disk")
+    parser.add_argument("--ramdisk", type=os.path.abspath, help="tmpfs directory for in-memory temporary files (requires --memory_budget)")
+    parser.add_argument("--max_workers", type=int, help="Maximum number of worker processes")
+    parser.add_argument("--max_threads", type=int, help="Maximum number of CPU threads to use in total")
+    parser.add_argument("--max_memory", type=float, help="Maximum memory (GB) to use in total")
+    parser.add_argument("--tile_size", type=float, help="Split rasters into tiles of at least this many megapixels to process in parallel when there are fewer layers than workers")
+    parser.add_argument("--cache_dir", type=os.path.abspath, help="Directory to keep processed rasters and layer totals in between runs")
+    parser.add_argument("--cache_size", type=float, default=10, help="Maximum size (GB) of the --cache_dir cache")
+    parser.add_argument("--cube", action="store_true", help="Stack each indicator's cropped, converted spatial output into one multi-band raster, kept in --cache_dir for reruns")
+    parser.add_argument("--sparse_disturbances", action="store_true", help="Store only the disturbed pixels of each disturbance layer instead of processing full rasters")
+    parser.add_argument("--incremental", action="store_true", help="Only process years whose spatial output has changed since the last run")
+    parser.add_argument("--catalog_sidecar", action="store_true", help="Keep the index of the spatial output directory in a file in the directory instead of the cache directory")
+    parser.add_argument("--no_memo", action="store_true", help="Recompute repeated raster operations instead of sharing them")
+    parser.add_argument("--profile", type=os.path.abspath, help="Write a report of the time and resources used by each stage (.json or .csv)")
+    parser.add_argument("--cprofile", type=os.path.abspath, help="Directory to write a cProfile dump for each stage to (requires --profile or --trace)")
+    parser.add_argument("--trace", type=os.path.abspath, help="Write a Chrome trace (.json) of the stages run by each process, for Perfetto")
+    parser.add_argument("--plan", action="store_true", help="Estimate the run's operations, runtime, memory and temporary disk space without running it")
+    parser.add_argument("--plan_output", type=os.path.abspath, help="Optional path to save the --plan estimates to as JSON")
+    parser.add_argument("--calibration", type=os.path.abspath, help="Benchmark results (gcbmanimation.benchmark.hotpaths --output) to calibrate --plan with")
+
+def apply_common_arguments(args):
+    # Applies the resource, caching and profiling settings from the options added
+    # by add_common_arguments.
+    ResourceGovernor.set_limits(args.max_workers, args.max_threads,
+                                args.max_memory and args.max_memory * 1024 ** 3)
+    ResourceGovernor.set_tiling(args.tile_size and args.tile_size * 1e6)
+
+    if args.temp_quota:
+        TempFileManager.set_disk_quota(args.temp_quota * 1024 ** 3)
+
+    if args.ramdisk and not args.memory_budget:
+        sys.exit("--ramdisk requires --memory_budget.")
+
+    if args.memory_budget:
+        TempFileManager.set_storage(args.memory_budget * 1024 ** 3, args.ramdisk)
+
+    OperationMemo.set_enabled(not args.no_memo)
+    if args.cache_dir:
+        OperationMemo.set_persistent_cache(args.cache_dir, args.cache_size * 1024 ** 3)
+        AnnualTotalsCache.set_default_path(os.path.join(args.cache_dir, "annual_totals.json"))
+
+    LayerCube.set_enabled(args.cube)
+    SpatialOutputCatalog.set_sidecar(args.catalog_sidecar)
+
+    TempFileManager.delete_on_exit()
+
+    if args.profile or args.trace:
+        Profiler.enable(TempFileManager.get_shared_dir("profile"), args.cprofile)
+
+def configure_disturbances(args):
+    # A plan only reads the disturbance rasters' headers, so they aren't encoded.
+    disturbance_configurer = DisturbanceLayerConfigurer(sparse=args.sparse_disturbances and not args.plan)
+
+    return disturbance_configurer.configure(args.study_area)
+
+def plan_run(args, bounding_box_file, disturbance_layers, indicators):
+    planner = RunPlanner(args.calibration)
+    operations = planner.plan(bounding_box_file, disturbance_layers, indicators)
+    summary = planner.summarize(operations)
+    planner.report(operations, summary, args.plan_output)
+
+def write_profile(args):
+    if args.profile:
+        Profiler.report(args.profile)
+        logging.info(f"Wrote profile: {args.profile}")
+
+    if args.trace:
+        Profiler.write_trace(args.trace)
+        logging.info(f"Wrote trace: {args.trace}")
+
 def cli():
     logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(message)s")
-    TempFileManager.delete_on_exit()
 
     parser = ArgumentParser(description="Create GCBM results animations")
     parser.add_argument("study_area", type=os.path.abspath, help="Path to study area file for GCBM spatial input")
@@ -31,57 +166,38 @@ def cli():
     parser.add_argument("config", type=os.path.abspath, help="Path to animation config file")
     parser.add_argument("output_path", type=os.path.abspath, help="Directory to write animations to")
     parser.add_argument("--db_results", type=os.path.abspath, help="Path to compiled GCBM results database")
-    parser.add_argument("--bounding_box", type=os.path.abspath, help="Bounding box defining animation area")
+    add_common_arguments(parser)
     args = parser.parse_args()
 
+    apply_common_arguments(args)
+
     for path in filter(lambda fn: fn, (args.study_area, args.spatial_results, args.db_results, args.config)):
         if not os.path.exists(path):
             sys.exit(f"{path} not found.")
 
-    bounding_box_file = args.bounding_box
-    if not bounding_box_file:
-        # Try to find a suitable bounding box: the tiler bounding box is usually
-        # the only tiff file in the study area directory without "moja" in its name;
-        # if that isn't found, use the first tiff file in the study area dir.
-        study_area_dir = os.path.dirname(args.study_area)
-        bounding_box_candidates = glob(os.path.join(study_area_dir, "*.tiff"))
-        bounding_box_file = next(filter(lambda tiff: "moja" not in tiff, bounding_box_candidates), None)
-        if not bounding_box_file:
-            bounding_box_file = bounding_box_candidates[0]
+    bounding_box_file = args.bounding_box or find_bounding_box(args.study_area)
 
     logging.info(f"Using bounding box: {bounding_box_file}")
     bounding_box = BoundingBox(bounding_box_file)
 
-    disturbance_configurer = DisturbanceLayerConfigurer()
-    disturbance_layers = disturbance_configurer.configure(args.study_area)
-
-    indicators = []
-    for indicator_config in json.load(open(args.config, "rb")):
-        graph_units = find_units(indicator_config["graph_units"]) if "graph_units" in indicator_config else Units.Tc
-        map_units = find_units(indicator_config["map_units"]) if "map_units" in indicator_config else Units.TcPerHa
+    disturbance_layers = configure_disturbances(args)
 
-        output_file_pattern = indicator_config["file_pattern"]
-        output_file_units = Units.TcPerHa
-        if isinstance(output_file_pattern, list):
-            output_file_pattern, output_file_units = output_file_pattern
+    # Without a results database, or when animating a cropped area, the graphed
+    # results are summed from the indicator's own cropped spatial output.
+    results_provider = SqliteGcbmResultsProvider(args.db_results) \
+        if args.db_results and not args.bounding_box else None
 
-        output_file_pattern = os.path.join(args.spatial_results, output_file_pattern)
+    indicators = load_indicators(args.config, args.spatial_results, results_provider)
 
-        results_provider = SqliteGcbmResultsProvider(args.db_results) if args.db_results and not args.bounding_box \
-            else SpatialGcbmResultsProvider(output_file_pattern)
-
-        indicators.append(Indicator(
-            indicator_config["database_indicator"],
-            output_file_pattern,
-            results_provider, {"indicator": indicator_config["database_indicator"]},
-            indicator_config.get("title"),
-            graph_units, map_units,
-            colorizer=QuantileColorizer(
-                palette=indicator_config.get("palette"),
-                negative_palette=indicator_config.get("negative_palette"))))
+    if args.plan:
+        plan_run(args, bounding_box_file, disturbance_layers, indicators)
+        sys.exit(0)
 
     animator = Animator(disturbance_layers, indicators, args.output_path)
-    animator.render(bounding_box)
+    with Profiler.stage("animate"):
+        animator.render(bounding_box, incremental=args.incremental)
+
+    write_profile(args)
 
 if __name__ == "__main__":
     cli()
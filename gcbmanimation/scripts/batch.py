@@ -0,0 +1,86 @@
+import os
+import sys
+import json
+import logging
+from argparse import ArgumentParser
+from itertools import chain
+from gcbmanimation.provider.sqlitegcbmresultsprovider import SqliteGcbmResultsProvider
+from gcbmanimation.animator.batchanimator import BatchAnimator
+from gcbmanimation.layer.boundingbox import BoundingBox
+from gcbmanimation.util.profiler import Profiler
+from gcbmanimation.scripts.animate import find_bounding_box
+from gcbmanimation.scripts.animate import load_indicators
+from gcbmanimation.scripts.animate import add_common_arguments
+from gcbmanimation.scripts.animate import apply_common_arguments
+from gcbmanimation.scripts.animate import configure_disturbances
+from gcbmanimation.scripts.animate import plan_run
+from gcbmanimation.scripts.animate import write_profile
+
+def load_runs(runs_path):
+    # The runs file is a dictionary of run name to the run's spatial output
+    # directory and optional results database, with paths relative to the file:
+    # {"baseline": {"spatial_results": "baseline/output_files/spatial",
+    #               "db_results": "baseline/compiled_gcbm_output.db"}, ...}
+    runs_dir = os.path.dirname(runs_path)
+    runs = {}
+    for name, run in json.load(open(runs_path, "rb")).items():
+        runs[name] = {
+            setting: os.path.abspath(os.path.join(runs_dir, path))
+            for setting, path in run.items()
+        }
+
+    return runs
+
+def cli():
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(message)s")
+
+    parser = ArgumentParser(description="Create GCBM results animations for many runs sharing a study area")
+    parser.add_argument("study_area", type=os.path.abspath, help="Path to study area file for GCBM spatial input shared by the runs")
+    parser.add_argument("runs", type=os.path.abspath, help="Path to runs file: run name to spatial_results and optional db_results paths")
+    parser.add_argument("config", type=os.path.abspath, help="Path to animation config file")
+    parser.add_argument("output_path", type=os.path.abspath, help="Directory to write each run's animations to")
+    parser.add_argument("--common_legend", action="store_true", help="Use the same legend for an indicator in every run so the animations are comparable")
+    add_common_arguments(parser)
+    args = parser.parse_args()
+
+    apply_common_arguments(args)
+
+    for path in (args.study_area, args.runs, args.config):
+        if not os.path.exists(path):
+            sys.exit(f"{path} not found.")
+
+    runs = load_runs(args.runs)
+    for run in runs.values():
+        for path in run.values():
+            if not os.path.exists(path):
+                sys.exit(f"{path} not found.")
+
+    bounding_box_file = args.bounding_box or find_bounding_box(args.study_area)
+    logging.info(f"Using bounding box: {bounding_box_file}")
+    bounding_box = BoundingBox(bounding_box_file)
+
+    disturbance_layers = configure_disturbances(args)
+
+    run_indicators = {}
+    for name, run in runs.items():
+        # Without a results database, or when animating a cropped area, the graphed
+        # results are summed from the indicator's own cropped spatial output.
+        results_provider = SqliteGcbmResultsProvider(run["db_results"]) \
+            if run.get("db_results") and not args.bounding_box else None
+
+        run_indicators[name] = load_indicators(args.config, run["spatial_results"], results_provider)
+
+    if args.plan:
+        # The runs share the bounding box and disturbances, so they're planned
+        # as a single run of every run's indicators.
+        plan_run(args, bounding_box_file, disturbance_layers, list(chain(*run_indicators.values())))
+        sys.exit(0)
+
+    animator = BatchAnimator(disturbance_layers, run_indicators, args.output_path)
+    with Profiler.stage("animate"):
+        animator.render(bounding_box, incremental=args.incremental, common_legend=args.common_legend)
+
+    write_profile(args)
+
+if __name__ == "__main__":
+    cli()
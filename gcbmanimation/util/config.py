@@ -1,5 +1,28 @@
-import psutil
-from multiprocessing import cpu_count
+import os
+from enum import Enum
 
-gdal_memory_limit = int(psutil.virtual_memory().available * 0.75 / cpu_count())
-gdal_creation_options = ["BIGTIFF=YES", "TILED=YES", "COMPRESS=ZSTD", "ZSTD_LEVEL=1", "NUM_THREADS=ALL_CPUS"]
+# Compression for short-lived intermediates, i.e. NONE, LZW, DEFLATE or ZSTD.
+scratch_compression = os.environ.get("GCBMANIMATION_SCRATCH_COMPRESS", "NONE")
+
+class IOProfile(Enum):
+                 # GeoTIFF creation options
+    Scratch    = ("BIGTIFF=IF_SAFER", "TILED=YES", f"COMPRESS={scratch_compression}")
+    Compressed = ("BIGTIFF=YES", "TILED=YES", "COMPRESS=ZSTD", "ZSTD_LEVEL=1")
+    Cube       = ("BIGTIFF=YES", "TILED=YES", "INTERLEAVE=BAND", "COMPRESS=ZSTD", "ZSTD_LEVEL=1")
+
+    @property
+    def creation_options(self):
+        '''
+        Gets the GDAL creation options for this profile: Scratch for intermediates
+        that are read back a few times and deleted, Compressed for anything
+        persisted or cached, and Cube for multi-band stacks of yearly layers,
+        where each band is stored separately so a year is read on its own.
+        Compression threads are set per process by the GDAL_NUM_THREADS config
+        option (see ResourceGovernor).
+        '''
+        return list(self.value)
+
+
+# Directory for data kept between runs, i.e. cached results.
+cache_dir = os.environ.get(
+    "GCBMANIMATION_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "gcbmanimation"))
@@ -2,6 +2,7 @@ import os
 import json
 from gcbmanimation.color.colorizer import Colorizer
 from gcbmanimation.layer.layer import Layer
+from gcbmanimation.layer.sparselayer import SparseLayer
 from gcbmanimation.layer.units import Units
 from gcbmanimation.layer.layercollection import LayerCollection
 
@@ -16,10 +17,13 @@ class DisturbanceLayerConfigurer:
     'colorizer' -- a Colorizer to create the map legend with - defaults to
         basic Colorizer which bins values into equal-sized buckets.
     'background_color' -- RGB tuple for the background color.
+    'sparse' -- encode the disturbance layers as SparseLayers, which only store
+        their disturbed pixels, instead of processing them as full rasters.
     '''
-    def __init__(self, colorizer=None, background_color=(224, 224, 224)):
+    def __init__(self, colorizer=None, background_color=(224, 224, 224), sparse=False):
         self._colorizer = colorizer or Colorizer()
         self._background_color = background_color
+        self._sparse = sparse
 
     def configure(self, study_area_path):
         '''
@@ -64,6 +68,11 @@ class DisturbanceLayerConfigurer:
 
                 layer_collection.append(Layer(layer_tif, year, interpretation, Units.Blank))
 
+        if self._sparse and not layer_collection.empty:
+            layer_collection = LayerCollection(SparseLayer.from_layers(layer_collection.layers),
+                                               colorizer=self._colorizer,
+                                               background_color=self._background_color)
+
         return layer_collection
 
     def _find_first(self, *paths):
@@ -0,0 +1,183 @@
+import os
+import time
+import psutil
+import logging
+from gcbmanimation.util.config import IOProfile
+from gcbmanimation.util.tempfile import TempFileManager
+from gcbmanimation.util.rastercache import RasterCache
+
+class OperationMemo:
+    '''
+    Run-wide memo of raster operations, so that an operation repeated on the same
+    input - i.e. cropping each year of a multi-year disturbance layer, flattening
+    the same bounding box for every indicator's background - is only computed
+    once. Entries are keyed by the identity of the operation's output, which is
+    derived from the identity of its input, the operation, and its parameters,
+    and map to the output file. Outputs are temporary files like any other: an
+    entry is only reused for as long as its file is still owned by a Layer,
+    and once the last owner is gone the file is deleted (see
+    TempFileManager.track) and the operation is computed again if it's needed.
+    The memo is kept on disk so that it is shared between pool workers: a worker
+    that needs an output another worker is still computing waits for it rather
+    than computing it again, unless the process computing it has died.
+    Optionally, outputs are also kept between runs in a persistent RasterCache.
+    '''
+
+    # Settings are kept in the environment so that pool workers see them too.
+    _disabled_var = "GCBMANIMATION_MEMO_DISABLED"
+    _cache_path_var = "GCBMANIMATION_RASTER_CACHE"
+    _cache_size_var = "GCBMANIMATION_RASTER_CACHE_SIZE"
+    default_cache_size = 10 * 1024 ** 3
+    _memo_dir_name = "memo"
+    wait_timeout = 600
+    poll_interval = 0.1
+
+    def __init__(self):
+        raise RuntimeError("Not instantiable")
+
+    @staticmethod
+    def set_enabled(enabled=True):
+        '''
+        Turns memoization on or off for the run; it is on by default.
+
+        Arguments:
+        'enabled' -- whether or not to memoize operations.
+        '''
+        if enabled:
+            os.environ.pop(OperationMemo._disabled_var, None)
+        else:
+            os.environ[OperationMemo._disabled_var] = "1"
+
+    @staticmethod
+    def set_persistent_cache(path=None, max_bytes=None):
+        '''
+        Keeps memoized outputs between runs in a cache directory; this is off by
+        default.
+
+        Arguments:
+        'path' -- the cache directory, or None to turn the persistent cache off.
+        'max_bytes' -- the maximum size of the cache; defaults to
+            OperationMemo.default_cache_size.
+        '''
+        for var, value in ((OperationMemo._cache_path_var, path),
+                           (OperationMemo._cache_size_var, path and int(max_bytes or 0))):
+            if value:
+                os.environ[var] = str(value)
+            else:
+                os.environ.pop(var, None)
+
+    @staticmethod
+    def is_enabled():
+        '''Checks if memoization is turned on for the run.'''
+        return not os.environ.get(OperationMemo._disabled_var)
+
+    @staticmethod
+    def get_or_compute(key, compute, cache_profile=IOProfile.Compressed):
+        '''
+        Gets the output of an operation from the memo, computing it if this is the
+        first time the operation has been requested, or waiting for it if another
+        process is already computing it.
+
+        Arguments:
+        'key' -- the identity of the operation's output.
+        'compute' -- function that performs the operation and returns the path to
+            the output file.
+        'cache_profile' -- the IOProfile to keep the output in the persistent
+            cache with; see RasterCache.put.
+
+        Returns the path to the output file.
+        '''
+        if not OperationMemo.is_enabled():
+            return compute()
+
+        memo_dir = TempFileManager.get_shared_dir(OperationMemo._memo_dir_name)
+        entry_path = os.path.join(memo_dir, f"{key}.path")
+        lock_path = os.path.join(memo_dir, f"{key}.lock")
+        deadline = time.monotonic() + OperationMemo.wait_timeout
+        while True:
+            output_path = OperationMemo._read_entry(entry_path)
+            if output_path:
+                return output_path
+
+            try:
+                lock = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(lock, str(os.getpid()).encode("utf-8"))
+                os.close(lock)
+                break
+            except FileExistsError:
+                if OperationMemo._break_stale_lock(lock_path):
+                    continue
+
+                if time.monotonic() > deadline:
+                    logging.warning(f"Timed out waiting for operation {key} in another process - computing it again")
+                    return compute()
+
+                time.sleep(OperationMemo.poll_interval)
+
+        try:
+            persistent_cache = OperationMemo._get_persistent_cache()
+            output_path = persistent_cache.get(key) if persistent_cache else None
+            if not output_path:
+                output_path = compute()
+                if persistent_cache:
+                    persistent_cache.put(key, output_path, cache_profile)
+
+            OperationMemo._write_entry(entry_path, output_path)
+
+            return output_path
+        finally:
+            try:
+                os.remove(lock_path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _get_persistent_cache():
+        cache_path = os.environ.get(OperationMemo._cache_path_var)
+        if not cache_path:
+            return None
+
+        max_bytes = int(os.environ.get(OperationMemo._cache_size_var, 0)) or OperationMemo.default_cache_size
+
+        return RasterCache(cache_path, max_bytes)
+
+    @staticmethod
+    def _break_stale_lock(lock_path):
+        # A lock left behind by a process that died while computing an operation
+        # would otherwise hold up every other process until the timeout.
+        try:
+            owner = open(lock_path, "r").read()
+        except OSError:
+            return True # Released in the meantime.
+
+        if not owner or psutil.pid_exists(int(owner)):
+            return False
+
+        logging.warning(f"Breaking lock {lock_path} left behind by process {owner}")
+        try:
+            os.remove(lock_path)
+        except OSError:
+            pass
+
+        return True
+
+    @staticmethod
+    def _read_entry(entry_path):
+        try:
+            output_path = open(entry_path, "r").read()
+        except OSError:
+            return None
+
+        return output_path if os.path.exists(output_path) else None
+
+    @staticmethod
+    def _write_entry(entry_path, output_path):
+        # Outputs in /vsimem/ can't be seen by other processes.
+        if output_path.startswith("/vsimem/"):
+            return
+
+        tmp_entry_path = f"{entry_path}.{os.getpid()}"
+        with open(tmp_entry_path, "w") as entry:
+            entry.write(output_path)
+
+        os.replace(tmp_entry_path, entry_path)
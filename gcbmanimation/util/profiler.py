@@ -0,0 +1,251 @@
+import os
+import csv
+import json
+import time
+import psutil
+import threading
+import cProfile
+from glob import glob
+from contextlib import contextmanager
+from collections import defaultdict
+
+try:
+    import resource
+except ImportError:
+    resource = None # Not available on Windows.
+
+class Profiler:
+    '''
+    Records how long each stage of a run takes - wall time, CPU time (including
+    child processes such as ffmpeg), bytes read and written, and the peak memory
+    of the process running it - including stages that run in pool workers. Each
+    process appends its records to its own file in a shared directory, and
+    Profiler.report combines them into a summary per stage and per stage and year,
+    or Profiler.write_trace into a timeline of every process. Profiling is off unless turned on with
+    Profiler.enable, and stages cost almost nothing when it's off.
+
+    The memory recorded for a stage (process_peak_rss) is the high-water mark of
+    the process that ran it as of the end of the stage, not the stage's own peak:
+    a pool worker's record includes the largest task it ran before, so it is an
+    upper bound for the stage.
+    '''
+
+    # Settings are kept in the environment so that pool workers see them too.
+    _records_dir_var = "GCBMANIMATION_PROFILE_DIR"
+    _cprofile_dir_var = "GCBMANIMATION_CPROFILE_DIR"
+    _cprofile_active = False
+
+    def __init__(self):
+        raise RuntimeError("Not instantiable")
+
+    @staticmethod
+    def enable(records_dir, cprofile_dir=None):
+        '''
+        Turns on profiling for the run.
+
+        Arguments:
+        'records_dir' -- directory to write the per-process stage records to.
+        'cprofile_dir' -- optional directory to write a cProfile dump for each
+            stage to, for stages that aren't nested inside another.
+        '''
+        for var, path in ((Profiler._records_dir_var, records_dir),
+                          (Profiler._cprofile_dir_var, cprofile_dir)):
+            if path:
+                os.makedirs(path, exist_ok=True)
+                os.environ[var] = path
+            else:
+                os.environ.pop(var, None)
+
+    @staticmethod
+    def is_enabled():
+        '''Checks if profiling is turned on for the run.'''
+        return bool(os.environ.get(Profiler._records_dir_var))
+
+    @staticmethod
+    @contextmanager
+    def stage(name, year=None):
+        '''
+        Records a stage of the run: use as a context manager around the work, i.e.
+        with Profiler.stage("crop", layer.year): ...
+
+        Arguments:
+        'name' -- the name of the stage.
+        'year' -- optional year that the work is for.
+        '''
+        records_dir = os.environ.get(Profiler._records_dir_var)
+        if not records_dir:
+            yield
+            return
+
+        cprofile_dir = os.environ.get(Profiler._cprofile_dir_var)
+        profile = None
+        if cprofile_dir and not Profiler._cprofile_active:
+            profile = cProfile.Profile()
+            Profiler._cprofile_active = True
+            profile.enable()
+
+        process = psutil.Process()
+        start_io = Profiler._get_io(process)
+        start_cpu = Profiler._get_cpu_time()
+        start_time = time.time()
+        start_wall = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = Profiler._get_cpu_time() - start_cpu
+            end_io = Profiler._get_io(process)
+            if profile:
+                profile.disable()
+                Profiler._cprofile_active = False
+                profile.dump_stats(os.path.join(
+                    cprofile_dir, f"{name}-{year or 'all'}-{os.getpid()}-{int(start_time * 1e6)}.prof"))
+
+            record = {
+                "stage": name,
+                "year": year,
+                "pid": os.getpid(),
+                "tid": Profiler._get_thread_id(),
+                "start": start_time,
+                "end": start_time + wall,
+                "wall": wall,
+                "cpu": cpu,
+                "read_bytes": end_io[0] - start_io[0],
+                "write_bytes": end_io[1] - start_io[1],
+                "process_peak_rss": Profiler._get_process_peak_rss(process)
+            }
+
+            with open(os.path.join(records_dir, f"{os.getpid()}.jsonl"), "a") as records:
+                records.write(json.dumps(record) + "\n")
+
+    @staticmethod
+    def load_records():
+        '''Gets all of the stage records written by every process in the run.'''
+        records_dir = os.environ.get(Profiler._records_dir_var)
+        if not records_dir:
+            return []
+
+        records = []
+        for records_path in glob(os.path.join(records_dir, "*.jsonl")):
+            with open(records_path, "r") as records_file:
+                records.extend(json.loads(line) for line in records_file if line.strip())
+
+        return sorted(records, key=lambda record: record["start"])
+
+    @staticmethod
+    def report(output_path):
+        '''
+        Writes a summary of the run's stages: totals per stage, and per stage and
+        year for stages that apply to a single year. Stages nested inside others
+        are included in both, so totals across stages overlap.
+
+        Arguments:
+        'output_path' -- path to the report; written as CSV if the file name ends
+            in .csv, otherwise JSON.
+        '''
+        summary = defaultdict(lambda: {
+            "count": 0, "wall": 0.0, "cpu": 0.0, "read_bytes": 0, "write_bytes": 0, "process_peak_rss": 0})
+
+        for record in Profiler.load_records():
+            keys = [(record["stage"], None)]
+            if record["year"] is not None:
+                keys.append((record["stage"], record["year"]))
+
+            for key in keys:
+                totals = summary[key]
+                totals["count"] += 1
+                for measure in ("wall", "cpu", "read_bytes", "write_bytes"):
+                    totals[measure] += record[measure]
+
+                totals["process_peak_rss"] = max(totals["process_peak_rss"], record["process_peak_rss"])
+
+        rows = [{"stage": stage, "year": year, **totals}
+                for (stage, year), totals in sorted(summary.items(), key=lambda item: (item[0][0], item[0][1] or 0))]
+
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        if output_path.lower().endswith(".csv"):
+            with open(output_path, "w", newline="") as report:
+                writer = csv.DictWriter(report, fieldnames=[
+                    "stage", "year", "count", "wall", "cpu", "read_bytes", "write_bytes", "process_peak_rss"])
+                writer.writeheader()
+                writer.writerows(rows)
+        else:
+            json.dump(rows, open(output_path, "w"), indent=4)
+
+    @staticmethod
+    def write_trace(output_path):
+        '''
+        Writes the run's stages as a trace in Chrome trace-event format, which can
+        be opened in Perfetto (ui.perfetto.dev) or chrome://tracing to see how the
+        work was spread over the pool workers: one track per process, with each
+        stage as a span labelled with its year.
+
+        Arguments:
+        'output_path' -- path to the trace file (.json).
+        '''
+        records = Profiler.load_records()
+        run_start = records[0]["start"] if records else 0
+        main_pid = os.getpid()
+
+        events = []
+        for pid in sorted({record["pid"] for record in records}):
+            events.append({
+                "name": "process_name", "ph": "M", "pid": pid,
+                "args": {"name": "main" if pid == main_pid else f"worker {pid}"}
+            })
+
+            events.append({
+                "name": "process_sort_index", "ph": "M", "pid": pid,
+                "args": {"sort_index": 0 if pid == main_pid else pid}
+            })
+
+        for record in records:
+            events.append({
+                "name": record["stage"] if record["year"] is None else f"{record['stage']} {record['year']}",
+                "cat": record["stage"],
+                "ph": "X",
+                "ts": (record["start"] - run_start) * 1e6,
+                "dur": record["wall"] * 1e6,
+                "pid": record["pid"],
+                "tid": record.get("tid", record["pid"]),
+                "args": {
+                    measure: record[measure] for measure in (
+                        "year", "cpu", "read_bytes", "write_bytes", "process_peak_rss")
+                }
+            })
+
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, open(output_path, "w"))
+
+    @staticmethod
+    def _get_cpu_time():
+        cpu_times = os.times()
+
+        return cpu_times.user + cpu_times.system + cpu_times.children_user + cpu_times.children_system
+
+    @staticmethod
+    def _get_io(process):
+        try:
+            io = process.io_counters()
+        except (psutil.Error, AttributeError):
+            return 0, 0
+
+        # Characters read and written include I/O served from the page cache, which
+        # is most of it for short-lived intermediate files.
+        return getattr(io, "read_chars", io.read_bytes), getattr(io, "write_chars", io.write_bytes)
+
+    @staticmethod
+    def _get_thread_id():
+        # Native thread IDs match the ones shown by system tools, but need Python 3.8.
+        get_thread_id = getattr(threading, "get_native_id", threading.get_ident)
+
+        return get_thread_id()
+
+    @staticmethod
+    def _get_process_peak_rss(process):
+        if resource:
+            # Linux reports kilobytes, macOS bytes.
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak_rss if psutil.MACOS else peak_rss * 1024
+
+        return getattr(process.memory_info(), "peak_wset", process.memory_info().rss)
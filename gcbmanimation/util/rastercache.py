@@ -0,0 +1,120 @@
+import os
+import shutil
+import logging
+import gdal
+from gcbmanimation.util.config import IOProfile
+from gcbmanimation.util.tempfile import TempFileManager
+
+class RasterCache:
+    '''
+    Persistent on-disk store of processed rasters, so that re-animating the same
+    GCBM run - i.e. after changing only the colors or titles - doesn't need to
+    crop, convert and reclassify every layer again. Rasters are keyed by the
+    identity of the operation that produced them, which is derived from their
+    input files' paths, sizes and modification times, the bounding box, and
+    the operation's parameters. When the cache grows past its size limit, the
+    least recently used rasters are deleted. Files that aren't rasters, i.e.
+    sparse layers, are cached as they are.
+
+    Arguments:
+    'path' -- the directory to store the cached rasters in.
+    'max_bytes' -- the maximum total size of the cache.
+    '''
+
+    # Bump this when a change to an operation makes previously cached output wrong.
+    _version = 2
+
+    # Rasters are cached as compressed GeoTIFFs; other files keep their own type.
+    _extensions = (".tif", ".npz")
+
+    def __init__(self, path, max_bytes):
+        self._path = os.path.join(path, f"v{RasterCache._version}")
+        self._max_bytes = max_bytes
+
+    def get(self, key):
+        '''
+        Gets a copy of a cached raster in the temp directory - which is unaffected
+        by the cache being trimmed by another run - or None if the key is not in
+        the cache.
+        '''
+        cached_path = next(filter(os.path.exists, (
+            self._get_cached_path(key, extension) for extension in RasterCache._extensions)), None)
+
+        if not cached_path:
+            return None
+
+        temp_path = TempFileManager.mktmp(suffix=os.path.splitext(cached_path)[1])
+        os.remove(temp_path)
+        try:
+            try:
+                os.link(cached_path, temp_path)
+            except OSError:
+                shutil.copyfile(cached_path, temp_path)
+        except OSError:
+            return None
+
+        # Mark as recently used.
+        try:
+            os.utime(cached_path)
+        except OSError:
+            pass
+
+        return temp_path
+
+    def put(self, key, path, profile=IOProfile.Compressed):
+        '''
+        Adds a raster to the cache, compressed, then trims the cache down to its
+        size limit.
+
+        Arguments:
+        'key' -- the identity of the raster.
+        'path' -- the raster to add.
+        'profile' -- the IOProfile to store the raster with; rasters that need a
+            particular layout, i.e. a band-interleaved LayerCube, should keep it.
+        '''
+        is_raster = gdal.IdentifyDriver(path) is not None
+        extension = ".tif" if is_raster else os.path.splitext(path)[1]
+        if extension not in RasterCache._extensions:
+            return
+
+        cached_path = self._get_cached_path(key, extension)
+        tmp_cached_path = f"{cached_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self._path, exist_ok=True)
+            if is_raster:
+                gdal.Translate(tmp_cached_path, path, format="GTiff", creationOptions=profile.creation_options)
+            else:
+                shutil.copyfile(path, tmp_cached_path)
+
+            os.replace(tmp_cached_path, cached_path)
+            self._trim()
+        except OSError as e:
+            logging.warning(f"Unable to add {path} to raster cache {self._path}: {e}")
+
+    def _get_cached_path(self, key, extension=".tif"):
+        return os.path.join(self._path, f"{key}{extension}")
+
+    def _trim(self):
+        cached_files = []
+        with os.scandir(self._path) as entries:
+            for entry in entries:
+                if not entry.name.endswith(RasterCache._extensions):
+                    continue
+
+                try:
+                    file_stat = entry.stat()
+                    cached_files.append((file_stat.st_mtime, file_stat.st_size, entry.path))
+                except OSError:
+                    pass # Deleted by another run.
+
+        cache_size = sum(size for _, size, _ in cached_files)
+        for _, size, path in sorted(cached_files):
+            if cache_size <= self._max_bytes:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+            cache_size -= size
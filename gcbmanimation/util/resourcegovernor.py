@@ -0,0 +1,254 @@
+import os
+import gdal
+import psutil
+from contextlib import contextmanager
+from contextlib import nullcontext
+from multiprocessing import Pool
+from multiprocessing import cpu_count
+
+class ResourceGovernor:
+    '''
+    Splits the CPU threads and memory available to a run between pool worker
+    processes and the threading inside each worker (GDAL compression and warping,
+    NumPy/BLAS), so that a pool of N workers doesn't start N * CPUs threads or give
+    every worker a GDAL cache sized for the whole machine. Limits come from, in
+    order of preference, ResourceGovernor.set_limits, cgroup quotas, and the
+    hardware, and are evaluated when each pool is created rather than at import.
+    '''
+
+    # Limits are kept in the environment so that pool workers see them too.
+    _max_workers_var = "GCBMANIMATION_MAX_WORKERS"
+    _max_threads_var = "GCBMANIMATION_MAX_THREADS"
+    _max_memory_var = "GCBMANIMATION_MAX_MEMORY"
+    _gdal_cache_var = "GCBMANIMATION_GDAL_CACHE"
+    _worker_threads_var = "GCBMANIMATION_WORKER_THREADS"
+    _min_tile_pixels_var = "GCBMANIMATION_MIN_TILE_PIXELS"
+
+    # Rough working memory needed per raster pixel by a task: the GDAL block
+    # cache plus a few full-size NumPy arrays.
+    bytes_per_pixel = 32
+    memory_fraction = 0.75
+
+    _thread_env_vars = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+    _shared_pool = None
+
+    def __init__(self):
+        raise RuntimeError("Not instantiable")
+
+    @staticmethod
+    def set_limits(max_workers=None, max_threads=None, max_memory=None):
+        '''
+        Sets explicit resource limits for the run, overriding the detected ones.
+
+        Arguments:
+        'max_workers' -- maximum number of pool worker processes.
+        'max_threads' -- maximum number of CPU threads to use in total.
+        'max_memory' -- maximum memory to use in total, in bytes.
+        '''
+        for var, value in ((ResourceGovernor._max_workers_var, max_workers),
+                           (ResourceGovernor._max_threads_var, max_threads),
+                           (ResourceGovernor._max_memory_var, max_memory)):
+            if value:
+                os.environ[var] = str(int(value))
+            else:
+                os.environ.pop(var, None)
+
+    @staticmethod
+    def set_tiling(min_tile_pixels=None):
+        '''
+        Turns on spatial tiling for the run: when there are fewer rasters to
+        process than pool workers, i.e. a single huge layer or a run with few
+        years, each raster is split into tiles that are processed in parallel.
+
+        Arguments:
+        'min_tile_pixels' -- the smallest tile worth splitting a raster into, in
+            pixels; None turns tiling off.
+        '''
+        if min_tile_pixels:
+            os.environ[ResourceGovernor._min_tile_pixels_var] = str(int(min_tile_pixels))
+        else:
+            os.environ.pop(ResourceGovernor._min_tile_pixels_var, None)
+
+    @staticmethod
+    def tile_count(raster_pixels, tasks):
+        '''
+        Gets the number of tiles to split each raster into so that there are
+        enough tasks to keep every pool worker busy: 1 unless tiling is turned on
+        with ResourceGovernor.set_tiling, there are fewer tasks than workers, and
+        the rasters are big enough to split.
+
+        Arguments:
+        'raster_pixels' -- the number of pixels in each raster.
+        'tasks' -- the number of rasters to process.
+        '''
+        min_tile_pixels = int(os.environ.get(ResourceGovernor._min_tile_pixels_var, 0))
+        if not min_tile_pixels or not raster_pixels or not tasks:
+            return 1
+
+        # Tiles use less memory than whole rasters, so only the CPUs limit the
+        # number of workers that can share them.
+        workers = ResourceGovernor.worker_count()
+        if tasks >= workers:
+            return 1
+
+        return max(1, min(-(-workers // tasks), raster_pixels // min_tile_pixels))
+
+    @staticmethod
+    def cpu_limit():
+        '''Gets the number of CPU threads available to the run.'''
+        explicit_limit = int(os.environ.get(ResourceGovernor._max_threads_var, 0))
+        if explicit_limit:
+            return explicit_limit
+
+        cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else cpu_count()
+        cgroup_cpus = ResourceGovernor._read_cgroup_cpu_limit()
+
+        return max(1, min(cpus, cgroup_cpus or cpus))
+
+    @staticmethod
+    def memory_limit():
+        '''Gets the memory available to the run, in bytes.'''
+        available = psutil.virtual_memory().available
+        explicit_limit = int(os.environ.get(ResourceGovernor._max_memory_var, 0))
+        cgroup_limit = ResourceGovernor._read_cgroup_memory_limit()
+
+        return min(limit for limit in (available, explicit_limit, cgroup_limit) if limit)
+
+    @staticmethod
+    def worker_threads():
+        '''
+        Gets the number of CPU threads this process can use: its share of the
+        total in a pool worker, or all of them in the main process.
+        '''
+        return int(os.environ.get(ResourceGovernor._worker_threads_var, 0)) or ResourceGovernor.cpu_limit()
+
+    @staticmethod
+    def worker_count(raster_pixels=None):
+        '''
+        Gets the number of pool workers to use: one per available CPU thread, or
+        fewer if the rasters being processed are too big for that many workers to
+        fit in memory at once.
+
+        Arguments:
+        'raster_pixels' -- optional number of pixels in each raster a task works on.
+        '''
+        workers = ResourceGovernor.cpu_limit()
+        explicit_limit = int(os.environ.get(ResourceGovernor._max_workers_var, 0))
+        if explicit_limit:
+            workers = min(workers, explicit_limit)
+
+        if raster_pixels:
+            task_memory = raster_pixels * ResourceGovernor.bytes_per_pixel
+            memory = ResourceGovernor.memory_limit() * ResourceGovernor.memory_fraction
+            workers = min(workers, int(memory // task_memory))
+
+        return max(1, workers)
+
+    @staticmethod
+    def pool(raster_pixels=None):
+        '''
+        Creates a process pool sized for the available resources, where each worker
+        gets an even share of the CPU threads and GDAL cache.
+
+        Arguments:
+        'raster_pixels' -- optional number of pixels in each raster the pool's tasks
+            work on, used to limit the number of workers.
+
+        Returns the pool, or the shared pool if one is open - see
+        ResourceGovernor.shared_pool.
+        '''
+        if ResourceGovernor._shared_pool:
+            return nullcontext(ResourceGovernor._shared_pool)
+
+        return ResourceGovernor._create_pool(raster_pixels)
+
+    @staticmethod
+    @contextmanager
+    def shared_pool(raster_pixels=None):
+        '''
+        Opens a single process pool for every ResourceGovernor.pool call made until
+        it's closed, i.e. to process many runs without starting and stopping a pool
+        for each step of each run: use as a context manager around the work.
+
+        Arguments:
+        'raster_pixels' -- optional number of pixels in the largest raster the
+            pool's tasks work on, used to limit the number of workers.
+        '''
+        if ResourceGovernor._shared_pool:
+            yield ResourceGovernor._shared_pool
+            return
+
+        with ResourceGovernor._create_pool(raster_pixels) as pool:
+            ResourceGovernor._shared_pool = pool
+            try:
+                yield pool
+            finally:
+                ResourceGovernor._shared_pool = None
+
+    @staticmethod
+    def apply_gdal_limits():
+        '''
+        Applies this process's share of the GDAL cache; in the main process, where
+        there is no pool, that is the whole memory allowance.
+        '''
+        gdal_cache = int(os.environ.get(ResourceGovernor._gdal_cache_var, 0)) \
+            or int(ResourceGovernor.memory_limit() * ResourceGovernor.memory_fraction)
+
+        gdal.SetCacheMax(gdal_cache)
+
+    @staticmethod
+    def _create_pool(raster_pixels=None):
+        workers = ResourceGovernor.worker_count(raster_pixels)
+        threads_per_worker = max(1, ResourceGovernor.cpu_limit() // workers)
+        gdal_cache = int(ResourceGovernor.memory_limit() * ResourceGovernor.memory_fraction / workers)
+
+        return Pool(workers, ResourceGovernor._init_worker, (threads_per_worker, gdal_cache))
+
+    @staticmethod
+    def _init_worker(threads, gdal_cache):
+        os.environ[ResourceGovernor._gdal_cache_var] = str(gdal_cache)
+        os.environ[ResourceGovernor._worker_threads_var] = str(threads)
+        gdal.SetCacheMax(gdal_cache)
+        gdal.SetConfigOption("GDAL_NUM_THREADS", str(threads))
+        for var in ResourceGovernor._thread_env_vars:
+            os.environ[var] = str(threads)
+
+        # BLAS may already have started its thread pool before the worker was
+        # forked; threadpoolctl can resize it if it's installed.
+        try:
+            from threadpoolctl import threadpool_limits
+            threadpool_limits(threads)
+        except ImportError:
+            pass
+
+    @staticmethod
+    def _read_cgroup_cpu_limit():
+        try:
+            # cgroup v2: "<quota> <period>" or "max <period>"
+            quota, period = open("/sys/fs/cgroup/cpu.max").read().split()
+            if quota != "max":
+                return max(1, int(int(quota) / int(period)))
+        except (OSError, ValueError):
+            pass
+
+        try:
+            quota = int(open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us").read())
+            period = int(open("/sys/fs/cgroup/cpu/cpu.cfs_period_us").read())
+            if quota > 0:
+                return max(1, quota // period)
+        except (OSError, ValueError):
+            pass
+
+        return None
+
+    @staticmethod
+    def _read_cgroup_memory_limit():
+        for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+            try:
+                limit = open(path).read().strip()
+                if limit != "max" and int(limit) < psutil.virtual_memory().total:
+                    return int(limit)
+            except (OSError, ValueError):
+                pass
+
+        return None
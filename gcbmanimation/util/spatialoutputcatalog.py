@@ -0,0 +1,217 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import gdal
+from glob import glob
+from fnmatch import fnmatch
+from tempfile import NamedTemporaryFile
+from gcbmanimation.util.config import cache_dir
+
+class SpatialOutputCatalog:
+    '''
+    Index of the files in a GCBM spatial output directory, built from a single
+    directory scan and shared by every lookup in the run, rather than globbing the
+    directory separately for every indicator, graph and composite component. Each
+    file is recorded with its indicator name and year (parsed from the file name,
+    i.e. NPP_2010.tiff), size, modification time, and for rasters, basic GDAL
+    metadata. The index is kept in the gcbmanimation cache directory - or, if
+    turned on with SpatialOutputCatalog.set_sidecar, in a sidecar file in the
+    output directory itself so that it travels with the output - so that later
+    runs only need to read the metadata of new or changed files. A catalog is
+    rescanned whenever its directory has changed, i.e. files have been added.
+
+    Arguments:
+    'path' -- the spatial output directory.
+    '''
+
+    sidecar_name = ".gcbmanimation_catalog.json"
+    _raster_extensions = (".tif", ".tiff")
+    _catalogs = {}
+
+    # Settings are kept in the environment so that pool workers see them too.
+    _sidecar_var = "GCBMANIMATION_CATALOG_SIDECAR"
+
+    def __init__(self, path):
+        self._path = os.path.abspath(path)
+        self._entries = None
+        self._dir_mtime = None
+
+    @staticmethod
+    def set_sidecar(enabled=True):
+        '''
+        Turns on writing each catalog's index to a sidecar file in the spatial
+        output directory instead of the gcbmanimation cache directory; this is
+        off by default.
+
+        Arguments:
+        'enabled' -- whether or not to write sidecar files.
+        '''
+        if enabled:
+            os.environ[SpatialOutputCatalog._sidecar_var] = "1"
+        else:
+            os.environ.pop(SpatialOutputCatalog._sidecar_var, None)
+
+    @staticmethod
+    def find(pattern):
+        '''
+        Finds the files matching a glob pattern, using the catalog for the pattern's
+        directory. Patterns with wildcards in the directory part are globbed as-is.
+
+        Arguments:
+        'pattern' -- the file pattern (including directory path) in glob format,
+            i.e. "c:\\my_run\\NPP_*.tif".
+
+        Returns a list of (path, year) tuples, where year is None if the file name
+        doesn't end with one.
+        '''
+        directory, file_pattern = os.path.split(os.path.abspath(pattern))
+        if any(c in directory for c in "*?["):
+            return [(path, SpatialOutputCatalog._parse_name(path)[1]) for path in sorted(glob(pattern))]
+
+        catalog = SpatialOutputCatalog._catalogs.get(directory)
+        if not catalog:
+            catalog = SpatialOutputCatalog._catalogs[directory] = SpatialOutputCatalog(directory)
+
+        return [(os.path.join(directory, name), entry["year"])
+                for name, entry in sorted(catalog.entries.items())
+                if fnmatch(name, file_pattern)]
+
+    @staticmethod
+    def get_raster_info(path):
+        '''
+        Gets the catalogued raster metadata for a file without opening it: a
+        dictionary of width, height, bands, data_type, nodata and geotransform, or
+        None if the file isn't a raster.
+
+        Arguments:
+        'path' -- path to the file.
+        '''
+        directory, name = os.path.split(os.path.abspath(path))
+        catalog = SpatialOutputCatalog._catalogs.get(directory)
+        if not catalog:
+            catalog = SpatialOutputCatalog._catalogs[directory] = SpatialOutputCatalog(directory)
+
+        entry = catalog.entries.get(name)
+
+        return entry["raster"] if entry else None
+
+    @property
+    def entries(self):
+        '''
+        Gets the catalog entries: a dictionary of file name to a dictionary of
+        indicator, year, size, mtime, and for rasters, raster metadata.
+        '''
+        if self._entries is None or self._get_dir_mtime() != self._dir_mtime:
+            self.refresh()
+
+        return self._entries
+
+    def refresh(self):
+        '''
+        Rescans the directory, reading the metadata of any files that are new or
+        have changed since they were indexed, and saves the updated index.
+        '''
+        self._dir_mtime = self._get_dir_mtime()
+        indexed_entries = self._load()
+        entries = {}
+        updated = False
+        with os.scandir(self._path) as dir_entries:
+            for dir_entry in dir_entries:
+                if dir_entry.name == self.sidecar_name or not dir_entry.is_file():
+                    continue
+
+                file_stat = dir_entry.stat()
+                entry = indexed_entries.get(dir_entry.name)
+                if not entry or entry["size"] != file_stat.st_size or entry["mtime"] != file_stat.st_mtime_ns:
+                    entry = self._index(dir_entry.path, file_stat)
+                    updated = True
+
+                entries[dir_entry.name] = entry
+
+        self._entries = entries
+        if updated or len(entries) != len(indexed_entries):
+            self._save()
+
+            # Writing a sidecar changes the directory too.
+            if os.environ.get(self._sidecar_var):
+                self._dir_mtime = self._get_dir_mtime()
+
+    def _index(self, path, file_stat):
+        indicator, year = self._parse_name(path)
+        entry = {
+            "indicator": indicator,
+            "year": year,
+            "size": file_stat.st_size,
+            "mtime": file_stat.st_mtime_ns,
+            "raster": None
+        }
+
+        if os.path.splitext(path)[1].lower() in self._raster_extensions:
+            raster = gdal.Open(path)
+            if raster:
+                band = raster.GetRasterBand(1)
+                entry["raster"] = {
+                    "width": raster.RasterXSize,
+                    "height": raster.RasterYSize,
+                    "bands": raster.RasterCount,
+                    "data_type": gdal.GetDataTypeName(band.DataType),
+                    "nodata": band.GetNoDataValue(),
+                    "geotransform": list(raster.GetGeoTransform())
+                }
+
+        return entry
+
+    @staticmethod
+    def _parse_name(path):
+        stem = os.path.splitext(os.path.basename(path))[0]
+        match = re.match(r"^(.*?)[_-]?(\d{4})$", stem)
+        if not match:
+            return stem, None
+
+        return match.group(1), int(match.group(2))
+
+    def _get_dir_mtime(self):
+        try:
+            return os.stat(self._path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _get_index_paths(self):
+        # Gets the paths to write the index to, in order of preference.
+        cache_path = os.path.join(
+            cache_dir, "catalogs", f"{hashlib.sha1(self._path.encode('utf-8')).hexdigest()}.json")
+
+        if not os.environ.get(self._sidecar_var):
+            return [cache_path]
+
+        return [os.path.join(self._path, self.sidecar_name), cache_path]
+
+    def _load(self):
+        # An existing sidecar is read even if sidecars aren't being written.
+        sidecar_path = os.path.join(self._path, self.sidecar_name)
+        for index_path in dict.fromkeys([*self._get_index_paths(), sidecar_path]):
+            if not os.path.exists(index_path):
+                continue
+
+            try:
+                return json.load(open(index_path, "r"))
+            except (OSError, ValueError):
+                logging.warning(f"Ignoring unreadable spatial output catalog: {index_path}")
+
+        return {}
+
+    def _save(self):
+        for index_path in self._get_index_paths():
+            try:
+                os.makedirs(os.path.dirname(index_path), exist_ok=True)
+                with NamedTemporaryFile("w", dir=os.path.dirname(index_path), delete=False) as tmp_file:
+                    json.dump(self._entries, tmp_file)
+
+                os.replace(tmp_file.name, index_path)
+                return
+            except OSError:
+                pass
+
+        logging.warning(f"Unable to save spatial output catalog for {self._path}")
@@ -1,10 +1,20 @@
 import os
+import gc
+import time
+import uuid
+import logging
 import weakref
 import shutil
 import warnings
+import gdal
+from enum import Enum
+from collections import Counter
+from multiprocessing import current_process
 from tempfile import NamedTemporaryFile
 from tempfile import gettempdir
 from glob import glob
+from fnmatch import fnmatch
+from itertools import chain
 
 class NamedTemporaryDirectory:
 
@@ -24,18 +34,85 @@ class NamedTemporaryDirectory:
         return "<{} {!r}>".format(self.__class__.__name__, self.name)
 
 
+class StorageBackend(Enum):
+
+    Disk    = "disk"    # The system temp directory.
+    RamDisk = "ramdisk" # A tmpfs directory, shared between processes.
+    Memory  = "memory"  # GDAL's in-process /vsimem/ filesystem.
+
+
 class TempFileManager:
-    
+
     _temp_dir = None
+    _ramdisk_temp_dir = None
     _name = os.path.join(gettempdir(), "gcbmanimation_temp")
+    _memory_name = "/vsimem/gcbmanimation_temp"
     _no_cleanup = []
+    _refcounts = Counter()
+    _memory_files = {}
+
+    # Settings are kept in the environment so that pool workers see them too.
+    _disk_quota_var = "GCBMANIMATION_TEMP_QUOTA"
+    _memory_budget_var = "GCBMANIMATION_MEMORY_BUDGET"
+    _ramdisk_var = "GCBMANIMATION_RAMDISK"
+    _backend_var = "GCBMANIMATION_STORAGE_BACKEND"
+    _run_id_var = "GCBMANIMATION_RUN_ID"
+    _pinned_dir_name = "pinned"
+    default_ramdisk = "/dev/shm"
+    disk_quota_timeout = 600
+    disk_quota_poll_interval = 0.5
 
     def __init__(self):
         raise RuntimeError("Not instantiable")
 
     @staticmethod
     def delete_on_exit():
+        # The RAM disk directory is only created if it's going to be used, so
+        # call this after TempFileManager.set_storage.
         TempFileManager._temp_dir = NamedTemporaryDirectory(TempFileManager._name)
+        ramdisk_name = TempFileManager._get_ramdisk_name()
+        if ramdisk_name and TempFileManager._uses_ramdisk():
+            TempFileManager._ramdisk_temp_dir = NamedTemporaryDirectory(ramdisk_name)
+
+    @staticmethod
+    def set_storage(memory_budget=None, ramdisk_path=None, backend=None):
+        '''
+        Configures where temporary files are stored. Given a memory budget, each
+        new temporary file goes to memory - GDAL's /vsimem/ filesystem for files
+        that never leave the process that creates them, otherwise a RAM disk - as
+        long as the files already there plus the new one fit in the budget, and
+        to the system temp directory otherwise.
+
+        Arguments:
+        'memory_budget' -- the maximum number of bytes of temporary files to keep
+            in memory, or None to keep everything on disk.
+        'ramdisk_path' -- optional tmpfs directory to use as the RAM disk; defaults
+            to /dev/shm if it exists.
+        'backend' -- optional StorageBackend to use for all temporary files instead
+            of choosing automatically.
+        '''
+        for var, value in ((TempFileManager._memory_budget_var, memory_budget and int(memory_budget)),
+                           (TempFileManager._ramdisk_var, ramdisk_path),
+                           (TempFileManager._backend_var, backend and backend.value)):
+            if value:
+                os.environ[var] = str(value)
+            else:
+                os.environ.pop(var, None)
+
+    @staticmethod
+    def set_disk_quota(max_bytes=None):
+        '''
+        Sets the maximum amount of disk space to use for temporary files. When the
+        quota is reached, pool workers wait for space to be freed up before creating
+        any more temporary files, up to TempFileManager.disk_quota_timeout seconds.
+
+        Arguments:
+        'max_bytes' -- the quota in bytes, or None to remove the quota.
+        '''
+        if max_bytes:
+            os.environ[TempFileManager._disk_quota_var] = str(int(max_bytes))
+        else:
+            os.environ.pop(TempFileManager._disk_quota_var, None)
 
     @staticmethod
     def cleanup(pattern="*"):
@@ -47,24 +124,237 @@ class TempFileManager:
         Arguments:
         'pattern' -- the file pattern to delete, or all files by default.
         '''
-        for fn in glob(os.path.join(TempFileManager._name, pattern)):
+        temp_dirs = [TempFileManager._name, TempFileManager._get_ramdisk_name()]
+        for fn in chain(*(glob(os.path.join(temp_dir, pattern)) for temp_dir in temp_dirs if temp_dir)):
             if fn not in TempFileManager._no_cleanup:
-                os.remove(fn)
+                TempFileManager.remove(fn)
+
+        for fn in list(TempFileManager._memory_files):
+            if fnmatch(os.path.basename(fn), pattern) and fn not in TempFileManager._no_cleanup:
+                TempFileManager.remove(fn)
+
+    @staticmethod
+    def remove(path):
+        '''
+        Deletes a temporary file immediately, i.e. an intermediate file that is
+        no longer needed.
+
+        Arguments:
+        'path' -- the temporary file to delete.
+        '''
+        if path.startswith(TempFileManager._memory_name):
+            gdal.Unlink(path)
+            TempFileManager._memory_files.pop(path, None)
+            return
+
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def track(owner, path):
+        '''
+        Registers an object as one of the owners of a temporary file. The file is
+        deleted as soon as all of its owners in the main process are garbage
+        collected, rather than waiting for a manual cleanup or interpreter exit.
+        Files are shared with pool workers, so ownership only counts in the main
+        process; files that a worker creates and returns are adopted by the main
+        process's copies of their owners.
+
+        Arguments:
+        'owner' -- the object (i.e. Layer or Frame) that refers to the file.
+        'path' -- the path to the temporary file; paths outside the gcbmanimation
+            temp directory are ignored.
+        '''
+        if not TempFileManager._is_managed(path):
+            return
+
+        TempFileManager._refcounts[path] += 1
+        weakref.finalize(owner, TempFileManager._release, path)
+
+    @staticmethod
+    def get_shared_dir(name):
+        '''
+        Gets a named subdirectory of the gcbmanimation temp directory, creating it
+        if needed, for bookkeeping files shared between the processes in a run.
+        Each run has its own, so that runs on the same machine - or files left
+        behind by a run that crashed - don't see each other's bookkeeping. Its
+        contents are left alone by TempFileManager.cleanup() and deleted when the
+        interpreter exits.
+
+        Arguments:
+        'name' -- the name of the subdirectory.
+        '''
+        shared_dir = os.path.join(TempFileManager._name, f"run_{TempFileManager._get_run_id()}", name)
+        os.makedirs(shared_dir, exist_ok=True)
+
+        return shared_dir
 
     @staticmethod
-    def mktmp(no_manual_cleanup=False, **kwargs):
+    def mktmp(no_manual_cleanup=False, process_local=False, size_hint=0, **kwargs):
         '''
-        Gets a unique temporary file name located in the gcbmanimation temp directory.
-        Accepts any arguments supported by NamedTemporaryFile. Temporary files will be
-        deleted when the interpreter exits.
+        Gets a unique temporary file name located in the gcbmanimation temp directory,
+        or in memory if configured by TempFileManager.set_storage. Accepts any
+        arguments supported by NamedTemporaryFile. Temporary files will be deleted
+        when the interpreter exits.
 
         Arguments:
         'no_manual_cleanup' -- prevents this file from being deleted by calls to
-            TempFileManager.cleanup()
+            TempFileManager.cleanup(), or when the objects that own it are deleted,
+            in any process: files on disk are created in a subdirectory that
+            cleanup() skips. They still count towards the disk quota.
+        'process_local' -- the file will only be read by GDAL in the process that
+            creates it and will be removed with TempFileManager.remove, so it can go
+            in the /vsimem/ filesystem.
+        'size_hint' -- estimated size of the file in bytes, used to decide whether
+            it fits in the memory budget.
         '''
-        os.makedirs(TempFileManager._name, exist_ok=True)
-        temp_file_name = NamedTemporaryFile("w", dir=TempFileManager._name, delete=False, **kwargs).name
+        backend = TempFileManager._choose_backend(process_local, size_hint)
+        if backend == StorageBackend.Memory:
+            temp_file_name = "{}/{}{}{}".format(
+                TempFileManager._memory_name, kwargs.get("prefix", ""),
+                uuid.uuid4().hex, kwargs.get("suffix", ""))
+
+            TempFileManager._memory_files[temp_file_name] = size_hint
+        else:
+            temp_dir = TempFileManager._name if backend == StorageBackend.Disk \
+                else TempFileManager._get_ramdisk_name()
+
+            if backend == StorageBackend.Disk:
+                TempFileManager._wait_for_disk_quota()
+
+            if no_manual_cleanup:
+                temp_dir = os.path.join(temp_dir, TempFileManager._pinned_dir_name)
+
+            os.makedirs(temp_dir, exist_ok=True)
+            temp_file_name = NamedTemporaryFile("w", dir=temp_dir, delete=False, **kwargs).name
+
         if no_manual_cleanup:
             TempFileManager._no_cleanup.append(temp_file_name)
 
         return temp_file_name
+
+    @staticmethod
+    def _get_run_id():
+        # The main process picks the run ID; pool workers inherit it through the
+        # environment (see the end of this module).
+        return os.environ.setdefault(TempFileManager._run_id_var, uuid.uuid4().hex)
+
+    @staticmethod
+    def _get_ramdisk_name():
+        ramdisk_path = os.environ.get(TempFileManager._ramdisk_var, TempFileManager.default_ramdisk)
+        if not os.path.isdir(ramdisk_path):
+            return None
+
+        return os.path.join(ramdisk_path, "gcbmanimation_temp")
+
+    @staticmethod
+    def _uses_ramdisk():
+        forced_backend = os.environ.get(TempFileManager._backend_var)
+        if forced_backend:
+            return StorageBackend(forced_backend) != StorageBackend.Disk
+
+        return bool(os.environ.get(TempFileManager._memory_budget_var))
+
+    @staticmethod
+    def _choose_backend(process_local=False, size_hint=0):
+        forced_backend = os.environ.get(TempFileManager._backend_var)
+        if forced_backend:
+            backend = StorageBackend(forced_backend)
+            if backend == StorageBackend.Memory and not process_local:
+                backend = StorageBackend.RamDisk
+            if backend == StorageBackend.RamDisk and not TempFileManager._get_ramdisk_name():
+                backend = StorageBackend.Disk
+
+            return backend
+
+        memory_budget = int(os.environ.get(TempFileManager._memory_budget_var, 0))
+        if not memory_budget:
+            return StorageBackend.Disk
+
+        ramdisk_name = TempFileManager._get_ramdisk_name()
+        memory_usage = sum(TempFileManager._memory_files.values())
+        if ramdisk_name and os.path.isdir(ramdisk_name):
+            memory_usage += TempFileManager._get_disk_usage(ramdisk_name)
+
+        if memory_usage + size_hint > memory_budget:
+            return StorageBackend.Disk
+
+        return StorageBackend.Memory if process_local \
+            else StorageBackend.RamDisk if ramdisk_name \
+            else StorageBackend.Disk
+
+    @staticmethod
+    def _is_managed(path):
+        if path is None or path in TempFileManager._no_cleanup:
+            return False
+
+        return path.startswith(TempFileManager._memory_name) or TempFileManager._in_temp_dir(path)
+
+    @staticmethod
+    def _in_temp_dir(path):
+        temp_dir = os.path.dirname(os.path.abspath(path))
+        ramdisk_name = TempFileManager._get_ramdisk_name()
+
+        return temp_dir == os.path.abspath(TempFileManager._name) \
+            or (ramdisk_name is not None and temp_dir == os.path.abspath(ramdisk_name))
+
+    @staticmethod
+    def _is_main_process():
+        return current_process().name == "MainProcess"
+
+    @staticmethod
+    def _release(path):
+        TempFileManager._refcounts[path] -= 1
+        if TempFileManager._refcounts[path] > 0:
+            return
+
+        del TempFileManager._refcounts[path]
+        if TempFileManager._is_main_process() and path not in TempFileManager._no_cleanup:
+            TempFileManager.remove(path)
+
+    @staticmethod
+    def _get_disk_usage(temp_dir=None):
+        # Pinned files are kept for the rest of the run, so they count too.
+        temp_dir = temp_dir or TempFileManager._name
+        disk_usage = 0
+        for usage_dir in (temp_dir, os.path.join(temp_dir, TempFileManager._pinned_dir_name)):
+            try:
+                with os.scandir(usage_dir) as temp_files:
+                    for entry in temp_files:
+                        try:
+                            if entry.is_file():
+                                disk_usage += entry.stat().st_size
+                        except OSError:
+                            pass # Deleted by another process.
+            except FileNotFoundError:
+                pass
+
+        return disk_usage
+
+    @staticmethod
+    def _wait_for_disk_quota():
+        disk_quota = int(os.environ.get(TempFileManager._disk_quota_var, 0))
+        if not disk_quota or TempFileManager._get_disk_usage() < disk_quota:
+            return
+
+        # Only the main process frees up space, so it can't usefully wait on itself.
+        if TempFileManager._is_main_process():
+            gc.collect()
+            if TempFileManager._get_disk_usage() >= disk_quota:
+                logging.warning("Temporary file disk quota exceeded")
+
+            return
+
+        deadline = time.monotonic() + TempFileManager.disk_quota_timeout
+        while TempFileManager._get_disk_usage() >= disk_quota:
+            if time.monotonic() > deadline:
+                logging.warning("Timed out waiting for temporary file disk quota - continuing")
+                return
+
+            time.sleep(TempFileManager.disk_quota_poll_interval)
+
+# The run ID has to be in the environment before any pool workers are started.
+if TempFileManager._is_main_process():
+    TempFileManager._get_run_id()
@@ -19,13 +19,14 @@ setup(
     ],
     keywords="moja.global",
     packages=find_packages(exclude=["contrib", "docs", "tests"]),
-    install_requires=["numpy", "matplotlib", "seaborn", "imageio", "imageio-ffmpeg", "pillow", "geopy", "pysal<=1.15.0", "utm"],
+    install_requires=["numpy", "matplotlib", "seaborn", "imageio", "imageio-ffmpeg", "pillow", "geopy", "pysal<=1.15.0", "utm", "psutil"],
     extras_require={},
     package_data={},
     data_files=[],
     entry_points={
         "console_scripts": [
-            "gcbmanimation = gcbmanimation.scripts.animate:cli"
+            "gcbmanimation = gcbmanimation.scripts.animate:cli",
+            "gcbmanimation-batch = gcbmanimation.scripts.batch:cli"
         ]
     },
     python_requires=">=3.7"
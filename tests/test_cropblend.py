@@ -0,0 +1,89 @@
+import os
+import pytest
+
+gdal = pytest.importorskip("gdal")
+np = pytest.importorskip("numpy")
+
+from gcbmanimation.layer.layer import Layer
+from gcbmanimation.layer.layer import BlendMode
+from gcbmanimation.layer.boundingbox import BoundingBox
+from gcbmanimation.util.config import IOProfile
+from gcbmanimation.util.tempfile import TempFileManager
+
+# Crop-blending should give the same pixels as blending the layers and then
+# cropping the result, as composite indicators did before.
+
+sample_dir = os.path.join(os.path.dirname(__file__), "..", "sample_data", "sample_2", "input_layers")
+
+@pytest.fixture(scope="module", autouse=True)
+def temp_dir():
+    TempFileManager.delete_on_exit()
+
+@pytest.fixture(scope="module")
+def bounding_box():
+    return BoundingBox(os.path.join(sample_dir, "bounding_box.tiff"))
+
+def make_float_layer(name, year, fill_nodata=False):
+    # The sample layers are bytes, which can't hold the result of a subtraction;
+    # components after the first optionally have their nodata pixels filled with
+    # 0 so that the blend has more than the first layer's gaps in it.
+    raster = gdal.Open(os.path.join(sample_dir, name))
+    band = raster.GetRasterBand(1)
+    data = band.ReadAsArray().astype(np.float32)
+    nodata_value = band.GetNoDataValue()
+    if fill_nodata:
+        data[data == nodata_value] = 0
+        nodata_value = -1
+
+    output_path = TempFileManager.mktmp(suffix=".tif")
+    output_raster = gdal.GetDriverByName("GTiff").Create(
+        output_path, raster.RasterXSize, raster.RasterYSize, 1, gdal.GDT_Float32,
+        IOProfile.Scratch.creation_options)
+
+    output_raster.SetGeoTransform(raster.GetGeoTransform())
+    output_raster.SetProjection(raster.GetProjection())
+    output_band = output_raster.GetRasterBand(1)
+    output_band.SetNoDataValue(nodata_value)
+    output_band.WriteArray(data)
+    output_raster = None
+
+    return Layer(output_path, year)
+
+@pytest.fixture(scope="module")
+def components():
+    return [
+        make_float_layer("mpb1990_moja.tiff", 1990),
+        make_float_layer("fire_1994_moja.tiff", 1990, fill_nodata=True),
+        make_float_layer("mpb1991_moja.tiff", 1990, fill_nodata=True)
+    ]
+
+def read_pixels(layer):
+    band = gdal.Open(layer.path).GetRasterBand(1)
+    data = band.ReadAsArray()
+
+    return data, data != band.GetNoDataValue()
+
+def blend_then_crop(bounding_box, *layers):
+    placeholder = layers[0].flatten(0, True)
+
+    return bounding_box.crop(placeholder.blend(*layers))
+
+@pytest.mark.parametrize("blend_modes", [
+    (BlendMode.Add,),
+    (BlendMode.Add, BlendMode.Add),
+    (BlendMode.Add, BlendMode.Subtract, BlendMode.Subtract)
+])
+def test_crop_blend(bounding_box, components, blend_modes):
+    blend_args = []
+    for layer, blend_mode in zip(components, blend_modes):
+        blend_args.extend([layer, blend_mode])
+
+    expected_data, expected_mask = read_pixels(blend_then_crop(bounding_box, *blend_args))
+    actual_data, actual_mask = read_pixels(bounding_box.crop_blend(*blend_args))
+    assert expected_data.shape == actual_data.shape
+
+    # Pixels outside the bounding box are nodata either way; inside it, a pixel
+    # where any of the layers is nodata is 0.
+    assert not np.any(expected_mask & ~actual_mask)
+    np.testing.assert_array_equal(expected_data[expected_mask], actual_data[expected_mask])
+    assert np.any(actual_data[actual_mask] != 0)
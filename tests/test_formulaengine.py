@@ -0,0 +1,98 @@
+import os
+import pytest
+
+gdal = pytest.importorskip("gdal")
+np = pytest.importorskip("numpy")
+pytest.importorskip("geopy")
+
+from gcbmanimation.layer.layer import Layer
+from gcbmanimation.layer.formulaengine import FormulaEngine
+from gcbmanimation.util.config import IOProfile
+from gcbmanimation.util.operationmemo import OperationMemo
+from gcbmanimation.util.tempfile import TempFileManager
+
+# Formula results should mask nodata inputs and non-finite results, with and
+# without numexpr.
+
+sample_dir = os.path.join(os.path.dirname(__file__), "..", "sample_data", "sample_2", "input_layers")
+input_nodata_value = -9999
+
+@pytest.fixture(scope="module", autouse=True)
+def temp_dir():
+    TempFileManager.delete_on_exit()
+
+@pytest.fixture(scope="module")
+def reference_raster():
+    return gdal.Open(os.path.join(sample_dir, "bounding_box.tiff"))
+
+def make_layer(reference_raster, data):
+    output_path = TempFileManager.mktmp(suffix=".tif")
+    output_raster = gdal.GetDriverByName("GTiff").Create(
+        output_path, reference_raster.RasterXSize, reference_raster.RasterYSize, 1, gdal.GDT_Float32,
+        IOProfile.Scratch.creation_options)
+
+    output_raster.SetGeoTransform(reference_raster.GetGeoTransform())
+    output_raster.SetProjection(reference_raster.GetProjection())
+    band = output_raster.GetRasterBand(1)
+    band.SetNoDataValue(input_nodata_value)
+    band.WriteArray(data)
+    output_raster = None
+
+    return Layer(output_path, 2000)
+
+@pytest.fixture(scope="module")
+def input_data(reference_raster):
+    shape = (reference_raster.RasterYSize, reference_raster.RasterXSize)
+    a_data = np.arange(shape[0] * shape[1], dtype=np.float32).reshape(shape) % 7 - 3
+    a_data[::5] = input_nodata_value
+    b_data = np.arange(shape[0] * shape[1], dtype=np.float32).reshape(shape) % 3
+    b_data[:, ::4] = input_nodata_value
+
+    return a_data, b_data
+
+@pytest.fixture(scope="module")
+def input_layers(reference_raster, input_data):
+    return {name: make_layer(reference_raster, data) for name, data in zip(("A", "B"), input_data)}
+
+@pytest.fixture(params=["numexpr", "numpy"])
+def formula_module(request, monkeypatch):
+    if request.param == "numexpr":
+        pytest.importorskip("numexpr")
+    else:
+        monkeypatch.setattr("gcbmanimation.layer.formulaengine.numexpr", None)
+
+    # Otherwise the second evaluation of a formula reuses the first one's output.
+    OperationMemo.set_enabled(False)
+    yield
+    OperationMemo.set_enabled(True)
+
+def read_pixels(layer):
+    band = gdal.Open(layer.path).GetRasterBand(1)
+    data = band.ReadAsArray()
+
+    return data, data != band.GetNoDataValue()
+
+def test_divide(input_layers, input_data, formula_module):
+    a_data, b_data = input_data
+    result_data, result_mask = read_pixels(FormulaEngine("A / B", threads=2).evaluate(input_layers, 2000))
+
+    expected_mask = (a_data != input_nodata_value) & (b_data != input_nodata_value) & (b_data != 0)
+    np.testing.assert_array_equal(result_mask, expected_mask)
+    np.testing.assert_allclose(result_data[expected_mask], a_data[expected_mask] / b_data[expected_mask])
+    assert np.all(result_data[~result_mask] == FormulaEngine.nodata_value)
+
+def test_where(input_layers, input_data, formula_module):
+    a_data, b_data = input_data
+    result_data, result_mask = read_pixels(
+        FormulaEngine("where(B > 0, A / B, 0)", threads=2).evaluate(input_layers, 2000))
+
+    expected_mask = (a_data != input_nodata_value) & (b_data != input_nodata_value)
+    np.testing.assert_array_equal(result_mask, expected_mask)
+    with np.errstate(all="ignore"):
+        expected_data = np.where(b_data > 0, a_data / b_data, 0)
+
+    np.testing.assert_allclose(result_data[expected_mask], expected_data[expected_mask])
+
+def test_missing_layer(input_layers):
+    with pytest.raises(ValueError):
+        FormulaEngine("A + C").evaluate(input_layers, 2000)
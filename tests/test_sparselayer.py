@@ -0,0 +1,96 @@
+import os
+import pytest
+
+gdal = pytest.importorskip("gdal")
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+
+from gcbmanimation.layer.layer import Layer
+from gcbmanimation.layer.sparselayer import SparseLayer
+from gcbmanimation.layer.boundingbox import BoundingBox
+from gcbmanimation.util.config import IOProfile
+from gcbmanimation.util.tempfile import TempFileManager
+
+# Sparse layers should give the same pixels as the dense operations they replace.
+
+sample_dir = os.path.join(os.path.dirname(__file__), "..", "sample_data", "sample_2", "input_layers")
+disturbance_years = (1990, 1991, 1992)
+
+@pytest.fixture(scope="module", autouse=True)
+def temp_dir():
+    TempFileManager.delete_on_exit()
+
+@pytest.fixture(scope="module")
+def bounding_box():
+    return BoundingBox(os.path.join(sample_dir, "bounding_box.tiff"))
+
+@pytest.fixture(scope="module")
+def dense_layers():
+    return [Layer(os.path.join(sample_dir, f"mpb{year}_moja.tiff"), year) for year in disturbance_years]
+
+@pytest.fixture(scope="module")
+def sparse_layers(dense_layers):
+    return SparseLayer.from_layers(dense_layers)
+
+def read_pixels(layer):
+    if isinstance(layer, SparseLayer):
+        layer = layer.to_dense()
+
+    band = gdal.Open(layer.path).GetRasterBand(1)
+    data = band.ReadAsArray()
+
+    return data, data != band.GetNoDataValue()
+
+def read_image(frame):
+    return np.array(Image.open(frame.path).convert("RGBA"))
+
+def assert_same_pixels(dense_layer, sparse_layer):
+    dense_data, dense_mask = read_pixels(dense_layer)
+    sparse_data, sparse_mask = read_pixels(sparse_layer)
+    assert dense_data.shape == sparse_data.shape
+    np.testing.assert_array_equal(dense_mask, sparse_mask)
+    np.testing.assert_array_equal(dense_data[dense_mask], sparse_data[sparse_mask])
+
+def assert_same_image(dense_frame, sparse_frame):
+    dense_image = read_image(dense_frame)
+    sparse_image = read_image(sparse_frame)
+    np.testing.assert_array_equal(dense_image[..., 3], sparse_image[..., 3])
+    visible = dense_image[..., 3] > 0
+    np.testing.assert_array_equal(dense_image[visible], sparse_image[visible])
+
+def test_encode(dense_layers, sparse_layers):
+    for dense_layer, sparse_layer in zip(dense_layers, sparse_layers):
+        assert_same_pixels(dense_layer, sparse_layer)
+
+def test_crop(bounding_box, dense_layers, sparse_layers):
+    for dense_layer, sparse_layer in zip(dense_layers, sparse_layers):
+        assert_same_pixels(bounding_box.crop(dense_layer), bounding_box.crop(sparse_layer))
+
+def test_merge(dense_layers, sparse_layers):
+    merged_path = TempFileManager.mktmp(suffix=".tif")
+    gdal.Warp(merged_path, [layer.path for layer in dense_layers],
+              creationOptions=IOProfile.Scratch.creation_options)
+
+    assert_same_pixels(Layer(merged_path, disturbance_years[0]), SparseLayer.merge(sparse_layers))
+
+def test_render_values(bounding_box, dense_layers, sparse_layers):
+    legend = {
+        1: {"color": (255, 0, 0)},
+        2: {"color": (0, 255, 0)},
+        3: {"color": (0, 0, 255)}
+    }
+
+    for dense_layer, sparse_layer in zip(dense_layers, sparse_layers):
+        assert_same_image(dense_layer.render(legend, bounding_box),
+                          sparse_layer.render(legend, bounding_box))
+
+def test_render_ranges(bounding_box, dense_layers, sparse_layers):
+    legend = {
+        (0.5, 1.5): {"color": (255, 0, 0)},
+        (1.5, 2.5): {"color": (0, 255, 0)},
+        (2.5, 3.5): {"color": (0, 0, 255)}
+    }
+
+    for dense_layer, sparse_layer in zip(dense_layers, sparse_layers):
+        assert_same_image(dense_layer.render(legend, bounding_box, value_scale=2),
+                          sparse_layer.render(legend, bounding_box, value_scale=2))
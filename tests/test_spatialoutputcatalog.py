@@ -0,0 +1,71 @@
+import os
+import shutil
+import pytest
+
+gdal = pytest.importorskip("gdal")
+
+from gcbmanimation.util.spatialoutputcatalog import SpatialOutputCatalog
+
+# The catalog should give the same results as globbing the directory, even as
+# files are added and removed between lookups.
+
+sample_dir = os.path.join(os.path.dirname(__file__), "..", "sample_data", "sample_2", "input_layers")
+
+@pytest.fixture(autouse=True)
+def sidecar(monkeypatch):
+    # Keep the index next to the test output rather than in the user's cache.
+    monkeypatch.setenv(SpatialOutputCatalog._sidecar_var, "1")
+
+@pytest.fixture
+def output_dir(tmp_path):
+    for year in (1990, 1991):
+        shutil.copy(os.path.join(sample_dir, f"mpb{year}_moja.tiff"), tmp_path / f"NPP_{year}.tiff")
+
+    return tmp_path
+
+def touch_dir(path):
+    # Directory timestamps may be too coarse to see changes made within the test.
+    dir_stat = os.stat(path)
+    os.utime(path, ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns + 10 ** 9))
+
+def find(output_dir, pattern="NPP_*.tiff"):
+    return SpatialOutputCatalog.find(os.path.join(str(output_dir), pattern))
+
+def test_find(output_dir):
+    assert find(output_dir) == [
+        (os.path.join(str(output_dir), "NPP_1990.tiff"), 1990),
+        (os.path.join(str(output_dir), "NPP_1991.tiff"), 1991)]
+
+    raster_info = SpatialOutputCatalog.get_raster_info(str(output_dir / "NPP_1990.tiff"))
+    raster = gdal.Open(str(output_dir / "NPP_1990.tiff"))
+    assert (raster_info["width"], raster_info["height"]) == (raster.RasterXSize, raster.RasterYSize)
+    assert raster_info["nodata"] == raster.GetRasterBand(1).GetNoDataValue()
+
+def test_rescan_added(output_dir):
+    find(output_dir)
+    shutil.copy(os.path.join(sample_dir, "mpb1992_moja.tiff"), output_dir / "NPP_1992.tiff")
+    touch_dir(output_dir)
+
+    assert [year for _, year in find(output_dir)] == [1990, 1991, 1992]
+
+def test_rescan_removed(output_dir):
+    find(output_dir)
+    os.remove(output_dir / "NPP_1990.tiff")
+    touch_dir(output_dir)
+
+    assert [year for _, year in find(output_dir)] == [1991]
+
+def test_reuse_index(output_dir, monkeypatch):
+    find(output_dir)
+    assert os.path.exists(output_dir / SpatialOutputCatalog.sidecar_name)
+
+    # A new catalog for the same directory only reads the files that have changed.
+    SpatialOutputCatalog._catalogs.pop(str(output_dir))
+    shutil.copy(os.path.join(sample_dir, "mpb1992_moja.tiff"), output_dir / "NPP_1992.tiff")
+    indexed_paths = []
+    original_index = SpatialOutputCatalog._index
+    monkeypatch.setattr(SpatialOutputCatalog, "_index",
+                        lambda self, path, file_stat: indexed_paths.append(path) or original_index(self, path, file_stat))
+
+    assert [year for _, year in find(output_dir)] == [1990, 1991, 1992]
+    assert indexed_paths == [os.path.join(str(output_dir), "NPP_1992.tiff")]